@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import load_script
+from stub_server import make_devices, make_groups, make_users
+
+# Per request latency of the stub console, the paginators are bound by round trips.
+LATENCIES = [0.0, 0.02]
+
+
+@pytest.mark.parametrize("latency", LATENCIES)
+def bench_devices_view(benchmark, stub_console, latency):
+    devices = load_script("res/devices.py")
+    console = stub_console({"/api/devices": make_devices(600)}, latency)
+    result = benchmark.pedantic(devices.view, args=(console.url, "token"), rounds=3)
+    assert len(result) == 600
+
+
+@pytest.mark.parametrize("latency", LATENCIES)
+def bench_users_view(benchmark, stub_console, latency):
+    users = load_script("res/users.py")
+    console = stub_console({"/api/users": make_users(600)}, latency)
+    result = benchmark.pedantic(users.view, args=(console.url, "token"), rounds=3)
+    assert len(result) == 600
+
+
+@pytest.mark.parametrize("latency", LATENCIES)
+def bench_user_groups_list(benchmark, stub_console, latency):
+    user_groups = load_script("res/user-groups.py")
+    console = stub_console({"/api/user-groups": make_groups(500)}, latency)
+    result = benchmark.pedantic(user_groups.list_groups, args=(console.url, "token"), rounds=3)
+    assert len(result) == 500
+
+
+@pytest.mark.parametrize("latency", LATENCIES)
+def bench_ab_view_peers(benchmark, stub_console, latency):
+    ab = load_script("res/ab.py")
+    peers = [{"id": str(100000000 + i), "alias": "peer%d" % i, "tags": ["t%d" % (i % 7)]} for i in range(600)]
+    console = stub_console({"/api/ab/peers": peers}, latency)
+    result = benchmark.pedantic(ab.view_ab_peers, args=(console.url, "token", "ab-guid"), rounds=3)
+    assert len(result) == 600
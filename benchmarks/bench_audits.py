@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import load_script
+
+
+def make_audits(audit_type, n):
+    rows = []
+    for i in range(n):
+        row = {"id": i, "created_at": 1735689600 + i * 60, "remote": str(100000000 + i)}
+        if audit_type == "conn":
+            row.update({"conn_type": i % 5, "end_time": 1735689600 + i * 60 + 30})
+        elif audit_type == "console":
+            row.update({"typ": i % 4, "iop": i % 23, "operator": "admin"})
+        elif audit_type == "alarm":
+            row.update({"typ": i % 6, "device": str(100000000 + i)})
+        rows.append(row)
+    return rows
+
+
+@pytest.mark.parametrize("audit_type", ["conn", "file", "console", "alarm"])
+def bench_enhance_audit_data(benchmark, audit_type):
+    audits = load_script("res/audits.py")
+    # 20 pages of 100 audits
+    pages = [make_audits(audit_type, 100) for _ in range(20)]
+
+    def run():
+        return [audits.enhance_audit_data(page, audit_type) for page in pages]
+
+    result = benchmark(run)
+    assert len(result) == 20
@@ -0,0 +1,38 @@
+import os
+import shutil
+
+import pytest
+
+from conftest import load_script
+
+
+@pytest.fixture
+def lang(root, tmp_path, monkeypatch):
+    lang = load_script("res/lang.py")
+    # lang.py works on ./src/lang, expand a copy of the real files.
+    shutil.copytree(os.path.join(root, "src", "lang"), tmp_path / "src" / "lang")
+    monkeypatch.chdir(tmp_path)
+    return lang
+
+
+def bench_lang_expand(benchmark, lang):
+    benchmark.pedantic(lang.expand, rounds=5)
+
+
+@pytest.mark.parametrize("cpus", [1, None], ids=["sequential", "process-pool"])
+def bench_lang_expand_all_changed(benchmark, lang, cpus, monkeypatch):
+    # Every language is rewritten: parse the template once, fill each language in
+    if cpus:
+        monkeypatch.setattr(lang.os, "cpu_count", lambda: cpus)
+    langs = lang.get_langs()
+
+    def dirty():
+        for name in langs:
+            with open("./src/lang/%s.rs" % name, "a", encoding="utf8") as f:
+                f.write("\n")
+
+    benchmark.pedantic(lang.expand, setup=dirty, rounds=5)
+
+
+def bench_lang_parse_template(benchmark, lang):
+    benchmark(lang.parse_template)
@@ -0,0 +1,57 @@
+import concurrent.futures
+
+import pytest
+import requests
+
+import limiter
+
+# The stub console serves CAPACITY requests in flight at LATENCY each, gets slower above that
+# and answers 429 above twice that. WORKERS threads hammer it, like a parallel admin script
+# with a large --jobs.
+CAPACITY = 6
+LATENCY = 0.02
+WORKERS = 48
+REQUESTS = 480
+
+
+def hammer(url):
+    statuses = []
+
+    def get(_):
+        return requests.get(f"{url}/api/users", params={"current": 1, "pageSize": 10}).status_code
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        statuses.extend(executor.map(get, range(REQUESTS)))
+    return statuses
+
+
+@pytest.fixture
+def installed():
+    yield
+    limiter.uninstall()
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+def bench_limiter_degrading_server(benchmark, stub_console, installed, adaptive):
+    console = stub_console({"/api/users": [{"guid": "u%d" % i, "name": "user%d" % i} for i in range(10)]},
+                           LATENCY, capacity=CAPACITY)
+    limiters = []
+
+    def run():
+        if adaptive:
+            limiters.append(limiter.install(limiter.AdaptiveLimiter(initial=2, max_limit=WORKERS)))
+        return hammer(console.url)
+
+    statuses = benchmark.pedantic(run, rounds=2)
+    throttled = statuses.count(429)
+    if not adaptive:
+        # Without the limiter a good share of the requests is rejected
+        assert throttled > REQUESTS // 10
+        return
+
+    stats = limiters[-1].stats()
+    benchmark.extra_info.update(stats)
+    # The window settles around the capacity of the server instead of the worker count
+    assert CAPACITY / 2 <= stats["window"] <= 2 * CAPACITY + 1
+    assert throttled < REQUESTS // 20
+    assert stats["p50_ms"] < 3 * LATENCY * 1000
@@ -0,0 +1,88 @@
+import os
+import random
+
+import pytest
+
+from conftest import load_script
+
+
+def make_tree(base, files, size):
+    # Flutter bundle like tree: a few large binaries, many small text assets.
+    rnd = random.Random(1)
+    words = [b"flutter", b"rustdesk", b"asset", b"icon", b"\n", b"{", b"}", b"0.5"]
+    for i in range(files):
+        subdir = os.path.join(base, "data", "flutter_assets", "assets%d" % (i % 5))
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, "file%d.bin" % i), "wb") as f:
+            if i % 10 == 0:
+                f.write(rnd.randbytes(size))
+            else:
+                f.write(b" ".join(rnd.choice(words) for _ in range(size // 8)))
+    with open(os.path.join(base, "rustdesk.exe"), "wb") as f:
+        f.write(rnd.randbytes(size * 4))
+
+
+@pytest.fixture
+def flutter_tree(tmp_path):
+    base = tmp_path / "rustdesk"
+    make_tree(str(base), 60, 32 * 1024)
+    return str(base)
+
+
+@pytest.mark.parametrize("level", [5, 11])
+def bench_generate_md5_table(benchmark, flutter_tree, tmp_path, monkeypatch, level):
+    generate = load_script("libs/portable/generate.py")
+    monkeypatch.chdir(tmp_path)
+    # generate_md5_table() doesn't restore the working directory, do it for every round.
+    def run():
+        try:
+            return generate.generate_md5_table(flutter_tree, level)
+        finally:
+            os.chdir(tmp_path)
+    table = benchmark.pedantic(run, rounds=3)
+    assert len(table) == 61
+
+
+def bench_write_package_metadata(benchmark, flutter_tree, tmp_path, monkeypatch):
+    generate = load_script("libs/portable/generate.py")
+    monkeypatch.chdir(tmp_path)
+    table = generate.generate_md5_table(flutter_tree, 5)
+    os.chdir(tmp_path)
+    out = tmp_path / "out"
+    out.mkdir()
+    benchmark(generate.write_package_metadata, table, str(out), "./rustdesk.exe")
+    assert (out / "data.bin").exists()
+
+
+def bench_md5_file_folder(benchmark, tmp_path, monkeypatch):
+    build = load_script("build.py")
+    monkeypatch.chdir(tmp_path)
+    make_tree(str(tmp_path / "tmpdeb" / "usr" / "share" / "rustdesk"), 40, 8 * 1024)
+    (tmp_path / "tmpdeb" / "DEBIAN").mkdir()
+    md5sums = tmp_path / "tmpdeb" / "DEBIAN" / "md5sums"
+
+    def setup():
+        if md5sums.exists():
+            md5sums.unlink()
+
+    benchmark.pedantic(build.md5_file_folder, args=("tmpdeb",), setup=setup, rounds=5)
+    assert len(md5sums.read_text().splitlines()) == 41
+
+
+# A real Flutter dist dir is a few hundred files, 10k shows how the walk and the GUID lookups scale.
+@pytest.mark.parametrize("files", [400, pytest.param(10000, marks=pytest.mark.slow)])
+def bench_insert_components_between_tags(benchmark, tmp_path, files):
+    preprocess = load_script("res/msi/preprocess.py")
+    dist_dir = tmp_path / "rustdesk"
+    make_tree(str(dist_dir), files, 256)
+    rounds = []
+
+    def setup():
+        # Include the dist dir walk, it is cached per process.
+        preprocess.g_dist_scans.clear()
+        rounds.append(["<!--$AutoComonentStart-->\n", "<!--$AutoComonentEnd-->\n"])
+        return (rounds[-1], 0, "RustDesk", dist_dir), {}
+
+    benchmark.pedantic(preprocess.insert_components_between_tags, setup=setup, rounds=10 if files < 1000 else 3)
+    # One component per file, except rustdesk.exe
+    assert len(rounds[-1]) == files + 2
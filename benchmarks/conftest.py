@@ -0,0 +1,44 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The scripts import their shared modules (limiter.py, snapshot.py) from res/.
+sys.path.insert(0, os.path.join(ROOT, "res"))
+
+from stub_server import StubConsole  # noqa: E402
+
+
+def load_script(path):
+    # The tools are standalone scripts (some with dashes in their names), load them by path.
+    full_path = os.path.join(ROOT, path)
+    name = "bench_" + os.path.splitext(path)[0].replace("/", "_").replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, full_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def root():
+    return ROOT
+
+
+@pytest.fixture
+def stub_console():
+    consoles = []
+
+    def start(data, latency=0.0, **options):
+        console = StubConsole(data, latency, **options).start()
+        consoles.append(console)
+        return console
+
+    yield start
+    for console in consoles:
+        console.stop()
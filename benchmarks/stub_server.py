@@ -0,0 +1,183 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Minimal stand-in for the console API used by the scripts in res/.
+# List endpoints are paged with `current`/`pageSize` like the real server, every
+# request sleeps `latency` seconds first. With `etags`, GET responses carry an ETag and
+# If-None-Match is answered with 304. With `capacity`, the server degrades under load like
+# an overloaded console: above `capacity` requests in flight the latency grows with the
+# load, above twice the capacity requests are rejected with 429.
+class StubConsole:
+    def __init__(self, data=None, latency=0.0, etags=False, capacity=None):
+        # path -> list of rows, e.g. {"/api/devices": [...]}
+        self.data = data or {}
+        self.latency = latency
+        self.etags = etags
+        self.capacity = capacity
+        self.inflight = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def start(self):
+        console = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                console.handle(self, "GET")
+
+            def do_POST(self):
+                console.handle(self, "POST")
+
+            def do_PUT(self):
+                console.handle(self, "PUT")
+
+            def do_PATCH(self):
+                console.handle(self, "PATCH")
+
+            def do_DELETE(self):
+                console.handle(self, "DELETE")
+
+        class Server(ThreadingHTTPServer):
+            # The default backlog of 5 drops connections of parallel clients.
+            request_queue_size = 128
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method):
+        with self.lock:
+            self.inflight += 1
+            inflight = self.inflight
+        try:
+            self.serve(handler, method, inflight)
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+    def serve(self, handler, method, inflight):
+        url = urlparse(handler.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        if self.capacity and inflight > 2 * self.capacity:
+            self.send(handler, 429, {"error": "too many requests"})
+            return
+        if self.latency:
+            time.sleep(self.latency * max(1.0, inflight / self.capacity) if self.capacity else self.latency)
+        with self.lock:
+            self.requests.append((method, url.path, query, body))
+        status, payload = self.respond(method, url.path, query, body)
+        content = json.dumps(payload).encode("utf-8")
+        etag = None
+        if self.etags and method == "GET" and status == 200:
+            etag = '"%s"' % hashlib.sha1(content).hexdigest()
+            if handler.headers.get("If-None-Match") == etag:
+                handler.send_response(304)
+                handler.send_header("ETag", etag)
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+        self.send(handler, status, payload, content, etag)
+
+    def send(self, handler, status, payload, content=None, etag=None):
+        content = content if content is not None else json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        if etag:
+            handler.send_header("ETag", etag)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def respond(self, method, path, query, body):
+        if method != "GET":
+            return self.change(method, path, body)
+        if path not in self.data:
+            return 404, {"error": "not found: %s" % path}
+        rows = self.data[path]
+        if "pageSize" not in query:
+            return 200, rows
+        page_size = int(query["pageSize"])
+        current = int(query.get("current", 1))
+        page = rows[(current - 1) * page_size:current * page_size]
+        return 200, {"data": page, "total": len(rows)}
+
+
+    def change(self, method, path, body):
+        # Creating, updating and deleting rows of the list endpoints, e.g. POST /api/user-groups
+        # or PATCH /api/user-groups/<guid>. Anything else just succeeds.
+        payload = json.loads(body) if body else None
+        with self.lock:
+            if method == "POST" and path in self.data and isinstance(payload, dict):
+                self.data[path].append(dict(payload, guid="created-%d" % len(self.requests)))
+                return 200, {}
+            parent, _, guid = path.rpartition("/")
+            rows = self.data.get(parent)
+            if rows is not None and method in ("PATCH", "DELETE"):
+                for i, row in enumerate(rows):
+                    if row.get("guid") == guid:
+                        if method == "DELETE":
+                            del rows[i]
+                        else:
+                            row.update(payload or {})
+                        return 200, {}
+                return 200, {"error": "not found: %s" % guid}
+        return 200, {}
+
+
+def make_devices(n):
+    return [
+        {
+            "guid": "00000000-0000-0000-0000-%012d" % i,
+            "id": str(100000000 + i),
+            "info": {"device_name": "device-%d" % i, "os": "windows", "username": "user%d" % (i % 50)},
+            "user_name": "user%d" % (i % 50),
+            "device_group_name": "group%d" % (i % 10),
+            "last_online": "2025-01-%02dT10:00:00.000" % (i % 28 + 1),
+            "status": 1,
+            "note": "",
+        }
+        for i in range(n)
+    ]
+
+
+def make_users(n):
+    return [
+        {
+            "guid": "10000000-0000-0000-0000-%012d" % i,
+            "name": "user%d" % i,
+            "email": "user%d@example.com" % i,
+            "group_name": "group%d" % (i % 10),
+            "status": 1,
+            "note": "",
+        }
+        for i in range(n)
+    ]
+
+
+def make_groups(n):
+    return [
+        {"guid": "20000000-0000-0000-0000-%012d" % i, "name": "group%d" % i, "note": ""}
+        for i in range(n)
+    ]
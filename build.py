@@ -45,6 +45,21 @@ def system2(cmd):
         sys.exit(-1)
 
 
+def inline_sciter_outdated(mode):
+    # inline-sciter.py only rewrites changed bundles, skip even starting it if
+    # src/ui/inline.rs is newer than every sciter source and the script itself.
+    output = 'src/ui/inline.rs'
+    if not os.path.exists(output):
+        return True
+    with open(output, encoding='utf-8') as fh:
+        if f'({mode})' not in fh.readline():
+            return True
+    built = os.path.getmtime(output)
+    inputs = [str(p) for p in Path('src/ui').glob('*.*') if p.suffix in ('.html', '.css', '.tis')]
+    inputs.append('res/inline-sciter.py')
+    return any(os.path.getmtime(p) > built for p in inputs)
+
+
 def get_version():
     with open("Cargo.toml", encoding="utf-8") as fh:
         for line in fh:
@@ -119,6 +134,11 @@ def make_parser():
         action='store_true',
         help='Enable feature vram, only available on windows now.'
     )
+    parser.add_argument(
+        '--inline-brotli',
+        action='store_true',
+        help='Embed the sciter UI brotli compressed, needs `pip3 install brotli`'
+    )
     parser.add_argument(
         '--portable',
         action='store_true',
@@ -273,6 +293,8 @@ def external_resources(flutter, args, res_dir):
 
 def get_features(args):
     features = ['inline'] if not args.flutter else []
+    if args.inline_brotli and not args.flutter:
+        features = ['inline-brotli']
     if args.hwcodec:
         features.append('hwcodec')
     if args.vram:
@@ -475,7 +497,9 @@ def main():
     features = ','.join(get_features(args))
     flutter = args.flutter
     if not flutter:
-        system2('python3 res/inline-sciter.py')
+        inline_mode = 'brotli' if args.inline_brotli else 'plain'
+        if inline_sciter_outdated(inline_mode):
+            system2('python3 res/inline-sciter.py' + (' --brotli' if args.inline_brotli else ''))
     print(args.skip_cargo)
     if args.skip_cargo:
         skip_cargo = True
@@ -4,217 +4,380 @@ import sys
 import argparse
 import re
 import shutil
+import filecmp
+import hashlib
+import subprocess
+import json
+import time
+import concurrent.futures
+import urllib.error
 import urllib.request
 
-def modify_config_rs(project_root, server_url, server_key, app_name):
-    file_path = os.path.join(project_root, 'libs/hbb_common/src/config.rs')
-    if not os.path.exists(file_path):
-        print(f"Error: {file_path} not found.")
-        return
+CONFIG_RS = 'libs/hbb_common/src/config.rs'
+RUNNER_RC = 'flutter/windows/runner/Runner.rc'
+PUBSPEC_YAML = 'flutter/pubspec.yaml'
+CARGO_TOMLS = ['Cargo.toml', 'libs/portable/Cargo.toml']
+BUILD_PY = 'build.py'
+PORTABLE_GENERATE_PY = 'libs/portable/generate.py'
+MAIN_CPP = 'flutter/windows/runner/main.cpp'
+MAIN_DART = 'flutter/lib/main.dart'
+
+# Map source in custom_resources to destination
+RESOURCE_MAP = {
+    'icon.ico': ['res/icon.ico', 'flutter/windows/runner/resources/app_icon.ico'],
+    'logo.svg': ['res/logo.svg'],
+    'tray-icon.ico': ['res/tray-icon.ico'],
+    'icon.png': ['res/icon.png'], # Used for flutter icons generation
+    'logo.png': ['flutter/assets/logo.png'] # Used for app logo in UI
+}
+
+# ETag/Last-Modified of downloaded resources, stored in custom_resources
+DOWNLOAD_CACHE_FILE = '.download_cache.json'
+# Fingerprint of the last customization and the hashes of the files it produced
+STATE_FILE = '.customize_state.json'
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_WORKERS = 5
+
+# Patterns are compiled once and shared by every variant customized in this process.
+RE_RENDEZVOUS_SERVERS = re.compile(r'pub\s+const\s+RENDEZVOUS_SERVERS\s*:\s*&\[&str\]\s*=\s*&\[".*?"\];')
+RE_PROD_RENDEZVOUS_SERVER = re.compile(r'pub\s+static\s+ref\s+PROD_RENDEZVOUS_SERVER\s*:\s*RwLock<String>\s*=\s*RwLock::new\(".*?"\.to_owned\(\)\);')
+RE_RS_PUB_KEY = re.compile(r'pub\s+const\s+RS_PUB_KEY\s*:\s*&str\s*=\s*".*?";')
+RE_APP_NAME = re.compile(r'pub\s+static\s+ref\s+APP_NAME\s*:\s*RwLock<String>\s*=\s*RwLock::new\(".*?"\.to_owned\(\)\);')
+# Pattern: pub static ref DEFAULT_SETTINGS: RwLock<HashMap<String, String>> = Default::default();
+RE_DEFAULT_SETTINGS = re.compile(r'pub\s+static\s+ref\s+DEFAULT_SETTINGS\s*:\s*RwLock<HashMap<String,\s*String>>\s*=\s*Default::default\(\);')
+# Pattern: pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = Default::default();
+RE_HARD_SETTINGS = re.compile(r'pub\s+static\s+ref\s+HARD_SETTINGS\s*:\s*RwLock<HashMap<String,\s*String>>\s*=\s*Default::default\(\);')
+RE_RC_PRODUCT_NAME = re.compile(r'VALUE "ProductName", ".*?"')
+RE_RC_FILE_DESCRIPTION = re.compile(r'VALUE "FileDescription", ".*?"')
+RE_RC_LEGAL_COPYRIGHT = re.compile(r'VALUE "LegalCopyright", ".*?"')
+RE_RC_COMPANY_NAME = re.compile(r'VALUE "CompanyName", ".*?"')
+RE_PUBSPEC_DESCRIPTION = re.compile(r'description: .*')
+RE_CARGO_DESCRIPTION = re.compile(r'description = ".*?"')
+RE_CARGO_PRODUCT_NAME = re.compile(r'ProductName = ".*?"')
+RE_CARGO_FILE_DESCRIPTION = re.compile(r'FileDescription = ".*?"')
+RE_CARGO_ORIGINAL_FILENAME = re.compile(r'OriginalFilename = ".*?"')
+
+RE_VERIFY_RENDEZVOUS_SERVERS = re.compile(r'pub const RENDEZVOUS_SERVERS: &\[&str\] = &\[".*?"\];')
+RE_VERIFY_PROD_RENDEZVOUS_SERVER = re.compile(r'pub static ref PROD_RENDEZVOUS_SERVER: RwLock<String> = RwLock::new\(".*?"\.to_owned\(\)\);')
+RE_VERIFY_RS_PUB_KEY = re.compile(r'pub const RS_PUB_KEY: &str = ".*?";')
+RE_VERIFY_DEFAULT_SETTINGS = re.compile(r'pub static ref DEFAULT_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new\(HashMap::from\(\[\s*\("api-server"\.to_owned\(\), ".*?"\.to_owned\(\)\)\s*\]\)\);', re.DOTALL)
+RE_VERIFY_HARD_SETTINGS = re.compile(r'pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new\(HashMap::from\(\[\s*\("password"\.to_owned\(\), ".*?"\.to_owned\(\)\)\s*\]\)\);', re.DOTALL)
+RE_VERIFY_PASSWORD_VALUE = re.compile(r'(\("password"\.to_owned\(\), )".*?"')
+
+
+class RewritePlan:
+    """Edits grouped by file. apply() reads and writes each file once, in the order
+    the files were first edited, and keeps the results in memory for verification."""
+
+    def __init__(self, project_root, base_rev=None):
+        self.project_root = project_root
+        # Read the original content from this git revision instead of the working tree, so
+        # an already customized tree can be customized again.
+        self.base_rev = base_rev
+        # path relative to project_root -> [(edit, label)], edit(content) -> (content, count)
+        self.edits = {}
+        self.optional = set()
+        self.contents = {}
+        self.written = []
+
+    def add(self, rel_path, edit, label=None, optional=False):
+        self.edits.setdefault(rel_path, []).append((edit, label))
+        if optional:
+            self.optional.add(rel_path)
+
+    def sub(self, rel_path, pattern, replacement, label=None, optional=False):
+        # A function replacement keeps backslashes in user values literal.
+        self.add(rel_path, lambda content: pattern.subn(lambda _: replacement, content), label, optional)
+
+    def replace(self, rel_path, old, new, label=None, optional=False):
+        self.add(rel_path, lambda content: (content.replace(old, new), content.count(old)), label, optional)
+
+    def apply(self):
+        for rel_path, edits in self.edits.items():
+            file_path = os.path.join(self.project_root, rel_path)
+            if not os.path.exists(file_path):
+                if rel_path in self.optional:
+                    print(f"Warning: {file_path} not found.")
+                else:
+                    print(f"Error: {file_path} not found.")
+                continue
+
+            with open(file_path, 'r', encoding='utf-8') as f:
+                current = f.read()
+            content = current
+            if self.base_rev:
+                content = self.read_base(file_path)
+
+            for edit, label in edits:
+                content, count = edit(content)
+                if label:
+                    if count == 0:
+                        print(f"Warning: {label} not found or not replaced.")
+                    else:
+                        print(f"{label} replaced.")
+
+            # Only write changed files, so unchanged ones keep their mtime and cargo/flutter
+            # incremental builds are not invalidated.
+            if content != current:
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                self.written.append(rel_path)
+            self.contents[rel_path] = content
+        print(f"Rewrote {len(self.written)} of {len(self.contents)} files: {', '.join(self.written) or 'none'}")
+
+    def read_base(self, file_path):
+        # Run git in the file's directory, so files of submodules (config.rs) work too.
+        return subprocess.check_output(
+            ['git', 'show', f'{self.base_rev}:./{os.path.basename(file_path)}'],
+            cwd=os.path.dirname(file_path),
+        ).decode('utf-8')
+
+    def content(self, rel_path):
+        if rel_path in self.contents:
+            return self.contents[rel_path]
+        file_path = os.path.join(self.project_root, rel_path)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+def file_sha256(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+def customize_fingerprint(args, permanent_password):
+    # Everything which affects the generated content: the arguments, the password and this script.
+    values = {k: v for k, v in vars(args).items() if k not in ('force', 'permanent_password')}
+    values['permanent_password'] = hashlib.sha256((permanent_password or '').encode('utf-8')).hexdigest()
+    values['script'] = file_sha256(os.path.abspath(__file__))
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
 
+def load_state(project_root):
+    state_path = os.path.join(project_root, STATE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def is_state_current(project_root, state, fingerprint):
+    # Up to date if the same arguments were applied and no customized file changed since.
+    if state.get('fingerprint') != fingerprint:
+        return False
+    for rel_path, digest in state.get('files', {}).items():
+        file_path = os.path.join(project_root, rel_path)
+        if not os.path.exists(file_path) or file_sha256(file_path) != digest:
+            return False
+    return True
+
+def save_state(project_root, fingerprint, rel_paths):
+    files = {}
+    for rel_path in rel_paths:
+        file_path = os.path.join(project_root, rel_path)
+        if os.path.exists(file_path):
+            files[rel_path] = file_sha256(file_path)
+    state = {'fingerprint': fingerprint, 'files': files}
+    if state == load_state(project_root):
+        return
+    atomic_write(os.path.join(project_root, STATE_FILE), json.dumps(state, indent=2, sort_keys=True).encode('utf-8'))
+
+def modify_config_rs(plan, server_url, server_key, app_name):
     if server_url:
         # Sanitize server_url: remove http:// or https:// for rendezvous servers
         sanitized_url = server_url.replace("http://", "").replace("https://", "")
         print(f"Updating RENDEZVOUS_SERVERS to {sanitized_url}")
         # Replace RENDEZVOUS_SERVERS
-        pattern_servers = r'pub\s+const\s+RENDEZVOUS_SERVERS\s*:\s*&\[&str\]\s*=\s*&\[".*?"\];'
         replacement_servers = f'pub const RENDEZVOUS_SERVERS: &[&str] = &["{sanitized_url}"];'
-        content, count = re.subn(pattern_servers, replacement_servers, content)
-        if count == 0:
-            print("Warning: RENDEZVOUS_SERVERS not found or not replaced.")
-        else:
-            print("RENDEZVOUS_SERVERS replaced.")
+        plan.sub(CONFIG_RS, RE_RENDEZVOUS_SERVERS, replacement_servers, "RENDEZVOUS_SERVERS")
 
         # Replace PROD_RENDEZVOUS_SERVER
         print(f"Updating PROD_RENDEZVOUS_SERVER to {sanitized_url}")
-        pattern_prod = r'pub\s+static\s+ref\s+PROD_RENDEZVOUS_SERVER\s*:\s*RwLock<String>\s*=\s*RwLock::new\(".*?"\.to_owned\(\)\);'
         replacement_prod = f'pub static ref PROD_RENDEZVOUS_SERVER: RwLock<String> = RwLock::new("{sanitized_url}".to_owned());'
-        content, count = re.subn(pattern_prod, replacement_prod, content)
-        if count == 0:
-            print("Warning: PROD_RENDEZVOUS_SERVER not found or not replaced.")
-        else:
-            print("PROD_RENDEZVOUS_SERVER replaced.")
+        plan.sub(CONFIG_RS, RE_PROD_RENDEZVOUS_SERVER, replacement_prod, "PROD_RENDEZVOUS_SERVER")
 
     if server_key:
         print(f"Updating RS_PUB_KEY")
         # Replace RS_PUB_KEY
-        pattern_key = r'pub\s+const\s+RS_PUB_KEY\s*:\s*&str\s*=\s*".*?";'
         replacement_key = f'pub const RS_PUB_KEY: &str = "{server_key}";'
-        content, count = re.subn(pattern_key, replacement_key, content)
-        if count == 0:
-            print("Warning: RS_PUB_KEY not found or not replaced.")
-        else:
-            print("RS_PUB_KEY replaced.")
+        plan.sub(CONFIG_RS, RE_RS_PUB_KEY, replacement_key, "RS_PUB_KEY")
 
     if app_name:
         print(f"Updating APP_NAME to {app_name}")
         # Replace APP_NAME
-        pattern_app_name = r'pub\s+static\s+ref\s+APP_NAME\s*:\s*RwLock<String>\s*=\s*RwLock::new\(".*?"\.to_owned\(\)\);'
         replacement_app_name = f'pub static ref APP_NAME: RwLock<String> = RwLock::new("{app_name}".to_owned());'
-        content, count = re.subn(pattern_app_name, replacement_app_name, content)
-        if count == 0:
-            print("Warning: APP_NAME not found or not replaced.")
-        else:
-            print("APP_NAME replaced.")
+        plan.sub(CONFIG_RS, RE_APP_NAME, replacement_app_name, "APP_NAME")
 
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def modify_default_settings(project_root, api_server, theme):
+def modify_default_settings(plan, api_server, theme):
     if not api_server and not theme:
         return
 
-    file_path = os.path.join(project_root, 'libs/hbb_common/src/config.rs')
-    if not os.path.exists(file_path):
-        print(f"Error: {file_path} not found.")
-        return
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
     print(f"Updating DEFAULT_SETTINGS with api-server: {api_server}, theme: {theme}")
-    # Replace DEFAULT_SETTINGS
-    # Pattern: pub static ref DEFAULT_SETTINGS: RwLock<HashMap<String, String>> = Default::default();
-    pattern_settings = r'pub\s+static\s+ref\s+DEFAULT_SETTINGS\s*:\s*RwLock<HashMap<String,\s*String>>\s*=\s*Default::default\(\);'
-    
     # Build the HashMap entries
     entries = []
     if api_server:
         entries.append(f'("api-server".to_owned(), "{api_server}".to_owned())')
     if theme:
         entries.append(f'("theme".to_owned(), "{theme}".to_owned())')
-    
+
     entries_str = ",\n        ".join(entries)
-    
+
     # We use RwLock::new(HashMap::from([...])) to initialize
     replacement_settings = (
         'pub static ref DEFAULT_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new(HashMap::from([\n'
         f'        {entries_str}\n'
         '    ]));'
     )
-    
-    content, count = re.subn(pattern_settings, replacement_settings, content)
-    if count == 0:
-        print("Warning: DEFAULT_SETTINGS not found or not replaced.")
-    else:
-        print("DEFAULT_SETTINGS replaced.")
-
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def modify_runner_rc(project_root, app_name):
-    file_path = os.path.join(project_root, 'flutter/windows/runner/Runner.rc')
-    if not os.path.exists(file_path):
-        print(f"Error: {file_path} not found.")
-        return
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    plan.sub(CONFIG_RS, RE_DEFAULT_SETTINGS, replacement_settings, "DEFAULT_SETTINGS")
 
+def modify_runner_rc(plan, app_name):
     if app_name:
         print(f"Updating Runner.rc with App Name: {app_name}")
         # Update ProductName
-        content = re.sub(r'VALUE "ProductName", ".*?"', f'VALUE "ProductName", "{app_name}"', content)
+        plan.sub(RUNNER_RC, RE_RC_PRODUCT_NAME, f'VALUE "ProductName", "{app_name}"')
         # Update FileDescription
-        content = re.sub(r'VALUE "FileDescription", ".*?"', f'VALUE "FileDescription", "{app_name}"', content)
+        plan.sub(RUNNER_RC, RE_RC_FILE_DESCRIPTION, f'VALUE "FileDescription", "{app_name}"')
         # Update LegalCopyright (Generic)
-        content = re.sub(r'VALUE "LegalCopyright", ".*?"', f'VALUE "LegalCopyright", "Copyright © {app_name}"', content)
+        plan.sub(RUNNER_RC, RE_RC_LEGAL_COPYRIGHT, f'VALUE "LegalCopyright", "Copyright © {app_name}"')
         # Update CompanyName (Generic)
-        content = re.sub(r'VALUE "CompanyName", ".*?"', f'VALUE "CompanyName", "{app_name}"', content)
-
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def modify_pubspec_yaml(project_root, app_name):
-    file_path = os.path.join(project_root, 'flutter/pubspec.yaml')
-    if not os.path.exists(file_path):
-        print(f"Error: {file_path} not found.")
-        return
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+        plan.sub(RUNNER_RC, RE_RC_COMPANY_NAME, f'VALUE "CompanyName", "{app_name}"')
 
+def modify_pubspec_yaml(plan, app_name):
     if app_name:
         print(f"Updating pubspec.yaml description")
         # Update description
-        content = re.sub(r'description: .*', f'description: {app_name} Remote Desktop', content)
-
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def modify_cargo_toml(project_root, app_name):
-    cargo_files = [
-        os.path.join(project_root, 'Cargo.toml'),
-        os.path.join(project_root, 'libs/portable/Cargo.toml')
-    ]
-    
-    for file_path in cargo_files:
-        if not os.path.exists(file_path):
-            print(f"Warning: {file_path} not found.")
-            continue
-            
-        print(f"Updating {file_path} with App Name: {app_name}")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
+        plan.sub(PUBSPEC_YAML, RE_PUBSPEC_DESCRIPTION, f'description: {app_name} Remote Desktop')
+
+def modify_cargo_toml(plan, app_name):
+    for rel_path in CARGO_TOMLS:
+        print(f"Updating {os.path.join(plan.project_root, rel_path)} with App Name: {app_name}")
         # Update description
-        content = re.sub(r'description = ".*?"', f'description = "{app_name}"', content)
+        plan.sub(rel_path, RE_CARGO_DESCRIPTION, f'description = "{app_name}"', optional=True)
         # Update ProductName (if present in win-res metadata or similar comments/fields)
-        content = re.sub(r'ProductName = ".*?"', f'ProductName = "{app_name}"', content)
+        plan.sub(rel_path, RE_CARGO_PRODUCT_NAME, f'ProductName = "{app_name}"', optional=True)
         # Update FileDescription
-        content = re.sub(r'FileDescription = ".*?"', f'FileDescription = "{app_name}"', content)
+        plan.sub(rel_path, RE_CARGO_FILE_DESCRIPTION, f'FileDescription = "{app_name}"', optional=True)
         # Update OriginalFilename
-        content = re.sub(r'OriginalFilename = ".*?"', f'OriginalFilename = "{app_name}.exe"', content)
-        
+        plan.sub(rel_path, RE_CARGO_ORIGINAL_FILENAME, f'OriginalFilename = "{app_name}.exe"', optional=True)
+
         # Also try to update the [[bin]] name if possible, but that might break build scripts
         # So we stick to metadata for now.
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
 
-def download_resource(url, dest_path):
-    if not url:
-        return
-    
-    print(f"Downloading {os.path.basename(dest_path)} from {url}...")
+def load_download_cache(custom_res_dir):
+    cache_path = os.path.join(custom_res_dir, DOWNLOAD_CACHE_FILE)
+    if not os.path.exists(cache_path):
+        return {}
     try:
-        urllib.request.urlretrieve(url, dest_path)
-        print(f"Downloaded {os.path.basename(dest_path)}")
-    except Exception as e:
-        print(f"Failed to download {url}: {e}")
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring invalid download cache {cache_path}: {e}")
+        return {}
+
+def atomic_write(dest_path, data):
+    # Write to a temporary file in the same directory and rename it over the target,
+    # so an interrupted download never leaves a truncated resource behind.
+    # Created like open() does (0666 minus the umask), mkstemp would make it 0600.
+    tmp_path = os.path.join(os.path.dirname(dest_path), f'.tmp-{os.urandom(8).hex()}')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def download_resource(url, dest_path, cache_entry=None, max_age=0):
+    """Download url to dest_path, revalidating a cached copy with ETag/Last-Modified.
+
+    Returns (status, cache_entry), status is 'downloaded', 'not-modified' or 'cached'.
+    A cached copy younger than max_age seconds (or any cached copy if max_age < 0)
+    is used without touching the network.
+    """
+    cached = bool(cache_entry) and cache_entry.get('url') == url and os.path.exists(dest_path)
+    if cached:
+        age = time.time() - cache_entry.get('checked', 0)
+        if max_age < 0 or age < max_age:
+            return 'cached', cache_entry
+
+    request = urllib.request.Request(url)
+    if cached:
+        if cache_entry.get('etag'):
+            request.add_header('If-None-Match', cache_entry['etag'])
+        if cache_entry.get('last_modified'):
+            request.add_header('If-Modified-Since', cache_entry['last_modified'])
+    try:
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            data = response.read()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    except urllib.error.HTTPError as e:
+        if cached and e.code == 304:
+            return 'not-modified', dict(cache_entry, checked=time.time())
+        raise
+
+    atomic_write(dest_path, data)
+    return 'downloaded', {
+        'url': url,
+        'etag': etag,
+        'last_modified': last_modified,
+        'size': len(data),
+        'checked': time.time(),
+    }
 
-def modify_hard_settings(project_root, password):
+def download_resources(downloads, custom_res_dir, strict=False, max_age=0, workers=DOWNLOAD_WORKERS):
+    """Fetch {file name: url} into custom_res_dir concurrently.
+
+    Returns False if any download failed. With strict, a failure exits the script
+    instead of silently keeping the previous (or default) resource.
+    """
+    downloads = {name: url for name, url in downloads.items() if url}
+    if not downloads:
+        return True
+
+    cache = load_download_cache(custom_res_dir)
+    failures = []
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_resource, url, os.path.join(custom_res_dir, name), cache.get(name), max_age): (name, url)
+            for name, url in downloads.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name, url = futures[future]
+            try:
+                status, entry = future.result()
+            except Exception as e:
+                print(f"Failed to download {url}: {e}")
+                failures.append(name)
+                continue
+            cache[name] = entry
+            print(f"{name}: {status} ({url})")
+
+    cache_path = os.path.join(custom_res_dir, DOWNLOAD_CACHE_FILE)
+    atomic_write(cache_path, json.dumps(cache, indent=2, sort_keys=True).encode('utf-8'))
+    print(f"Fetched {len(downloads)} resources in {time.time() - start:.2f}s, {len(failures)} failed")
+
+    if failures and strict:
+        print(f"Error: failed to download {', '.join(sorted(failures))}")
+        sys.exit(1)
+    return not failures
+
+def modify_hard_settings(plan, password):
     if not password:
         return
 
-    file_path = os.path.join(project_root, 'libs/hbb_common/src/config.rs')
-    if not os.path.exists(file_path):
-        print(f"Error: {file_path} not found.")
-        return
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
     print(f"Updating HARD_SETTINGS with permanent password")
-    # Replace HARD_SETTINGS
-    # Pattern: pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = Default::default();
-    pattern_settings = r'pub\s+static\s+ref\s+HARD_SETTINGS\s*:\s*RwLock<HashMap<String,\s*String>>\s*=\s*Default::default\(\);'
-    
     # We use RwLock::new(HashMap::from([...])) to initialize with password
     replacement_settings = (
         'pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new(HashMap::from([\n'
         f'        ("password".to_owned(), "{password}".to_owned())\n'
         '    ]));'
     )
-    
-    content, count = re.subn(pattern_settings, replacement_settings, content)
-    if count == 0:
-        print("Warning: HARD_SETTINGS not found or not replaced.")
-    else:
-        print("HARD_SETTINGS replaced.")
+    plan.sub(CONFIG_RS, RE_HARD_SETTINGS, replacement_settings, "HARD_SETTINGS")
 
     # Force get_permanent_password to use HARD_SETTINGS
     print("Updating get_permanent_password to prioritize HARD_SETTINGS")
@@ -229,7 +392,7 @@ def modify_hard_settings(project_root, password):
         '        password\n'
         '    }'
     )
-    
+
     replacement_fn = (
         '    pub fn get_permanent_password() -> String {\n'
         '        if let Some(v) = HARD_SETTINGS.read().unwrap().get("password") {\n'
@@ -238,203 +401,156 @@ def modify_hard_settings(project_root, password):
         '        CONFIG.read().unwrap().password.clone()\n'
         '    }'
     )
-    
-    if target_fn in content:
-        content = content.replace(target_fn, replacement_fn)
-        print("get_permanent_password updated.")
-    else:
-        print("Warning: get_permanent_password function body not found (exact match failed).")
+    plan.replace(CONFIG_RS, target_fn, replacement_fn, "get_permanent_password")
 
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def verify_changes(project_root, app_name, server_url):
+def verify_changes(plan, app_name, server_url):
+    # Verify against the in-memory result of the plan instead of reading the files again.
     print("-" * 30)
     print("Verifying Changes in config.rs:")
-    file_path = os.path.join(project_root, 'libs/hbb_common/src/config.rs')
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            
+    file_path = os.path.join(plan.project_root, CONFIG_RS)
+    content = plan.content(CONFIG_RS)
+    if content is not None:
         # Extract and print relevant lines
-        rendezvous = re.search(r'pub const RENDEZVOUS_SERVERS: &\[&str\] = &\[".*?"\];', content)
+        rendezvous = RE_VERIFY_RENDEZVOUS_SERVERS.search(content)
         if rendezvous:
             print(f"  {rendezvous.group(0)}")
-            
-        prod_server = re.search(r'pub static ref PROD_RENDEZVOUS_SERVER: RwLock<String> = RwLock::new\(".*?"\.to_owned\(\)\);', content)
+
+        prod_server = RE_VERIFY_PROD_RENDEZVOUS_SERVER.search(content)
         if prod_server:
             print(f"  {prod_server.group(0)}")
 
-        rs_pub_key = re.search(r'pub const RS_PUB_KEY: &str = ".*?";', content)
+        rs_pub_key = RE_VERIFY_RS_PUB_KEY.search(content)
         if rs_pub_key:
             print(f"  {rs_pub_key.group(0)}")
 
-        default_settings = re.search(r'pub static ref DEFAULT_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new\(HashMap::from\(\[\s*\("api-server"\.to_owned\(\), ".*?"\.to_owned\(\)\)\s*\]\)\);', content, re.DOTALL)
+        default_settings = RE_VERIFY_DEFAULT_SETTINGS.search(content)
         if default_settings:
             print("  DEFAULT_SETTINGS updated with api-server.")
             print(f"  {default_settings.group(0)}")
 
-        hard_settings = re.search(r'pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = RwLock::new\(HashMap::from\(\[\s*\("password"\.to_owned\(\), ".*?"\.to_owned\(\)\)\s*\]\)\);', content, re.DOTALL)
+        hard_settings = RE_VERIFY_HARD_SETTINGS.search(content)
         if hard_settings:
             print("  HARD_SETTINGS updated with permanent password.")
-            print(f"  {hard_settings.group(0)}")
-            
+            # The output ends up in build logs, never print the password itself
+            masked = RE_VERIFY_PASSWORD_VALUE.sub(r'\1"***"', hard_settings.group(0))
+            print(f"  {masked}")
+
         if 'if let Some(v) = HARD_SETTINGS.read().unwrap().get("password") {' in content:
              print("  get_permanent_password updated to prioritize HARD_SETTINGS.")
 
     else:
         print(f"  Error: {file_path} not found.")
 
-    main_dart_path = os.path.join(project_root, "flutter/lib/main.dart")
-    if os.path.exists(main_dart_path):
-        with open(main_dart_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            if f'"{app_name}"' in content:
-                print(f"  Verified: App name '{app_name}' injected into {main_dart_path}")
-            else:
-                print(f"  WARNING: App name injection not found in {main_dart_path}")
+    main_dart_path = os.path.join(plan.project_root, MAIN_DART)
+    content = plan.content(MAIN_DART)
+    if content is not None:
+        if f'"{app_name}"' in content:
+            print(f"  Verified: App name '{app_name}' injected into {main_dart_path}")
+        else:
+            print(f"  WARNING: App name injection not found in {main_dart_path}")
     else:
         print(f"  Error: {main_dart_path} not found.")
 
     print("-" * 30)
 
-def inject_extra_args(project_root, extra_args_str):
+def inject_extra_args(plan, extra_args_str):
     print(f"Injecting extra args: {extra_args_str}")
     import shlex
-    
+
     try:
         # Split args respecting quotes
         extra_args_list = shlex.split(extra_args_str)
-        # Format as Dart list items: "'arg1', 'arg2'"
-        dart_args = ", ".join([f"'{arg}'" for arg in extra_args_list])
-        
-        main_dart_path = os.path.join(project_root, "flutter/lib/main.dart")
-        with open(main_dart_path, "r", encoding="utf-8") as f:
-            content = f.read()
-            
-        # Find main function
-        target = "Future<void> main(List<String> args) async {"
-        if target in content:
-            # Inject code to append args
-            injection = f"\n  args = List.from(args)..addAll([{dart_args}]);"
-            new_content = content.replace(target, target + injection)
-            
-            with open(main_dart_path, "w", encoding="utf-8") as f:
-                f.write(new_content)
-            print(f"Successfully injected extra args into {main_dart_path}")
-        else:
-            print(f"Error: Could not find main function in {main_dart_path}")
-            
     except Exception as e:
         print(f"Error injecting extra args: {e}")
+        return
+
+    # Format as Dart list items: "'arg1', 'arg2'"
+    dart_args = ", ".join([f"'{arg}'" for arg in extra_args_list])
+    # Find main function and inject code to append args
+    target = "Future<void> main(List<String> args) async {"
+    injection = f"\n  args = List.from(args)..addAll([{dart_args}]);"
+
+    def edit(content):
+        # Don't inject twice when main.dart is customized again with the same args.
+        if target + injection in content:
+            return content, 1
+        return content.replace(target, target + injection), content.count(target)
+
+    plan.add(MAIN_DART, edit, "main function (extra args)")
 
 def copy_resources(project_root, custom_res_dir):
     if not os.path.exists(custom_res_dir):
         print(f"No {custom_res_dir} directory found. Skipping resource copy.")
         return
 
-    # Map source in custom_resources to destination
-    resource_map = {
-        'icon.ico': [os.path.join(project_root, 'res/icon.ico'), os.path.join(project_root, 'flutter/windows/runner/resources/app_icon.ico')],
-        'logo.svg': [os.path.join(project_root, 'res/logo.svg')],
-        'tray-icon.ico': [os.path.join(project_root, 'res/tray-icon.ico')],
-        'icon.png': [os.path.join(project_root, 'res/icon.png')], # Used for flutter icons generation
-        'logo.png': [os.path.join(project_root, 'flutter/assets/logo.png')] # Used for app logo in UI
-    }
-
-    for src_name, dest_list in resource_map.items():
+    for src_name, dest_list in RESOURCE_MAP.items():
         src_path = os.path.join(custom_res_dir, src_name)
         if os.path.exists(src_path):
             for dest in dest_list:
+                dest = os.path.join(project_root, dest)
                 dest_dir = os.path.dirname(dest)
                 if not os.path.exists(dest_dir):
                     os.makedirs(dest_dir)
+                if os.path.exists(dest) and filecmp.cmp(src_path, dest, shallow=False):
+                    continue
                 print(f"Copying {src_name} to {dest}")
                 shutil.copy2(src_path, dest)
         else:
             print(f"Warning: {src_name} not found in {custom_res_dir}")
 
-def modify_build_py(project_root, args):
+def modify_build_py(plan, args):
     print("Modifying build.py...")
-    build_py_path = os.path.join(project_root, 'build.py')
-    with open(build_py_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # Replace rustdesk.exe with {app_name}.exe (careful with case and context)
     # For flutter build, it expects the exe name to match the pubspec name (usually)
     # But build.py has hardcoded 'rustdesk.exe' in several places.
-    
+
     # We need to be careful. If we changed pubspec name, flutter produces {pubspec_name}.exe
     # Let's assume pubspec name is sanitized app_name.
     sanitized_name = args.app_name.lower().replace(" ", "_").replace("-", "_")
-    
+
     # In build_flutter_windows:
     # python3 ./generate.py -f ... -e .../rustdesk.exe
     # We DO NOT want to change the input file name here, because flutter still builds rustdesk.exe
     # content = content.replace(f'/rustdesk.exe', f'/{sanitized_name}.exe')
-    
+
     # In main (cargo build section):
     # mv target/release/rustdesk.exe target/release/RustDesk.exe
     # We want: mv target/release/rustdesk.exe target/release/{app_name}.exe
     # But cargo still produces rustdesk.exe unless we change Cargo.toml bin name.
     # So we only change the destination.
-    content = content.replace('target/release/RustDesk.exe', f'target/release/{args.app_name}.exe')
-    
+    plan.replace(BUILD_PY, 'target/release/RustDesk.exe', f'target/release/{args.app_name}.exe')
+
     # cp -rf target/release/RustDesk.exe {res_dir}
     # Already handled by above replacement if consistent.
-    
-    with open(build_py_path, 'w', encoding='utf-8') as f:
-        f.write(content)
 
-def modify_portable_generate(project_root, app_name):
+def modify_portable_generate(plan, app_name):
     print("Modifying libs/portable/generate.py...")
-    gen_path = os.path.join(project_root, 'libs', 'portable', 'generate.py')
-    with open(gen_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # The magic string "rustdesk" is checked by bin_reader.rs and MUST NOT be changed.
     # content = content.replace('"rustdesk".encode', f'"{app_name}".encode')
-    
+
     # Default executable name
     # options.executable = 'rustdesk.exe'
     sanitized_name = app_name.lower().replace(" ", "_").replace("-", "_")
-    content = content.replace("'rustdesk.exe'", f"'{sanitized_name}.exe'")
-    
-    with open(gen_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    plan.replace(PORTABLE_GENERATE_PY, "'rustdesk.exe'", f"'{sanitized_name}.exe'")
 
-def modify_main_cpp(project_root, app_name):
+def modify_main_cpp(plan, app_name):
     print("Modifying flutter/windows/runner/main.cpp...")
-    cpp_path = os.path.join(project_root, 'flutter', 'windows', 'runner', 'main.cpp')
-    with open(cpp_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # Replace default app name
-    content = content.replace('std::wstring app_name = L"RustDesk";', f'std::wstring app_name = L"{app_name}";')
-    
+    plan.replace(MAIN_CPP, 'std::wstring app_name = L"RustDesk";', f'std::wstring app_name = L"{app_name}";')
+
     # Disable Rust override to ensure our name sticks
     # We use app_name.empty() which is false (since we set it above) but not a compile-time constant,
     # avoiding error C4127 (conditional expression is constant).
-    content = content.replace('if (get_rustdesk_app_name(app_name_buffer, 512) == 0)', 'if (app_name.empty() && get_rustdesk_app_name(app_name_buffer, 512) == 0)')
-    
-    with open(cpp_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    plan.replace(MAIN_CPP, 'if (get_rustdesk_app_name(app_name_buffer, 512) == 0)', 'if (app_name.empty() && get_rustdesk_app_name(app_name_buffer, 512) == 0)')
 
-def modify_main_dart(project_root, app_name):
+def modify_main_dart(plan, app_name):
     print("Modifying flutter/lib/main.dart...")
-    dart_path = os.path.join(project_root, 'flutter', 'lib', 'main.dart')
-    with open(dart_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
     # Replace bind.mainGetAppNameSync() with our string
     # We need to be careful about the context.
     # title: isWeb ? '${bind.mainGetAppNameSync()} ...' : bind.mainGetAppNameSync(),
-    
+
     # Regex replacement might be safer or just string replace if unique enough.
-    content = content.replace('bind.mainGetAppNameSync()', f'"{app_name}"')
-    
-    with open(dart_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+    plan.replace(MAIN_DART, 'bind.mainGetAppNameSync()', f'"{app_name}"')
 
 def main():
     parser = argparse.ArgumentParser(description='Customize RustDesk build')
@@ -451,6 +567,11 @@ def main():
     parser.add_argument('--logo-png-url', help='URL for logo.png')
     parser.add_argument('--extra-args', help='Extra arguments to inject into main.dart (e.g. --view-style=adaptive)')
     parser.add_argument('--theme', help='Default theme (light, dark, system)')
+    parser.add_argument('--resources-dir', default='custom_resources', help='Directory the resources are downloaded to and copied from (default: custom_resources)')
+    parser.add_argument('--pristine', action='store_true', help='Customize the files as committed in git HEAD, so an already customized tree can be customized again')
+    parser.add_argument('--force', action='store_true', help='Apply the customization even if the last run used the same arguments')
+    parser.add_argument('--strict-resources', action='store_true', help='Fail if any resource download fails')
+    parser.add_argument('--resources-max-age', type=int, default=-1, help='Revalidate cached resources older than this many seconds with the server (ETag/Last-Modified), 0 to revalidate on every run (default: -1, reuse a cached resource while its URL is unchanged)')
 
     args = parser.parse_args()
 
@@ -472,48 +593,58 @@ def main():
 
     print(f"Customizing RustDesk: {args.app_name}")
 
-    modify_config_rs(project_root, args.server_url, args.server_key, args.app_name)
-    if args.api_server or args.theme:
-        modify_default_settings(project_root, args.api_server, args.theme)
     # Prioritize environment variable for password to avoid shell interpolation issues
     permanent_password = os.environ.get('RUSTDESK_PERMANENT_PASSWORD') or args.permanent_password
-    if permanent_password:
-        modify_hard_settings(project_root, permanent_password)
-    
-    modify_runner_rc(project_root, args.app_name)
-    modify_pubspec_yaml(project_root, args.app_name)
-    
-    # Modify Cargo.toml files to update metadata
-    modify_cargo_toml(project_root, args.app_name)
-    
-    # New deep customization functions
-    modify_build_py(project_root, args)
-    modify_portable_generate(project_root, args.app_name)
-    modify_main_cpp(project_root, args.app_name)
-    modify_main_dart(project_root, args.app_name)
+    fingerprint = customize_fingerprint(args, permanent_password)
+    state = load_state(project_root)
+    plan = RewritePlan(project_root, 'HEAD' if args.pristine else None)
+    if not args.force and is_state_current(project_root, state, fingerprint):
+        print("Source files are already customized with these arguments, nothing to rewrite.")
+    else:
+        modify_config_rs(plan, args.server_url, args.server_key, args.app_name)
+        if args.api_server or args.theme:
+            modify_default_settings(plan, args.api_server, args.theme)
+        if permanent_password:
+            modify_hard_settings(plan, permanent_password)
+
+        modify_runner_rc(plan, args.app_name)
+        modify_pubspec_yaml(plan, args.app_name)
+
+        # Modify Cargo.toml files to update metadata
+        modify_cargo_toml(plan, args.app_name)
+
+        # New deep customization functions
+        modify_build_py(plan, args)
+        modify_portable_generate(plan, args.app_name)
+        modify_main_cpp(plan, args.app_name)
+        modify_main_dart(plan, args.app_name)
+
+        if args.extra_args:
+            inject_extra_args(plan, args.extra_args)
+
+        # Every file is read once and written only if its content changed.
+        plan.apply()
 
     # Download and copy resources
-    
-    custom_res_dir = os.path.join(project_root, 'custom_resources')
+
+    custom_res_dir = os.path.join(project_root, args.resources_dir)
     os.makedirs(custom_res_dir, exist_ok=True)
 
-    if args.icon_url:
-        download_resource(args.icon_url, os.path.join(custom_res_dir, 'icon.ico'))
-    if args.logo_url:
-        download_resource(args.logo_url, os.path.join(custom_res_dir, 'logo.svg'))
-    if args.logo_png_url:
-        download_resource(args.logo_png_url, os.path.join(custom_res_dir, 'logo.png'))
-    if args.tray_icon_url:
-        download_resource(args.tray_icon_url, os.path.join(custom_res_dir, 'tray-icon.ico'))
-    if args.icon_png_url:
-        download_resource(args.icon_png_url, os.path.join(custom_res_dir, 'icon.png'))
+    download_resources({
+        'icon.ico': args.icon_url,
+        'logo.svg': args.logo_url,
+        'logo.png': args.logo_png_url,
+        'tray-icon.ico': args.tray_icon_url,
+        'icon.png': args.icon_png_url,
+    }, custom_res_dir, strict=args.strict_resources, max_age=args.resources_max_age)
 
     copy_resources(project_root, custom_res_dir)
 
-    if args.extra_args:
-        inject_extra_args(project_root, args.extra_args)
+    rel_paths = list(plan.edits) or list(state.get('files', {}))
+    rel_paths = sorted(set(rel_paths) | {d for dest_list in RESOURCE_MAP.values() for d in dest_list})
+    save_state(project_root, fingerprint, rel_paths)
 
-    verify_changes(project_root, args.app_name, args.server_url)
+    verify_changes(plan, args.app_name, args.server_url)
     print("Customization complete.")
 
 if __name__ == '__main__':
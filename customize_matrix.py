@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import re
+import shutil
+import subprocess
+import time
+
+# Usage: python3 customize_matrix.py variants.json -o matrix -j 2
+#
+# variants.json:
+# {
+#   "build_command": "python3 build.py --flutter",
+#   "prepare_command": "<optional, run once in every new worktree>",
+#   "artifacts": ["rustdesk-*"],
+#   "jobs": 2,
+#   "variants": [
+#     {"name": "acme", "app_name": "Acme", "server_url": "...", "server_key": "...", "resources_url": "..."}
+#   ]
+# }
+#
+# Every variant is customized with `customize.py --pristine` in a git worktree under
+# <output>/worktrees, logs and artifacts go to <output>/variants/<name>, and the timings
+# are written to <output>/matrix_report.json.
+
+from customize import RESOURCE_MAP
+
+# Variant keys passed to customize.py as --key-name value
+CUSTOMIZE_KEYS = [
+    'app_name',
+    'server_url',
+    'server_key',
+    'api_server',
+    'resources_url',
+    'icon_url',
+    'logo_url',
+    'tray_icon_url',
+    'icon_png_url',
+    'logo_png_url',
+    'extra_args',
+    'theme',
+    'resources_max_age',
+]
+# Keys customize.py writes into Rust sources (config.rs, Cargo.toml). Variants which agree
+# on all of them share one worktree, so the compiled Rust lib is built once and reused.
+RUST_KEYS = ['app_name', 'server_url', 'server_key', 'api_server', 'permanent_password', 'theme']
+DEFAULT_BUILD_COMMAND = 'python3 build.py --flutter'
+DEFAULT_ARTIFACTS = ['rustdesk-*', 'rustdesk_portable.exe']
+
+
+def load_matrix(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                print("Error: PyYAML is required for YAML matrix files, run `pip3 install pyyaml`")
+                sys.exit(-1)
+            matrix = yaml.safe_load(f)
+        else:
+            matrix = json.load(f)
+    if isinstance(matrix, list):
+        matrix = {'variants': matrix}
+    names = [v.get('name') or v.get('app_name') for v in matrix.get('variants', [])]
+    if None in names or len(set(names)) != len(names):
+        print("Error: every variant needs a unique name (or app_name)")
+        sys.exit(-1)
+    for variant, name in zip(matrix['variants'], names):
+        variant['name'] = name
+        missing = [k for k in ('app_name', 'server_url', 'server_key') if not variant.get(k)]
+        if missing:
+            print(f"Error: variant {name} is missing {', '.join(missing)}")
+            sys.exit(-1)
+    return matrix
+
+
+def rust_key(variant):
+    values = {k: variant.get(k) for k in RUST_KEYS}
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def customize_args(variant):
+    args = []
+    for key in CUSTOMIZE_KEYS:
+        value = variant.get(key)
+        if value is not None:
+            args.append(f"--{key.replace('_', '-')}={value}")
+    if variant.get('strict_resources'):
+        args.append('--strict-resources')
+    return args
+
+
+def customize_env(variant):
+    # The password goes through the environment (customize.py prefers it), never argv where
+    # `ps` shows it. Drop an inherited one so a variant without password doesn't pick it up.
+    env = dict(os.environ)
+    env.pop('RUSTDESK_PERMANENT_PASSWORD', None)
+    if variant.get('permanent_password') is not None:
+        env['RUSTDESK_PERMANENT_PASSWORD'] = str(variant['permanent_password'])
+    return env
+
+
+SECRET_ARG = re.compile(r'(--?[\w-]*(?:password|token|secret)[\w-]*)(=|\s+)(\S+)', re.IGNORECASE)
+
+
+def redact(cmd):
+    """Command line for the log, with the values of password/token/secret options masked"""
+    return SECRET_ARG.sub(r'\1\2***', cmd if isinstance(cmd, str) else ' '.join(cmd))
+
+
+def variant_secrets(variant):
+    """Values which must not appear in the logs of a variant"""
+    return [str(variant['permanent_password'])] if variant.get('permanent_password') else []
+
+
+def run(cmd, cwd, log_path, env=None, secrets=()):
+    with open(log_path, 'a', encoding='utf-8') as log:
+        log.write(f"$ {redact(cmd)}\n")
+        log.flush()
+        if not secrets:
+            return subprocess.call(
+                cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, shell=isinstance(cmd, str), env=env
+            )
+        # The child may print a secret it was given (e.g. the rewritten source lines), mask
+        # them in its output before it reaches the log.
+        process = subprocess.Popen(
+            cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=isinstance(cmd, str), env=env,
+            encoding='utf-8', errors='replace'
+        )
+        for line in process.stdout:
+            for secret in secrets:
+                line = line.replace(secret, '***')
+            log.write(line)
+        return process.wait()
+
+
+def create_worktree(root, path, log_path):
+    if os.path.exists(path):
+        return True
+    if run(['git', 'worktree', 'add', '--detach', path, 'HEAD'], root, log_path) != 0:
+        return False
+    # Clone submodules (libs/hbb_common holds config.rs) from the local checkout, no network needed.
+    try:
+        output = subprocess.check_output(
+            ['git', 'config', '-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$'], cwd=root
+        ).decode('utf-8')
+    except subprocess.CalledProcessError:
+        output = ''
+    for line in output.splitlines():
+        key, sub_path = line.split(' ', 1)
+        name = key[len('submodule.'):-len('.path')]
+        cmds = [
+            ['git', 'submodule', 'init', sub_path],
+            ['git', 'config', f'submodule.{name}.url', os.path.join(root, sub_path)],
+            ['git', '-c', 'protocol.file.allow=always', 'submodule', 'update', sub_path],
+        ]
+        for cmd in cmds:
+            if run(cmd, path, log_path) != 0:
+                return False
+    return True
+
+
+def reset_resources(worktree, log_path):
+    """Restore the resource destinations of the worktree to HEAD, returns False if git failed"""
+    dests = [d for dest_list in RESOURCE_MAP.values() for d in dest_list]
+    # git rejects the whole pathspec if one path isn't tracked (flutter/assets/logo.png),
+    # restore the tracked ones and delete the others.
+    try:
+        tracked = subprocess.check_output(['git', 'ls-files', '-z', '--'] + dests, cwd=worktree).decode('utf-8')
+    except subprocess.CalledProcessError:
+        return False
+    tracked = set(tracked.split('\0')) - {''}
+    for dest in dests:
+        if dest not in tracked and os.path.exists(os.path.join(worktree, dest)):
+            os.remove(os.path.join(worktree, dest))
+    if not tracked:
+        return True
+    return run(['git', 'checkout', 'HEAD', '--'] + sorted(tracked), worktree, log_path) == 0
+
+
+def build_variant(root, out_dir, worktree, variant, matrix, reused):
+    name = variant['name']
+    variant_dir = os.path.join(out_dir, 'variants', name)
+    os.makedirs(variant_dir, exist_ok=True)
+    log_path = os.path.join(variant_dir, 'matrix.log')
+    report = {'name': name, 'worktree': worktree, 'rust_reused': reused, 'status': 'ok'}
+    start = time.time()
+
+    # Each variant keeps its own downloaded resources (and download cache).
+    resources_dir = os.path.join(variant_dir, 'custom_resources')
+    if not os.path.exists(resources_dir):
+        shutil.copytree(os.path.join(root, 'custom_resources'), resources_dir)
+
+    # Drop the resources copied for the previous variant built in this worktree.
+    if not reset_resources(worktree, log_path):
+        report['status'] = 'reset failed'
+        report['total_s'] = round(time.time() - start, 2)
+        return report
+
+    t = time.time()
+    cmd = [sys.executable, os.path.join(root, 'customize.py'), '--pristine', f'--resources-dir={resources_dir}']
+    code = run(cmd + customize_args(variant), worktree, log_path, customize_env(variant), variant_secrets(variant))
+    report['customize_s'] = round(time.time() - t, 2)
+    if code != 0:
+        report['status'] = 'customize failed'
+        report['total_s'] = round(time.time() - start, 2)
+        return report
+
+    build_command = variant.get('build_command', matrix.get('build_command', DEFAULT_BUILD_COMMAND))
+    if build_command:
+        t = time.time()
+        code = run(build_command, worktree, log_path, secrets=variant_secrets(variant))
+        report['build_s'] = round(time.time() - t, 2)
+        if code != 0:
+            report['status'] = 'build failed'
+
+    # Move the artifacts out, the next variant of this worktree would overwrite them.
+    artifacts = []
+    for pattern in variant.get('artifacts', matrix.get('artifacts', DEFAULT_ARTIFACTS)):
+        for artifact in glob.glob(os.path.join(worktree, pattern)):
+            dest = os.path.join(variant_dir, os.path.basename(artifact))
+            shutil.move(artifact, dest)
+            artifacts.append(dest)
+    report['artifacts'] = artifacts
+    report['total_s'] = round(time.time() - start, 2)
+    return report
+
+
+def build_group(root, out_dir, key, variants, matrix):
+    worktree = os.path.join(out_dir, 'worktrees', key)
+    os.makedirs(os.path.dirname(worktree), exist_ok=True)
+    log_path = os.path.join(out_dir, 'worktrees', f'{key}.log')
+    t = time.time()
+    if not create_worktree(root, worktree, log_path):
+        return [{'name': v['name'], 'worktree': worktree, 'status': 'worktree failed'} for v in variants]
+    prepare_command = matrix.get('prepare_command')
+    if prepare_command and not os.path.exists(os.path.join(worktree, '.matrix_prepared')):
+        if run(prepare_command, worktree, log_path) != 0:
+            return [{'name': v['name'], 'worktree': worktree, 'status': 'prepare failed'} for v in variants]
+        open(os.path.join(worktree, '.matrix_prepared'), 'w').close()
+    setup_s = round(time.time() - t, 2)
+
+    reports = []
+    # Variants sharing Rust inputs run one after another in the same worktree, so cargo
+    # finds the Rust lib of the previous variant up to date.
+    for i, variant in enumerate(variants):
+        report = build_variant(root, out_dir, worktree, variant, matrix, i > 0)
+        report['setup_s'] = setup_s if i == 0 else 0
+        print(f"[{report['name']}] {report['status']} in {report['total_s']}s")
+        reports.append(report)
+    return reports
+
+
+def print_report(reports):
+    columns = ['name', 'status', 'rust_reused', 'setup_s', 'customize_s', 'build_s', 'total_s']
+    rows = [[str(r.get(c, '')) for c in columns] for r in reports]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build several customized RustDesk variants')
+    parser.add_argument('matrix', help='JSON or YAML file with the list of variants')
+    parser.add_argument('-o', '--output', default='matrix', help='Output directory for worktrees, logs and artifacts (default: matrix)')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worktrees built concurrently (default: 2)')
+    parser.add_argument('--only', help='Comma separated variant names to build')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    out_dir = os.path.abspath(args.output)
+    matrix = load_matrix(args.matrix)
+    variants = matrix['variants']
+    if args.only:
+        only = args.only.split(',')
+        variants = [v for v in variants if v['name'] in only]
+
+    groups = {}
+    for variant in variants:
+        groups.setdefault(rust_key(variant), []).append(variant)
+    jobs = args.jobs or matrix.get('jobs', 2)
+    print(f"Building {len(variants)} variants in {len(groups)} worktrees, {jobs} at a time")
+
+    start = time.time()
+    reports = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(build_group, root, out_dir, key, group, matrix) for key, group in groups.items()]
+        for future in concurrent.futures.as_completed(futures):
+            reports.extend(future.result())
+
+    reports.sort(key=lambda r: [v['name'] for v in variants].index(r['name']))
+    print_report(reports)
+    print(f"Matrix finished in {time.time() - start:.2f}s")
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'matrix_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(reports, f, indent=2)
+    if any(r['status'] != 'ok' for r in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,18 @@
 
 import requests
 import argparse
+import concurrent.futures
+import csv
 import json
+import os
+import threading
+import time
+import zipfile
 from datetime import datetime, timedelta
 
+import instrument
+import limiter
+
 
 def get_personal_ab(url, token):
     """Get personal address book GUID"""
@@ -214,6 +223,150 @@ def update_peer(url, token, ab_guid, peer_id, alias=None, note=None, tags=None,
     return check_response(response)
 
 
+def parse_tags(value):
+    """Parse tags - supports both 'tag1,tag2' and '[tag1,tag2]' formats, '[]' for no tags"""
+    if value is None:
+        return None
+    if value == "[]":
+        return []  # Empty list to clear tags
+    tags_str = value.strip()
+    if tags_str.startswith('[') and tags_str.endswith(']'):
+        tags_str = tags_str[1:-1]  # Remove brackets
+    return [tag.strip() for tag in tags_str.split(",") if tag.strip()]
+
+
+def load_peers_file(path):
+    """Load peers from a CSV (columns: id, alias, tags, note, password) or JSON file.
+
+    Missing columns and empty cells leave the field as it is on the server."""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+    peers = {}
+    for i, row in enumerate(rows):
+        peer_id = str(row.get("id") or "").strip()
+        if not peer_id:
+            print(f"Error: row {i + 1} has no id")
+            exit(1)
+        peer = {"id": peer_id}
+        for key in ["alias", "note", "password"]:
+            if row.get(key) not in (None, ""):
+                peer[key] = row[key]
+        tags = row.get("tags")
+        if tags not in (None, ""):
+            peer["tags"] = tags if isinstance(tags, list) else parse_tags(tags)
+        peers[peer_id] = peer
+    return list(peers.values())
+
+
+# Peer fields a client may write, server-assigned ones (guid, ...) are never sent back.
+PEER_FIELDS = ["id", "alias", "tags", "note", "username", "hostname", "platform", "hash", "password"]
+# Fields that can't be read back reliably, they are only set when the peer is added.
+PEER_ADD_ONLY_FIELDS = ["password", "hash"]
+
+
+def writable_peer(peer):
+    return {k: v for k, v in peer.items() if k in PEER_FIELDS and v is not None}
+
+
+def diff_peers(existing, wanted, delete_missing):
+    """Returns (to_add, to_update, to_delete ids, unchanged count)."""
+    current = {p["id"]: p for p in existing}
+    to_add, to_update = [], []
+    for peer in map(writable_peer, wanted):
+        old = current.get(peer["id"])
+        if old is None:
+            to_add.append(peer)
+            continue
+        changes = {
+            k: v for k, v in peer.items()
+            if k != "id" and k not in PEER_ADD_ONLY_FIELDS and (old.get(k) or ([] if k == "tags" else "")) != v
+        }
+        if changes:
+            to_update.append(dict(changes, id=peer["id"]))
+    wanted_ids = {p["id"] for p in wanted}
+    to_delete = [p["id"] for p in existing if p["id"] not in wanted_ids] if delete_missing else []
+    unchanged = len(wanted) - len(to_add) - len(to_update)
+    return to_add, to_update, to_delete, unchanged
+
+
+def send_requests(url, token, tasks, jobs=8, progress=False):
+    """Send (kind, label, method, path, payload) tasks concurrently, yields (task, error or None) as they finish"""
+    headers = {"Authorization": f"Bearer {token}"}
+    local = threading.local()
+
+    def send(method, path, payload):
+        # One keep-alive session per worker thread
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers.update(headers)
+        response = local.session.request(method, f"{url}{path}", json=payload)
+        if response.status_code != 200:
+            return f"HTTP {response.status_code} - {response.text}"
+        try:
+            response_json = response.json()
+            if isinstance(response_json, dict) and "error" in response_json:
+                return response_json["error"]
+        except ValueError:
+            pass
+        return None
+
+    start = time.time()
+    step = max(1, len(tasks) // 10)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(send, task[2], task[3], task[4]): task for task in tasks}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            yield futures[future], future.result()
+            if progress and (done % step == 0 or done == len(tasks)):
+                seconds = time.time() - start
+                print(f"Progress: {done}/{len(tasks)} requests, {done / seconds if seconds else 0:.1f} req/s")
+
+
+def sync_peers(url, token, ab_guid, wanted, delete_missing=False, jobs=8, batch_size=100, dry_run=False):
+    """Bring the peers of an address book in line with `wanted`, loading the book only once"""
+    start = time.time()
+    existing = view_ab_peers(url, token, ab_guid)
+    to_add, to_update, to_delete, unchanged = diff_peers(existing, wanted, delete_missing)
+    print(f"Loaded {len(existing)} peers in {time.time() - start:.2f}s: "
+          f"{len(to_add)} to add, {len(to_update)} to update, {len(to_delete)} to delete, {unchanged} unchanged")
+    if dry_run:
+        for peer in to_add:
+            print(f"+ {peer['id']}")
+        for peer in to_update:
+            print(f"~ {peer['id']}: {', '.join(k for k in peer if k != 'id')}")
+        for peer_id in to_delete:
+            print(f"- {peer_id}")
+        return {"added": 0, "updated": 0, "deleted": 0, "unchanged": unchanged, "failed": 0}
+
+    tasks = [("added", peer["id"], "POST", f"/api/ab/peer/add/{ab_guid}", peer) for peer in to_add]
+    tasks += [("updated", peer["id"], "PUT", f"/api/ab/peer/update/{ab_guid}", peer) for peer in to_update]
+    # The delete endpoint takes a list, delete in batches.
+    for i in range(0, len(to_delete), batch_size):
+        batch = to_delete[i:i + batch_size]
+        tasks.append(("deleted", batch, "DELETE", f"/api/ab/peer/{ab_guid}", batch))
+
+    result = {"added": 0, "updated": 0, "deleted": 0, "unchanged": unchanged, "failed": 0}
+    t = time.time()
+    for (kind, ids, method, path, payload), error in send_requests(url, token, tasks, jobs):
+        count = len(ids) if isinstance(ids, list) else 1
+        if error:
+            action = {"added": "Adding", "updated": "Updating", "deleted": "Deleting"}[kind]
+            print(f"Error: {action} peers {ids} failed: {error}")
+            result["failed"] += count
+        else:
+            result[kind] += count
+    seconds = time.time() - t
+    changed = result["added"] + result["updated"] + result["deleted"]
+    print(f"Added {result['added']}, updated {result['updated']}, deleted {result['deleted']}, "
+          f"unchanged {result['unchanged']}, failed {result['failed']}")
+    print(f"{len(tasks)} requests in {seconds:.2f}s, {changed / seconds if seconds else 0:.1f} peers/s, "
+          f"total {time.time() - start:.2f}s")
+    return result
+
+
 def str2color(tag_name, existing_colors=None):
     """Generate color for tag name similar to str2color2 function"""
     if existing_colors is None:
@@ -480,6 +633,181 @@ def delete_ab_rules(url, token, rule_guids):
     return check_response(response)
 
 
+def backup_abs(url, token, path, jobs=8):
+    """Back up every shared address book with its peers, tags and rules into one zip archive"""
+    start = time.time()
+    abs = view_shared_abs(url, token)
+    print(f"Backing up {len(abs)} address books")
+    fetchers = {"peers": view_ab_peers, "tags": view_ab_tags, "rules": view_ab_rules}
+    books = {ab["guid"]: {"profile": ab} for ab in abs}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(fetch, url, token, ab["guid"]): (ab["guid"], kind)
+            for ab in abs
+            for kind, fetch in fetchers.items()
+        }
+        done = 0
+        for future in concurrent.futures.as_completed(futures):
+            guid, kind = futures[future]
+            book = books[guid]
+            book[kind] = future.result()
+            if len(book) == len(fetchers) + 1:
+                done += 1
+                print(f"[{done}/{len(abs)}] {book['profile']['name']}: "
+                      f"{len(book['peers'])} peers, {len(book['tags'])} tags, {len(book['rules'])} rules")
+
+    manifest = {
+        "version": 1,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "url": url,
+        "books": [
+            {
+                "guid": guid,
+                "name": book["profile"]["name"],
+                "file": f"books/{guid}.json",
+                "peers": len(book["peers"]),
+                "tags": len(book["tags"]),
+                "rules": len(book["rules"]),
+            }
+            for guid, book in books.items()
+        ],
+    }
+    tmp = path + ".tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        for entry in manifest["books"]:
+            archive.writestr(entry["file"], json.dumps(books[entry["guid"]], indent=2))
+    os.replace(tmp, path)
+
+    seconds = time.time() - start
+    peers = sum(entry["peers"] for entry in manifest["books"])
+    print(f"Wrote {path} ({os.path.getsize(path)} bytes): {len(abs)} address books, {peers} peers "
+          f"in {seconds:.2f}s, {peers / seconds if seconds else 0:.1f} peers/s")
+    return manifest
+
+
+def load_backup(path):
+    """Read the manifest and books of a backup archive"""
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        books = [json.loads(archive.read(entry["file"])) for entry in manifest["books"]]
+    return manifest, books
+
+
+def plan_book_restore(ab_guid, book, current):
+    """Requests that upsert the tags, peers and rules of a backed up book into `current`"""
+    tasks = []
+
+    current_tags = {tag["name"]: tag.get("color") for tag in current["tags"]}
+    for tag in book["tags"]:
+        color = tag.get("color")
+        if isinstance(color, str):
+            color = int(color, 16)
+        if tag["name"] not in current_tags:
+            tasks.append(("added", f"tag {tag['name']}", "POST", f"/api/ab/tag/add/{ab_guid}",
+                          {"name": tag["name"], "color": color if color is not None else str2color(tag["name"])}))
+        elif color is not None and current_tags[tag["name"]] != f"0x{color:08X}":
+            tasks.append(("updated", f"tag {tag['name']}", "PUT", f"/api/ab/tag/update/{ab_guid}",
+                          {"name": tag["name"], "color": color}))
+
+    to_add, to_update, _, _ = diff_peers(current["peers"], book["peers"], False)
+    tasks += [("added", f"peer {peer['id']}", "POST", f"/api/ab/peer/add/{ab_guid}", peer) for peer in to_add]
+    tasks += [("updated", f"peer {peer['id']}", "PUT", f"/api/ab/peer/update/{ab_guid}", peer) for peer in to_update]
+
+    # Rules are identified by their target, the guids differ between servers
+    current_rules = {(rule.get("user"), rule.get("group")): rule for rule in current["rules"]}
+    for rule in book["rules"]:
+        target = (rule.get("user"), rule.get("group"))
+        permission = string_to_permission(str(rule["rule"])) or rule["rule"]
+        existing = current_rules.get(target)
+        if existing is None:
+            payload = {"guid": ab_guid, "rule": permission}
+            if target[0]:
+                payload["user"] = target[0]
+            elif target[1]:
+                payload["group"] = target[1]
+            tasks.append(("added", f"rule {target[0] or target[1] or 'everyone'}", "POST", "/api/ab/rule", payload))
+        elif existing["rule"] != rule["rule"]:
+            tasks.append(("updated", f"rule {target[0] or target[1] or 'everyone'}", "PATCH", "/api/ab/rule",
+                          {"guid": existing["guid"], "rule": permission}))
+    return tasks
+
+
+def restore_abs(url, token, path, jobs=8, names=None):
+    """Restore a backup archive, creating missing address books and upserting their contents.
+
+    Nothing is deleted, so restoring the same archive twice is a no-op."""
+    start = time.time()
+    manifest, books = load_backup(path)
+    if names:
+        books = [book for book in books if book["profile"]["name"] in names]
+    print(f"Restoring {len(books)} address books from {path} (created {manifest['created']})")
+
+    existing = {ab["name"]: ab for ab in view_shared_abs(url, token)}
+    tasks = []
+    for book in books:
+        profile = book["profile"]
+        ab = existing.get(profile["name"])
+        if ab is None:
+            tasks.append(("added", f"address book {profile['name']}", "POST", "/api/ab/shared/add",
+                          {"name": profile["name"], "note": profile.get("note")}))
+        elif profile.get("note") and ab.get("note") != profile["note"]:
+            tasks.append(("updated", f"address book {profile['name']}", "PUT", "/api/ab/shared/update/profile",
+                          {"guid": ab["guid"], "note": profile["note"]}))
+    created = [task for task in tasks if task[0] == "added"]
+    result = {"added": 0, "updated": 0, "failed": 0}
+    for (kind, label, method, req_path, payload), error in send_requests(url, token, tasks, jobs):
+        if error:
+            print(f"Error: {label}: {error}")
+            result["failed"] += 1
+        else:
+            result[kind] += 1
+    if created:
+        existing = {ab["name"]: ab for ab in view_shared_abs(url, token)}
+
+    # Load the current contents of the books that already existed, new ones are empty
+    empty = {"peers": [], "tags": [], "rules": []}
+    current = {}
+    fetchers = {"peers": view_ab_peers, "tags": view_ab_tags, "rules": view_ab_rules}
+    created_names = {task[4]["name"] for task in created}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for book in books:
+            ab = existing.get(book["profile"]["name"])
+            if ab is None:
+                print(f"Error: address book '{book['profile']['name']}' could not be created, skipping")
+                continue
+            current[ab["guid"]] = dict(empty)
+            if book["profile"]["name"] in created_names:
+                continue
+            for kind, fetch in fetchers.items():
+                futures[executor.submit(fetch, url, token, ab["guid"])] = (ab["guid"], kind)
+        for future in concurrent.futures.as_completed(futures):
+            guid, kind = futures[future]
+            current[guid][kind] = future.result()
+
+    tasks = []
+    for book in books:
+        ab = existing.get(book["profile"]["name"])
+        if ab is not None:
+            tasks += plan_book_restore(ab["guid"], book, current[ab["guid"]])
+    print(f"{len(tasks)} tags, peers and rules to add or update")
+    # Peers refer to tags by name: restore the tags of every book first, then peers and rules
+    tags = [task for task in tasks if task[3].startswith("/api/ab/tag/")]
+    for phase in [tags, [task for task in tasks if task not in tags]]:
+        for (kind, label, method, req_path, payload), error in send_requests(url, token, phase, jobs, progress=True):
+            if error:
+                print(f"Error: {label}: {error}")
+                result["failed"] += 1
+            else:
+                result[kind] += 1
+
+    seconds = time.time() - start
+    print(f"Added {result['added']}, updated {result['updated']}, failed {result['failed']} "
+          f"in {seconds:.2f}s, {(result['added'] + result['updated']) / seconds if seconds else 0:.1f} changes/s")
+    return result
+
+
 def main():
     def parse_color(value):
         """Parse color value - supports both hex (0xFF00FF00) and decimal"""
@@ -510,8 +838,8 @@ def main():
     # Required arguments
     parser.add_argument(
         "command",
-        choices=["view-ab", "add-ab", "update-ab", "delete-ab", "get-personal-ab",
-                "view-peer", "add-peer", "update-peer", "delete-peer",
+        choices=["view-ab", "add-ab", "update-ab", "delete-ab", "get-personal-ab", "backup", "restore",
+                "view-peer", "add-peer", "update-peer", "delete-peer", "import-peers", "sync-peers",
                 "view-tag", "add-tag", "update-tag", "delete-tag",
                 "view-rule", "add-rule", "update-rule", "delete-rule"],
         help="Command to execute",
@@ -535,6 +863,10 @@ def main():
     parser.add_argument("--peer-id", help="Peer ID")
     parser.add_argument("--alias", help="Peer alias")
     parser.add_argument("--tags", help="Peer tags (supports both 'tag1,tag2' and '[tag1,tag2]' formats, use '[]' to clear tags)")
+    parser.add_argument("--file", help="CSV (id,alias,tags,note,password) or JSON file of peers (for import-peers/sync-peers)")
+    parser.add_argument("--jobs", type=int, default=8, help="Concurrent requests for import-peers/sync-peers/backup/restore (default: 8)")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what import-peers/sync-peers would change")
+    parser.add_argument("--archive", help="Backup archive (zip) to write or to restore from")
     
     # Tag management arguments
     parser.add_argument("--tag-name", help="Tag name")
@@ -548,6 +880,8 @@ def main():
     parser.add_argument("--rule-guid", help="Rule GUID (for update/delete)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
 
     # Remove trailing slashes from URL
     while args.url.endswith("/"):
@@ -563,6 +897,17 @@ def main():
         personal_ab = get_personal_ab(args.url, args.token)
         print(json.dumps(personal_ab, indent=2))
     
+    elif args.command in ["backup", "restore"]:
+        if not args.archive:
+            print(f"Error: --archive is required for {args.command} command")
+            return
+
+        if args.command == "backup":
+            backup_abs(args.url, args.token, args.archive, args.jobs)
+        else:
+            # --ab-name restores only that address book
+            restore_abs(args.url, args.token, args.archive, args.jobs, [args.ab_name] if args.ab_name else None)
+
     elif args.command in ["add-ab", "update-ab", "delete-ab"]:
         # Address book management commands
         if args.command == "add-ab":
@@ -603,7 +948,7 @@ def main():
                 result = delete_shared_abs(args.url, args.token, ab_guid)
                 print(f"Result: {result}")
     
-    elif args.command in ["view-peer", "add-peer", "update-peer", "delete-peer", "view-tag", "add-tag", "update-tag", "delete-tag", "view-rule", "add-rule", "update-rule", "delete-rule"]:
+    elif args.command in ["view-peer", "add-peer", "update-peer", "delete-peer", "import-peers", "sync-peers", "view-tag", "add-tag", "update-tag", "delete-tag", "view-rule", "add-rule", "update-rule", "delete-rule"]:
         if not args.ab_name and not args.ab_guid:
             print("Error: --ab-name or --ab-guid is required for this command")
             return
@@ -635,16 +980,7 @@ def main():
                 return
             
             # Handle tags parsing - support both [tag1,tag2] and tag1,tag2 formats
-            tags = None
-            if args.tags is not None:
-                if args.tags == "[]":
-                    tags = []  # Empty list to clear tags
-                else:
-                    # Remove brackets if present and split by comma
-                    tags_str = args.tags.strip()
-                    if tags_str.startswith('[') and tags_str.endswith(']'):
-                        tags_str = tags_str[1:-1]  # Remove brackets
-                    tags = [tag.strip() for tag in tags_str.split(",") if tag.strip()]
+            tags = parse_tags(args.tags)
             
             result = add_peer(
                 args.url, 
@@ -664,16 +1000,7 @@ def main():
                 return
             
             # Handle tags parsing - support both [tag1,tag2] and tag1,tag2 formats
-            tags = None
-            if args.tags is not None:
-                if args.tags == "[]":
-                    tags = []  # Empty list to clear tags
-                else:
-                    # Remove brackets if present and split by comma
-                    tags_str = args.tags.strip()
-                    if tags_str.startswith('[') and tags_str.endswith(']'):
-                        tags_str = tags_str[1:-1]  # Remove brackets
-                    tags = [tag.strip() for tag in tags_str.split(",") if tag.strip()]
+            tags = parse_tags(args.tags)
             
             result = update_peer(
                 args.url, 
@@ -695,6 +1022,15 @@ def main():
             result = delete_peer(args.url, args.token, ab_guid, args.peer_id)
             print(f"Result: {result}")
         
+        elif args.command in ["import-peers", "sync-peers"]:
+            if not args.file:
+                print(f"Error: --file is required for {args.command} command")
+                return
+
+            # import-peers only adds and updates, sync-peers also deletes peers missing from the file
+            peers = load_peers_file(args.file)
+            sync_peers(args.url, args.token, ab_guid, peers, args.command == "sync-peers", args.jobs, dry_run=args.dry_run)
+
         elif args.command == "view-tag":
             tags = view_ab_tags(args.url, args.token, ab_guid)
             print(json.dumps(tags, indent=2))
@@ -5,6 +5,9 @@ import argparse
 import json
 from datetime import datetime, timedelta, timezone
 
+import instrument
+import limiter
+
 
 def format_timestamp(timestamp):
     """Convert Unix timestamp to readable local datetime"""
@@ -311,6 +314,8 @@ def main():
     parser.add_argument("--operator", help="Operator filter (for console audits only)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
 
     # Remove trailing slashes from URL
     while args.url.endswith("/"):
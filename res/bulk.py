@@ -0,0 +1,74 @@
+# Bulk helpers shared by user-groups.py and device-groups.py: resolving many group names from
+# one listing and sending chunked member changes in parallel.
+#
+# Functions run by run_parallel() execute on worker threads, where exit() would only end the
+# worker. They raise ApiError (or let a requests exception through) instead; run_parallel()
+# stops starting new items after the first failure, then reports the errors and exits once,
+# from the calling thread.
+
+import concurrent.futures
+
+import requests
+
+# Members per add/remove request and parallel requests for bulk operations
+CHUNK_SIZE = 100
+JOBS = 4
+
+
+class ApiError(Exception):
+    """An HTTP error status or an {"error": ...} response"""
+
+
+def check_result(response):
+    """Like the scripts' check_response(), but raises ApiError instead of exiting"""
+    if response.status_code != 200:
+        raise ApiError(f"HTTP {response.status_code}: {response.text}")
+    if response.text and response.text.strip():
+        try:
+            json_data = response.json()
+        except ValueError:
+            return response.text
+        if isinstance(json_data, dict) and "error" in json_data:
+            raise ApiError(json_data["error"])
+        return json_data
+    return None
+
+
+def get_groups_by_names(list_groups, url, token, names):
+    """Resolve group names with a single listing, returns {name: group} for the names found"""
+    if len(names) == 1:
+        groups = list_groups(url, token, names[0])
+    else:
+        groups = list_groups(url, token)
+    wanted = set(names)
+    return {str(g.get("name")): g for g in groups if str(g.get("name")) in wanted}
+
+
+def run_parallel(fn, items, jobs=JOBS):
+    """Call fn for each item with up to `jobs` requests in flight, returns the results in order.
+
+    Exits with the errors if any call failed; the items not started by then are not sent."""
+    results = [None] * len(items)
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(fn, item): i for i, item in enumerate(items)}
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            try:
+                results[futures[future]] = future.result()
+            except (ApiError, requests.RequestException) as e:
+                errors.append(str(e))
+                for f in futures:
+                    f.cancel()
+    if errors:
+        for error in errors:
+            print(f"Error: {error}")
+        skipped = sum(f.cancelled() for f in futures)
+        print(f"Error: {len(errors)} of {len(items)} requests failed, {skipped} not sent")
+        exit(1)
+    return results
+
+
+def chunks(items, size=CHUNK_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
@@ -4,6 +4,10 @@ import requests
 import argparse
 import json
 
+import instrument
+import limiter
+from bulk import check_result, chunks, get_groups_by_names, run_parallel
+
 
 def check_response(response):
     """
@@ -104,14 +108,17 @@ def delete_groups(url, token, names):
     headers = headers_with(token)
     if isinstance(names, str):
         names = [names]
-    for n in names:
-        g = get_group_by_name(url, token, n)
-        if not g:
-            print(f"Error: Group '{n}' not found")
-            exit(1)
-        guid = g.get("guid")
-        r = requests.delete(f"{url}/api/device-groups/{guid}", headers=headers)
-        check_response(r)
+    groups = get_groups_by_names(list_groups, url, token, names)
+    missing = [n for n in names if n not in groups]
+    if missing:
+        print("Error: " + "; ".join(f"Group '{n}' not found" for n in missing))
+        exit(1)
+
+    def delete(name):
+        r = requests.delete(f"{url}/api/device-groups/{groups[name].get('guid')}", headers=headers)
+        check_result(r)
+
+    run_parallel(delete, names)
     return "Success"
 
 
@@ -164,9 +171,12 @@ def add_devices(url, token, group_name, device_ids):
     if not g:
         return f"Group '{group_name}' not found"
     guid = g.get("guid")
-    payload = device_ids if isinstance(device_ids, list) else [device_ids]
-    r = requests.post(f"{url}/api/device-groups/{guid}", headers=headers, json=payload)
-    return check_response(r)
+    device_ids = device_ids if isinstance(device_ids, list) else [device_ids]
+    results = run_parallel(
+        lambda payload: check_result(requests.post(f"{url}/api/device-groups/{guid}", headers=headers, json=payload)),
+        chunks(device_ids),
+    )
+    return results[0] if len(results) == 1 else f"Success: {len(device_ids)} device(s) in {len(results)} requests"
 
 
 def remove_devices(url, token, group_name, device_ids):
@@ -175,9 +185,12 @@ def remove_devices(url, token, group_name, device_ids):
     if not g:
         return f"Group '{group_name}' not found"
     guid = g.get("guid")
-    payload = device_ids if isinstance(device_ids, list) else [device_ids]
-    r = requests.delete(f"{url}/api/device-groups/{guid}/devices", headers=headers, json=payload)
-    return check_response(r)
+    device_ids = device_ids if isinstance(device_ids, list) else [device_ids]
+    results = run_parallel(
+        lambda payload: check_result(requests.delete(f"{url}/api/device-groups/{guid}/devices", headers=headers, json=payload)),
+        chunks(device_ids),
+    )
+    return results[0] if len(results) == 1 else f"Success: {len(device_ids)} device(s) in {len(results)} requests"
 
 
 def parse_rules(s):
@@ -221,6 +234,8 @@ def main():
     parser.add_argument("--device-username", help="Device username filter (logged in user on device, for view-devices)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
     while args.url.endswith("/"): args.url = args.url[:-1]
 
     if args.command == "view":
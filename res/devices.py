@@ -4,6 +4,9 @@ import requests
 import argparse
 from datetime import datetime, timedelta
 
+import instrument
+import limiter
+
 
 def view(
     url,
@@ -151,6 +154,8 @@ def main():
     )
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
     
     while args.url.endswith("/"): args.url = args.url[:-1]
 
@@ -1,82 +1,261 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
+import os
 import re
+import sys
+
+UI_DIR = 'src/ui'
+OUTPUT = 'src/ui/inline.rs'
+# Input hashes and generated code of every bundle, to rebuild only the changed ones.
+CACHE = 'src/ui/.inline-cache.json'
+
+# (const name, getter, page, files included into the page)
+# .css files replace "@import url(<file>);", .tis files replace 'include "<file>";'
+# common.css and common.tis are included at build time, the pages need no replacing at runtime.
+BUNDLES = [
+    ('_INDEX', 'get_index', 'index.html',
+     ['common.css', 'index.css', 'common.tis', 'index.tis', 'msgbox.tis', 'ab.tis']),
+    ('_REMOTE', 'get_remote', 'remote.html', [
+        'common.css', 'remote.css', 'header.css', 'file_transfer.css', 'common.tis', 'remote.tis',
+        'msgbox.tis', 'grid.tis', 'header.tis', 'file_transfer.tis', 'port_forward.tis', 'printer.tis',
+    ]),
+    ('_INSTALL', 'get_install', 'install.html', ['common.css', 'common.tis', 'install.tis']),
+    ('_CHATBOX', 'get_chatbox', 'chatbox.html', ['common.css', 'common.tis']),
+    ('_CONNECTION_MANAGER', 'get_cm', 'cm.html', ['common.css', 'cm.css', 'common.tis', 'cm.tis']),
+]
+
+# Code characters after which a "/" starts a regex literal instead of a division.
+REGEX_PREFIX = set('(,=:[!&|?{;+-*%~^')
 
 
 def strip(s): return re.sub(r'\s+\n', '\n', re.sub(r'\n\s+', '\n', s))
 
-common_css = open('src/ui/common.css').read()
-common_tis = open('src/ui/common.tis', encoding='UTF8').read()
-
-index = open('src/ui/index.html').read() \
-    .replace('@import url(index.css);', open('src/ui/index.css').read()) \
-    .replace('include "index.tis";', open('src/ui/index.tis').read()) \
-    .replace('include "msgbox.tis";', open('src/ui/msgbox.tis').read()) \
-    .replace('include "ab.tis";', open('src/ui/ab.tis').read())
-
-remote = open('src/ui/remote.html').read() \
-    .replace('@import url(remote.css);', open('src/ui/remote.css').read()) \
-    .replace('@import url(header.css);', open('src/ui/header.css').read()) \
-    .replace('@import url(file_transfer.css);', open('src/ui/file_transfer.css').read()) \
-    .replace('include "remote.tis";', open('src/ui/remote.tis').read()) \
-    .replace('include "msgbox.tis";', open('src/ui/msgbox.tis').read()) \
-    .replace('include "grid.tis";', open('src/ui/grid.tis').read()) \
-    .replace('include "header.tis";', open('src/ui/header.tis').read()) \
-    .replace('include "file_transfer.tis";', open('src/ui/file_transfer.tis').read()) \
-    .replace('include "port_forward.tis";', open('src/ui/port_forward.tis').read()) \
-    .replace('include "printer.tis";', open('src/ui/printer.tis').read())
-
-chatbox = open('src/ui/chatbox.html').read()
-install = open('src/ui/install.html').read().replace('include "install.tis";', open('src/ui/install.tis').read())
-
-cm = open('src/ui/cm.html').read() \
-    .replace('@import url(cm.css);', open('src/ui/cm.css').read()) \
-    .replace('include "cm.tis";', open('src/ui/cm.tis').read())
-
-
-def compress(s):
-    s = s.replace("\r\n", "\n")
-    x = bytes(s, encoding='utf-8')
+
+def read(name):
+    with open(os.path.join(UI_DIR, name), encoding='UTF8') as f:
+        return f.read()
+
+
+def tokenize(s, line_comments):
+    """Split css/tis source into (kind, text) tokens, kind is one of
+    'code', 'string', 'regex' or 'comment'. Strings and regexes never span lines."""
+    tokens = []
+    code_start = i = 0
+    n = len(s)
+
+    def flush(end):
+        if end > code_start:
+            tokens.append(('code', s[code_start:end]))
+
+    while i < n:
+        c = s[i]
+        kind = None
+        if c == '/' and s.startswith('/*', i):
+            end = s.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            kind = 'comment'
+        elif c == '/' and line_comments and s.startswith('//', i):
+            end = s.find('\n', i)
+            end = n if end < 0 else end
+            kind = 'comment'
+        elif c in '"\'' or (c == '/' and line_comments and regex_allowed(s, i)):
+            end = i + 1
+            in_class = False
+            while end < n and s[end] != '\n':
+                if s[end] == '\\':
+                    end += 2
+                    continue
+                if c == '/' and s[end] in '[]':
+                    in_class = s[end] == '['
+                elif s[end] == c and not in_class:
+                    break
+                end += 1
+            if end < n and s[end] == c:
+                end += 1
+                kind = 'string' if c != '/' else 'regex'
+        if kind is None:
+            i += 1
+            continue
+        flush(i)
+        tokens.append((kind, s[i:end]))
+        code_start = i = end
+    flush(n)
+    return tokens
+
+
+def regex_allowed(s, i):
+    j = i - 1
+    while j >= 0 and s[j] in ' \t':
+        j -= 1
+    if j < 0 or s[j] == '\n' or s[j] in REGEX_PREFIX:
+        return True
+    return s[max(0, j - 5):j + 1] == 'return'
+
+
+def minify_css(s):
+    # Comments may sit between declarations, drop them before squeezing the code around.
+    tokens = []
+    for kind, text in tokenize(s, False):
+        if kind == 'comment':
+            kind, text = 'code', ' '
+        if kind == 'code' and tokens and tokens[-1][0] == 'code':
+            tokens[-1] = ('code', tokens[-1][1] + text)
+        else:
+            tokens.append((kind, text))
+    out = []
+    for kind, text in tokens:
+        if kind == 'code':
+            text = re.sub(r'\s+', ' ', text)
+            text = re.sub(r' ?([{};,]) ?', r'\1', text)
+            text = re.sub(r': ', ':', text)
+            text = text.replace(';}', '}')
+        out.append(text)
+    return ''.join(out).strip()
+
+
+def minify_tis(s):
+    out = []
+    for kind, text in tokenize(s, True):
+        if kind == 'comment':
+            # Keep the line break a comment ends or spans, statements may rely on it.
+            out.append('\n' if '\n' in text or text.startswith('//') else ' ')
+            continue
+        if kind == 'code':
+            text = re.sub(r'[ \t]+', ' ', text)
+        out.append(text)
+    return re.sub(r'\n[ \n]*', '\n', ''.join(out)).strip()
+
+
+def directive(name):
+    if name.endswith('.css'):
+        return '@import url(%s);' % name
+    return 'include "%s";' % name
+
+
+def minify(name):
+    if name.endswith('.css'):
+        return minify_css(read(name))
+    return minify_tis(read(name))
+
+
+def bundle(page, includes):
+    s = read(page)
+    for name in includes:
+        s = s.replace(directive(name), minify(name))
+    return strip(s).replace("\r\n", "\n")
+
+
+def byte_literal(x):
     return '&[u8; ' + str(len(x)) + '] = b"' + str(x)[2:-1].replace(r"\'", "'").replace(r'"',
                                                                                   r'\"') + '"'
 
 
-with open('src/ui/inline.rs', 'wt') as fh:
-    fh.write('const _COMMON_CSS: ' + compress(strip(common_css)) + ';\n')
-    fh.write('const _COMMON_TIS: ' + compress(strip(common_tis)) + ';\n')
-    fh.write('const _INDEX: ' + compress(strip(index)) + ';\n')
-    fh.write('const _REMOTE: ' + compress(strip(remote)) + ';\n')
-    fh.write('const _CHATBOX: ' + compress(strip(chatbox)) + ';\n')
-    fh.write('const _INSTALL: ' + compress(strip(install)) + ';\n')
-    fh.write('const _CONNECTION_MANAGER: ' + compress(strip(cm)) + ';\n')
-    fh.write('''
-fn get(data: &[u8]) -> String {
-    String::from_utf8_lossy(data).to_string()
-}
-fn replace(data: &[u8]) -> String {
-    let css = get(&_COMMON_CSS[..]);
-    let res = get(data).replace("@import url(common.css);", &css);
-    let tis = get(&_COMMON_TIS[..]);
-    res.replace("include \\\"common.tis\\\";", &tis)
-}
-#[inline]
-pub fn get_index() -> String {
-    replace(&_INDEX[..])
-}
-#[inline]
-pub fn get_remote() -> String {
-    replace(&_REMOTE[..])
-}
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+HEADER = '// Generated by res/inline-sciter.py (%s), do not edit.\n'
+
+PLAIN_GETTER = '''
 #[inline]
-pub fn get_install() -> String {
-    replace(&_INSTALL[..])
+pub fn %(getter)s() -> String {
+    String::from_utf8_lossy(&%(const)s[..]).to_string()
 }
-#[inline]
-pub fn get_chatbox() -> String {
-    replace(&_CHATBOX[..])
+'''
+
+# Decompressed once, on first use of the page.
+BROTLI_PRELUDE = '''
+fn decompress(data: &[u8]) -> String {
+    use std::io::Read;
+    let mut res = String::new();
+    brotli_decompressor::Decompressor::new(data, 4096)
+        .read_to_string(&mut res)
+        .expect("corrupt brotli data in inline.rs, run res/inline-sciter.py --brotli --force");
+    res
 }
+'''
+
+BROTLI_GETTER = '''
 #[inline]
-pub fn get_cm() -> String {
-    replace(&_CONNECTION_MANAGER[..])
+pub fn %(getter)s() -> String {
+    lazy_static::lazy_static! {
+        static ref PAGE: String = decompress(&%(const)s[..]);
+    }
+    PAGE.clone()
 }
-''')
+'''
+
+
+def load_cache(script_hash, mode):
+    try:
+        with open(CACHE, encoding='utf8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # A change of this script or of the mode invalidates every bundle.
+    if cache.get('script') != script_hash or cache.get('mode') != mode:
+        return {}
+    return cache.get('bundles', {})
+
+
+def main():
+    args = sys.argv[1:]
+    force = '--force' in args
+    mode = 'brotli' if '--brotli' in args else 'plain'
+    if mode == 'brotli':
+        try:
+            import brotli
+        except ImportError:
+            print("Error: brotli is required for --brotli, run `pip3 install brotli`")
+            sys.exit(-1)
+    script_hash = file_hash(os.path.abspath(__file__))
+    cache = {} if force else load_cache(script_hash, mode)
+    hashes = {}
+    bundles = {}
+    rebuilt = []
+    size = packed = 0
+    for const, getter, page, includes in BUNDLES:
+        inputs = {}
+        for name in [page] + includes:
+            if name not in hashes:
+                hashes[name] = file_hash(os.path.join(UI_DIR, name))
+            inputs[name] = hashes[name]
+        cached = cache.get(const)
+        if not cached or cached['inputs'] != inputs:
+            data = bytes(bundle(page, includes), encoding='utf-8')
+            if mode == 'brotli':
+                data_packed = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+            else:
+                data_packed = data
+            code = 'const %s: %s;\n' % (const, byte_literal(data_packed))
+            cached = {'inputs': inputs, 'code': code, 'size': len(data), 'packed': len(data_packed)}
+            rebuilt.append(const)
+        bundles[const] = cached
+        size += cached['size']
+        packed += cached['packed']
+
+    getter_template = BROTLI_GETTER if mode == 'brotli' else PLAIN_GETTER
+    content = HEADER % mode + ''.join(bundles[const]['code'] for const, _, _, _ in BUNDLES)
+    if mode == 'brotli':
+        content += BROTLI_PRELUDE
+    content += ''.join(getter_template % {'const': const, 'getter': getter} for const, getter, _, _ in BUNDLES)
+    old = None
+    if os.path.exists(OUTPUT):
+        with open(OUTPUT, encoding='utf8') as f:
+            old = f.read()
+    # Don't touch inline.rs if nothing changed, or cargo would rebuild the crate.
+    if content != old:
+        with open(OUTPUT, 'wt', encoding='utf8') as fh:
+            fh.write(content)
+    with open(CACHE, 'wt', encoding='utf8') as f:
+        json.dump({'script': script_hash, 'mode': mode, 'bundles': bundles}, f)
+    print('inline-sciter: rebuilt %s, %s %s, %d bytes of pages embedded as %d bytes (%s)' % (
+        ', '.join(rebuilt) or 'nothing', 'wrote' if content != old else 'unchanged', OUTPUT,
+        size, packed, mode))
+
+
+if __name__ == '__main__':
+    main()
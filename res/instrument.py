@@ -0,0 +1,241 @@
+# Per-endpoint instrumentation of the console API calls of the admin scripts.
+#
+# install() hooks the HTTP adapter of `requests` like limiter.py and records, per method and
+# endpoint (the path with ids and guids replaced by {id}), a latency histogram, status code
+# counts, bytes sent and received and retries. A request counts as a retry when the same
+# method, URL and body failed before (429, 5xx or connection error).
+#
+# Nothing is recorded unless one of these is set, all are written when the script exits:
+#   RUSTDESK_API_METRICS_JSON=<file>  JSON summary ("-" for stderr)
+#   RUSTDESK_API_METRICS_PROM=<file>  Prometheus textfile, e.g. for the node_exporter textfile collector
+#   RUSTDESK_API_TRACE=<file>         OpenTelemetry (OTLP JSON) client spans, one per line, appended
+
+import atexit
+import collections
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+# Prometheus' default buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+ID_SEGMENT = re.compile(r"^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+|[0-9a-zA-Z_-]{20,})$")
+
+
+def endpoint_of(url):
+    """Path of `url` with id and guid segments replaced by {id}"""
+    return "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in urlsplit(url).path.split("/"))
+
+
+class Endpoint:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latencies = collections.deque(maxlen=10000)
+        self.statuses = collections.Counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+
+    def add(self, seconds, status, bytes_out, bytes_in, retry):
+        self.count += 1
+        self.seconds += seconds
+        self.latencies.append(seconds)
+        self.buckets[next((i for i, le in enumerate(BUCKETS) if seconds <= le), len(BUCKETS))] += 1
+        self.statuses[status] += 1
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.retries += retry
+
+    def percentile(self, p):
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+
+class Recorder:
+    def __init__(self, trace_path=None):
+        self.script = os.path.basename(sys.argv[0]) or "python"
+        self.started = time.time()
+        self.endpoints = collections.defaultdict(Endpoint)
+        self.failed = collections.OrderedDict()
+        self.trace_id = os.urandom(16).hex()
+        self.trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self.lock = threading.Lock()
+
+    def record(self, method, url, body, started, ended, status, bytes_in):
+        """Record one request, `status` is None for connection errors"""
+        # Streamed bodies (files, generators) are neither hashed nor counted
+        body = body.encode("utf-8") if isinstance(body, str) else body if isinstance(body, bytes) else b""
+        endpoint = endpoint_of(url)
+        fingerprint = hashlib.sha1(b"%s %s %s" % (method.encode(), url.encode(), body)).digest()
+        failed = status is None or status == 429 or status >= 500
+        with self.lock:
+            retry = self.failed.pop(fingerprint, None) is not None
+            if failed:
+                self.failed[fingerprint] = True
+                if len(self.failed) > 10000:
+                    self.failed.popitem(last=False)
+            self.endpoints[(method, endpoint)].add(
+                ended - started, str(status) if status else "error", len(body), bytes_in, retry)
+            if self.trace:
+                self.trace.write(json.dumps(self.span(method, url, endpoint, started, ended, status, retry)) + "\n")
+                self.trace.flush()
+
+    def span(self, method, url, endpoint, started, ended, status, retry):
+        attributes = {
+            "http.request.method": {"stringValue": method},
+            "url.full": {"stringValue": url},
+            "http.route": {"stringValue": endpoint},
+            "service.name": {"stringValue": self.script},
+        }
+        if status:
+            attributes["http.response.status_code"] = {"intValue": str(status)}
+        else:
+            attributes["error.type"] = {"stringValue": "connection"}
+        if retry:
+            attributes["http.request.resend_count"] = {"intValue": "1"}
+        return {
+            "traceId": self.trace_id,
+            "spanId": os.urandom(8).hex(),
+            "name": f"{method} {endpoint}",
+            "kind": 3,  # SPAN_KIND_CLIENT
+            "startTimeUnixNano": str(int(started * 1e9)),
+            "endTimeUnixNano": str(int(ended * 1e9)),
+            "attributes": [{"key": k, "value": v} for k, v in attributes.items()],
+            # STATUS_CODE_ERROR for connection errors and 5xx, unset otherwise
+            "status": {"code": 2} if not status or status >= 500 else {},
+        }
+
+    def summary(self):
+        with self.lock:
+            endpoints = {}
+            for (method, endpoint), e in sorted(self.endpoints.items(), key=lambda item: item[0][1]):
+                endpoints[f"{method} {endpoint}"] = {
+                    "count": e.count,
+                    "statuses": dict(e.statuses),
+                    "bytes_out": e.bytes_out,
+                    "bytes_in": e.bytes_in,
+                    "retries": e.retries,
+                    "latency_ms": {
+                        "mean": round(e.seconds / e.count * 1000, 1),
+                        "p50": round(e.percentile(50) * 1000, 1),
+                        "p90": round(e.percentile(90) * 1000, 1),
+                        "p99": round(e.percentile(99) * 1000, 1),
+                        "max": round(max(e.latencies) * 1000, 1),
+                    },
+                    "histogram": dict(zip([str(le) for le in BUCKETS] + ["+Inf"], e.buckets)),
+                }
+        return {
+            "script": self.script,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration_s": round(time.time() - self.started, 3),
+            "endpoints": endpoints,
+        }
+
+    def prometheus(self):
+        lines = [
+            "# HELP rustdesk_api_request_duration_seconds Console API request latency.",
+            "# TYPE rustdesk_api_request_duration_seconds histogram",
+        ]
+        with self.lock:
+            items = sorted(self.endpoints.items(), key=lambda item: (item[0][1], item[0][0]))
+            for (method, endpoint), e in items:
+                labels = f'script="{self.script}",method="{method}",endpoint="{endpoint}"'
+                cumulative = 0
+                for le, count in zip([str(le) for le in BUCKETS] + ["+Inf"], e.buckets):
+                    cumulative += count
+                    lines.append(f'rustdesk_api_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"rustdesk_api_request_duration_seconds_sum{{{labels}}} {e.seconds:.6f}")
+                lines.append(f"rustdesk_api_request_duration_seconds_count{{{labels}}} {e.count}")
+            for name, description, value in [
+                ("rustdesk_api_requests_total", "Console API requests by status code.", None),
+                ("rustdesk_api_request_bytes_total", "Bytes sent in console API request bodies.", "bytes_out"),
+                ("rustdesk_api_response_bytes_total", "Bytes received in console API response bodies.", "bytes_in"),
+                ("rustdesk_api_retries_total", "Console API requests repeating a failed one.", "retries"),
+            ]:
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+                for (method, endpoint), e in items:
+                    labels = f'script="{self.script}",method="{method}",endpoint="{endpoint}"'
+                    if value is None:
+                        for status, count in sorted(e.statuses.items()):
+                            lines.append(f'{name}{{{labels},status="{status}"}} {count}')
+                    else:
+                        lines.append(f"{name}{{{labels}}} {getattr(e, value)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prom_path=None):
+        if json_path == "-":
+            print(json.dumps(self.summary(), indent=2), file=sys.stderr)
+        elif json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f, indent=2)
+        if prom_path:
+            # Written through a temp file, the textfile collector must never see a partial file
+            tmp = prom_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp, prom_path)
+        if self.trace:
+            self.trace.close()
+            self.trace = None
+
+
+current = None
+_original_send = None
+
+
+def _send(adapter, request, **kwargs):
+    recorder = current
+    if recorder is None:
+        return _original_send(adapter, request, **kwargs)
+    started = time.time()
+    status = None
+    bytes_in = 0
+    try:
+        response = _original_send(adapter, request, **kwargs)
+        status = response.status_code
+        if kwargs.get("stream"):
+            bytes_in = int(response.headers.get("Content-Length") or 0)
+        else:
+            # Session.send reads the body right after anyway, read it here to time the download too
+            bytes_in = len(response.content)
+        return response
+    finally:
+        try:
+            recorder.record(request.method, request.url, request.body, started, time.time(), status, bytes_in)
+        except Exception as e:
+            # The metrics must never break the request they measure
+            print(f"Warning: failed to record {request.method} {request.url}: {e}", file=sys.stderr)
+
+
+def install(recorder=None):
+    """Record all requests in `recorder` (configured from the environment by default).
+
+    Install before limiter.install(), so the latency doesn't include the time waiting for the window."""
+    global current, _original_send
+    if recorder is None:
+        json_path = os.environ.get("RUSTDESK_API_METRICS_JSON")
+        prom_path = os.environ.get("RUSTDESK_API_METRICS_PROM")
+        trace_path = os.environ.get("RUSTDESK_API_TRACE")
+        if not (json_path or prom_path or trace_path):
+            return None
+        recorder = Recorder(trace_path)
+        atexit.register(recorder.write, json_path, prom_path)
+    if _original_send is None:
+        _original_send = requests.adapters.HTTPAdapter.send
+        requests.adapters.HTTPAdapter.send = _send
+    current = recorder
+    return recorder
+
+
+def uninstall():
+    global current
+    current = None
@@ -7,6 +7,8 @@ import argparse
 import logging
 import shutil
 import zipfile
+import hashlib
+import sys
 
 logging.basicConfig(
     level=logging.INFO,
@@ -198,12 +200,23 @@ SIGN_EXTENSIONS = [
 ]
 
 
+def hash_file(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def sign_files(dir_path, only_ext=None):
     if only_ext:
         only_ext = only_ext.split(",")
         for i in range(len(only_ext)):
             if not only_ext[i].startswith("."):
                 only_ext[i] = "." + only_ext[i]
+    # Group byte-identical files so each unique blob is uploaded and signed once,
+    # the signed result is then copied to every other path with the same content.
+    groups = {}
     for root, dirs, files in os.walk(dir_path):
         for file in files:
             file_path = os.path.join(root, file)
@@ -211,9 +224,20 @@ def sign_files(dir_path, only_ext=None):
             if only_ext and ext not in only_ext:
                 continue
             if ext in SIGN_EXTENSIONS:
-                if not sign_one_file(file_path):
-                    logging.error(f"Failed to sign {file_path}")
-                    break
+                groups.setdefault(hash_file(file_path), []).append(file_path)
+    for paths in groups.values():
+        if not sign_one_file(paths[0]):
+            logging.error(f"Failed to sign {paths[0]}")
+            return False
+        for file_path in paths[1:]:
+            shutil.copy2(paths[0], file_path)
+            logging.info(f"Signed {file_path} (copied from {paths[0]})")
+    total = sum(len(paths) for paths in groups.values())
+    saved = total - len(groups)
+    logging.info(
+        f"{len(groups)} unique files for {total} paths, saved {saved} uploads"
+    )
+    return True
 
 
 def main():
@@ -296,7 +320,9 @@ def main():
     if args.command == "sign_one_file":
         sign_one_file(args.file_path)
     elif args.command == "sign_files":
-        sign_files(args.dir_path, args.only_ext)
+        # Fail the build step, an unsigned file must not be packaged
+        if not sign_files(args.dir_path, args.only_ext):
+            sys.exit(1)
     elif args.command == "fetch":
         print(fetch())
     elif args.command == "update_status":
@@ -2,30 +2,101 @@
 
 import os
 import glob
+import json
+import struct
+import zlib
+import re
 import sys
 import csv
+import time
+import concurrent.futures
+
+# A Rust string literal body: runs of any char but " \ and newline, separated by escape
+# sequences (the unrolled form of (?:[^"\\\n]|\\.)*, which is much faster).
+LITERAL = r'[^"\\\n]*(?:\\.[^"\\\n]*)*'
+# One ("key", "value"), tuple per line, the groups are the key and the value as written
+# in the source (still escaped).
+ENTRY_RE = re.compile(r'^[ \t]*\("(' + LITERAL + r')",[ \t]*"(' + LITERAL + r')"\),?[ \t]*$', re.M)
+# Characters which may follow a \ in a Rust string literal (\u{...} and \x.. included).
+ESCAPES = 'nrt0\\"\'ux'
+ENTRY_START_RE = re.compile(r'^[ \t]*\("', re.M)
+
+
+def parse_entries(text, fn='<string>'):
+    # Tokenize every ("key", "value"), tuple of text in one pass.
+    # Returns [(key, value, value_start, value_end)], key and value are kept escaped, so
+    # writing them back reproduces the source exactly.
+    entries = [(m.group(1), m.group(2), m.start(2), m.end(2)) for m in ENTRY_RE.finditer(text)]
+    if len(entries) != len(ENTRY_START_RE.findall(text)):
+        # Report the first line which looks like a tuple but is not a valid one.
+        for no, line in enumerate(text.splitlines(), 1):
+            if ENTRY_START_RE.match(line) and not ENTRY_RE.match(line):
+                raise ValueError('%s:%d: invalid translation entry: %s' % (fn, no, line.strip()))
+    return entries
+
+
+def read_entries(fn):
+    with open(fn, encoding='utf8') as f:
+        return parse_entries(f.read(), fn)
 
 
 def get_lang(lang):
     out = {}
-    for ln in open('./src/lang/%s.rs' % lang, encoding='utf8'):
-        ln = ln.strip()
-        if ln.startswith('("'):
-            k, v = line_split(ln)
-            out[k] = v
+    for k, v, _, _ in read_entries('./src/lang/%s.rs' % lang):
+        out[k] = v
     return out
 
 
-def line_split(line):
-    toks = line.split('", "')
-    if len(toks) != 2:
-        print(line)
-        assert 0
-    # Replace fixed position.
-    # Because toks[1] may be v") or v"),
-    k = toks[0][toks[0].find('"') + 1:]
-    v = toks[1][:toks[1].rfind('"')]
-    return k, v
+def unescape_literal(s):
+    # The string a Rust literal body stands for.
+    out = []
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c != '\\' or i + 1 == len(s):
+            out.append(c)
+            i += 1
+            continue
+        e = s[i + 1]
+        if e == 'u':
+            end = s.index('}', i)
+            out.append(chr(int(s[i + 3:end], 16)))
+            i = end + 1
+            continue
+        if e == 'x':
+            out.append(chr(int(s[i + 2:i + 4], 16)))
+            i += 4
+            continue
+        out.append({'n': '\n', 'r': '\r', 't': '\t', '0': '\0'}.get(e, e))
+        i += 2
+    return ''.join(out)
+
+
+def rust_escape(s):
+    # Rust literal body of a plain (unescaped) string.
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace(
+        '\r', '\\r').replace('\t', '\\t').replace('\0', '\\0')
+
+
+def escape_literal(s):
+    # Escape the bare " and \ of a value which may already contain escape sequences,
+    # so the result is always a valid literal body.
+    out = []
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c == '\\' and i + 1 < len(s) and s[i + 1] in ESCAPES:
+            out.append(s[i:i + 2])
+            i += 2
+            continue
+        if c == '\\' or c == '"':
+            out.append('\\' + c)
+        elif c == '\n':
+            out.append('\\n')
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out)
 
 
 def main():
@@ -33,30 +104,303 @@ def main():
         expand()
     elif sys.argv[1] == '1':
         to_csv()
+    elif sys.argv[1] == 'status':
+        status('--json' in sys.argv[2:])
+    elif sys.argv[1] == 'sync':
+        sync('--prune' in sys.argv[2:], '--dry-run' in sys.argv[2:])
+    elif sys.argv[1] == 'static':
+        opts = [a for a in sys.argv[2:] if not a.startswith('--')]
+        to_static(opts[0] if opts else './target/lang', '--bundle' in sys.argv[2:])
     else:
         to_rs(sys.argv[1])
 
 
-def expand():
-    for fn in glob.glob('./src/lang/*.rs'):
+def get_langs():
+    langs = []
+    for fn in sorted(glob.glob('./src/lang/*.rs')):
         lang = os.path.basename(fn)[:-3]
         if lang in ['en', 'template']: continue
-        print(lang)
-        dict = get_lang(lang)
-        fw = open("./src/lang/%s.rs" % lang, "wt", encoding='utf8')
-        for line in open('./src/lang/template.rs', encoding='utf8'):
-            line_strip = line.strip()
-            if line_strip.startswith('("'):
-                k, v = line_split(line_strip)
-                if k in dict:
-                    # embraced with " to avoid empty v
-                    line = line.replace('"%s"' % v, '"%s"' % dict[k])
-                else:
-                    line = line.replace(v, "")
-                fw.write(line)
-            else:
-                fw.write(line)
-        fw.close()
+        langs.append(lang)
+    return langs
+
+
+def build_key_index():
+    # Keys of template.rs in order, and {lang: {key: value}} of every language.
+    template = [k for k, _, _, _ in read_entries('./src/lang/template.rs')]
+    langs = {}
+    for lang in get_langs():
+        langs[lang] = get_lang(lang)
+    return template, langs
+
+
+def lang_status(template, dict):
+    template_keys = set(template)
+    return {
+        'missing': [k for k in template if k not in dict],
+        'extra': [k for k in dict if k not in template_keys],
+        'empty': [k for k in template if dict.get(k) == ''],
+    }
+
+
+def status(as_json=False):
+    template, langs = build_key_index()
+    report = {lang: lang_status(template, dict) for lang, dict in langs.items()}
+    if as_json:
+        print(json.dumps({'keys': len(template), 'langs': report}, indent=2, ensure_ascii=False))
+        return
+    print('%-8s %8s %8s %8s %8s' % ('lang', 'missing', 'extra', 'empty', 'done'))
+    for lang, r in report.items():
+        done = len(template) - len(r['missing']) - len(r['empty'])
+        print('%-8s %8d %8d %8d %7.1f%%' % (
+            lang, len(r['missing']), len(r['extra']), len(r['empty']), 100.0 * done / max(len(template), 1)))
+    print('%d keys in template.rs' % len(template))
+
+
+def sync_lang(lang, template, prune=False):
+    # Patch only the lines that need it: add the missing keys (with an empty value) after
+    # the previous template key present in the file, and remove unknown keys if prune.
+    # Unlike expand(), the order and the unknown keys of the file are kept.
+    fn = './src/lang/%s.rs' % lang
+    with open(fn, encoding='utf8') as f:
+        lines = f.readlines()
+    line_of = {}
+    last_entry = -1
+    for i, line in enumerate(lines):
+        m = ENTRY_RE.match(line)
+        if m:
+            line_of[m.group(1)] = i
+            last_entry = i
+    if last_entry == -1:
+        print('%s: no translation entries, skipped' % fn)
+        return [], []
+
+    template_keys = set(template)
+    removed = [k for k in line_of if k not in template_keys] if prune else []
+    # line index -> new lines to insert after it
+    inserts = {}
+    added = []
+    indent = re.match(r'[ \t]*', lines[last_entry]).group(0)
+    first_entry = min(line_of.values())
+    after = first_entry - 1
+    for k in template:
+        if k in line_of:
+            after = line_of[k]
+            continue
+        pos = after
+        inserts.setdefault(pos, []).append('%s("%s", ""),\n' % (indent, k))
+        added.append(k)
+
+    if added or removed:
+        drop = {line_of[k] for k in removed}
+        out = []
+        for i, line in enumerate(lines):
+            if i not in drop:
+                out.append(line)
+            out.extend(inserts.get(i, []))
+        with open(fn, 'wt', encoding='utf8') as fw:
+            fw.writelines(out)
+    return added, removed
+
+
+def sync(prune=False, dry_run=False):
+    start = time.time()
+    template, langs = build_key_index()
+    changed = 0
+    for lang, dict in langs.items():
+        if dry_run:
+            r = lang_status(template, dict)
+            added, removed = r['missing'], r['extra'] if prune else []
+        else:
+            added, removed = sync_lang(lang, template, prune)
+        if added or removed:
+            changed += 1
+            print('%s: +%d -%d' % (lang, len(added), len(removed)))
+            for k in added:
+                print('  + %s' % k)
+            for k in removed:
+                print('  - %s' % k)
+    print('%d of %d languages %s in %.3fs' % (
+        changed, len(langs), 'to change' if dry_run else 'changed', time.time() - start))
+
+
+def parse_template():
+    # Parse template.rs once into a list of text chunks and (key,) slots for the values,
+    # shared by every language.
+    with open('./src/lang/template.rs', encoding='utf8') as f:
+        text = f.read()
+    index = []
+    pos = 0
+    for k, _, start, end in parse_entries(text, './src/lang/template.rs'):
+        index.append(text[pos:start])
+        index.append((k,))
+        pos = end
+    index.append(text[pos:])
+    return index
+
+
+def expand_lang(lang, template):
+    dict = get_lang(lang)
+    out = []
+    for chunk in template:
+        if isinstance(chunk, tuple):
+            out.append(dict.get(chunk[0], ''))
+        else:
+            out.append(chunk)
+    content = ''.join(out)
+    fn = "./src/lang/%s.rs" % lang
+    with open(fn, encoding='utf8') as f:
+        if f.read() == content:
+            return lang, False
+    with open(fn, "wt", encoding='utf8') as fw:
+        fw.write(content)
+    return lang, True
+
+
+def expand():
+    template = parse_template()
+    langs = get_langs()
+    start = time.time()
+    if (os.cpu_count() or 1) > 1:
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            results = list(executor.map(expand_lang, langs, [template] * len(langs)))
+    else:
+        # A process pool only adds start-up cost on a single core.
+        results = [expand_lang(lang, template) for lang in langs]
+    changed = [lang for lang, written in results if written]
+    print("%d languages, %d changed: %s" % (len(langs), len(changed), ' '.join(changed)))
+    print("expand took %.3fs" % (time.time() - start))
+
+
+# Bundle of all languages, zlib compressed:
+#   b'RDLANG1\0', u32 uncompressed size, zlib(payload)
+# payload, for each language:
+#   u16 name length, name, u32 entry count,
+#   per entry sorted by key bytes: u16 key length, key, u32 value length, value
+# All integers are big endian, strings are UTF-8.
+BUNDLE_MAGIC = b'RDLANG1\0'
+
+
+def static_table(lang):
+    # {key: value} of a language with the escapes resolved and the empty values dropped,
+    # translate() falls back for those anyway. The last duplicate wins, like the HashMap.
+    table = {}
+    for k, v, _, _ in read_entries('./src/lang/%s.rs' % lang):
+        v = unescape_literal(v)
+        if v:
+            table[unescape_literal(k)] = v
+        else:
+            table.pop(unescape_literal(k), None)
+    # Sort by UTF-8 bytes, which is the order of Rust's str::cmp used by binary_search.
+    return sorted(table.items(), key=lambda kv: kv[0].encode('utf8'))
+
+
+def static_rs(entries):
+    out = ['// Generated by res/lang.py static, do not edit.\n',
+           '// Sorted by key, so lookups are a binary search on static data without any\n',
+           '// initialization at runtime.\n',
+           'pub static T: &[(&str, &str)] = &[\n']
+    for k, v in entries:
+        out.append('    ("%s", "%s"),\n' % (rust_escape(k), rust_escape(v)))
+    out.append('];\n\n')
+    out.append('pub fn get(key: &str) -> Option<&\'static str> {\n')
+    out.append('    T.binary_search_by(|(k, _)| (*k).cmp(key)).ok().map(|i| T[i].1)\n')
+    out.append('}\n')
+    return ''.join(out)
+
+
+def build_bundle(tables):
+    payload = []
+    for lang, entries in tables.items():
+        name = lang.encode('utf8')
+        payload.append(struct.pack('>H', len(name)) + name + struct.pack('>I', len(entries)))
+        for k, v in entries:
+            k = k.encode('utf8')
+            v = v.encode('utf8')
+            payload.append(struct.pack('>H', len(k)) + k + struct.pack('>I', len(v)) + v)
+    payload = b''.join(payload)
+    return BUNDLE_MAGIC + struct.pack('>I', len(payload)) + zlib.compress(payload, 9)
+
+
+def read_bundle(data):
+    if data[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        raise ValueError('bad bundle magic')
+    size, = struct.unpack_from('>I', data, len(BUNDLE_MAGIC))
+    payload = zlib.decompress(data[len(BUNDLE_MAGIC) + 4:])
+    if len(payload) != size:
+        raise ValueError('bad bundle size %d != %d' % (len(payload), size))
+    tables = {}
+    pos = 0
+    while pos < len(payload):
+        n, = struct.unpack_from('>H', payload, pos)
+        lang = payload[pos + 2:pos + 2 + n].decode('utf8')
+        count, = struct.unpack_from('>I', payload, pos + 2 + n)
+        pos += 6 + n
+        entries = []
+        for _ in range(count):
+            n, = struct.unpack_from('>H', payload, pos)
+            k = payload[pos + 2:pos + 2 + n].decode('utf8')
+            pos += 2 + n
+            n, = struct.unpack_from('>I', payload, pos)
+            v = payload[pos + 4:pos + 4 + n].decode('utf8')
+            pos += 4 + n
+            entries.append((k, v))
+        tables[lang] = entries
+    return tables
+
+
+def validate_static(out_dir, tables, bundle):
+    # Check the generated files against the source tables: same entries, sorted, no duplicates.
+    errors = []
+    for lang, entries in tables.items():
+        with open(os.path.join(out_dir, '%s.rs' % lang), encoding='utf8') as f:
+            parsed = [(unescape_literal(k), unescape_literal(v)) for k, v, _, _ in parse_entries(f.read())]
+        if parsed != entries:
+            errors.append('%s.rs does not match src/lang/%s.rs' % (lang, lang))
+        keys = [k.encode('utf8') for k, _ in parsed]
+        if any(a >= b for a, b in zip(keys, keys[1:])):
+            errors.append('%s.rs is not strictly sorted' % lang)
+    if bundle is not None and read_bundle(bundle) != tables:
+        errors.append('bundle does not match the source tables')
+    return errors
+
+
+def to_static(out_dir, bundle=False):
+    start = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+    tables = {}
+    for fn in sorted(glob.glob('./src/lang/*.rs')):
+        lang = os.path.basename(fn)[:-3]
+        if lang == 'template': continue
+        tables[lang] = static_table(lang)
+    for lang, entries in tables.items():
+        content = static_rs(entries)
+        fn = os.path.join(out_dir, '%s.rs' % lang)
+        if os.path.exists(fn):
+            with open(fn, encoding='utf8') as f:
+                if f.read() == content:
+                    continue
+        with open(fn, 'wt', encoding='utf8') as fw:
+            fw.write(content)
+    data = None
+    if bundle:
+        data = build_bundle(tables)
+        with open(os.path.join(out_dir, 'lang.bin'), 'wb') as fw:
+            fw.write(data)
+    errors = validate_static(out_dir, tables, data)
+    for e in errors:
+        print('Error: %s' % e)
+
+    src_size = sum(os.path.getsize('./src/lang/%s.rs' % lang) for lang in tables)
+    static_size = sum(os.path.getsize(os.path.join(out_dir, '%s.rs' % lang)) for lang in tables)
+    data_size = sum(len(k.encode('utf8')) + len(v.encode('utf8')) for t in tables.values() for k, v in t)
+    print('%d languages, %d entries with a value' % (len(tables), sum(len(t) for t in tables.values())))
+    print('  src/lang/*.rs:   %8d bytes' % src_size)
+    print('  static tables:   %8d bytes (%d bytes of string data)' % (static_size, data_size))
+    if data is not None:
+        print('  lang.bin bundle: %8d bytes' % len(data))
+    print('static took %.3fs' % (time.time() - start))
+    if errors:
+        sys.exit(-1)
 
 
 def to_csv():
@@ -64,11 +408,8 @@ def to_csv():
         lang = os.path.basename(fn)[:-3]
         csvfile = open('./src/lang/%s.csv' % lang, "wt", encoding='utf8')
         csvwriter = csv.writer(csvfile)
-        for line in open(fn, encoding='utf8'):
-            line_strip = line.strip()
-            if line_strip.startswith('("'):
-                k, v = line_split(line_strip)
-                csvwriter.writerow([k, v])
+        for k, v, _, _ in read_entries(fn):
+            csvwriter.writerow([k, v])
         csvfile.close()
 
 
@@ -80,11 +421,12 @@ pub static ref T: std::collections::HashMap<&'static str, &'static str> =
     [
 ''')
     for row in csv.reader(csvfile):
-        fw.write('        ("%s", "%s"),\n' % (row[0].replace('"', '\"'), row[1].replace('"', '\"')))
+        fw.write('        ("%s", "%s"),\n' % (escape_literal(row[0]), escape_literal(row[1])))
     fw.write('''    ].iter().cloned().collect();
 }
 ''')
     fw.close()
 
 
-main()
+if __name__ == '__main__':
+    main()
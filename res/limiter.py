@@ -0,0 +1,152 @@
+# Adaptive (AIMD) concurrency limit for the console API calls of the admin scripts.
+#
+# install() hooks the HTTP adapter of `requests`, so every call made by ab.py, users.py,
+# devices.py and the others passes through one shared window of in-flight requests. Each
+# successful, fast response grows the window by 1/window (about +1 per window's worth of
+# responses), a 429, 5xx or connection error halves it and a response slower than
+# `tolerance` times the baseline latency shrinks it by `slowdown`. Sequential scripts are
+# unaffected, the window only matters for the parallel modes.
+#
+# RUSTDESK_API_MAX_INFLIGHT caps the window (default 32), RUSTDESK_API_LIMITER=0 disables
+# the limiter and RUSTDESK_API_LIMITER_STATS=1 prints the window and latency percentiles to
+# stderr on exit.
+
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial=8, min_limit=1, max_limit=32, tolerance=2.0, backoff=0.5, slowdown=0.8, samples=500):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.slowdown = slowdown
+        self.inflight = 0
+        self.baseline = None
+        self.latencies = collections.deque(maxlen=samples)
+        self.counts = {"ok": 0, "slow": 0, "throttled": 0, "errors": 0}
+        self.increases = 0
+        self.decreases = 0
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot in the window, returns the start time to pass to release()"""
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+        return time.monotonic()
+
+    def release(self, started, status):
+        """Record the outcome of a request, `status` is None for connection errors"""
+        now = time.monotonic()
+        latency = now - started
+        with self.cond:
+            self.inflight -= 1
+            self.latencies.append(latency)
+            if status is None or status >= 500:
+                self.counts["errors"] += 1
+                self._decrease(started, now, self.backoff)
+            elif status == 429:
+                self.counts["throttled"] += 1
+                self._decrease(started, now, self.backoff)
+            else:
+                # The baseline is the lowest latency seen, slowly decaying so it follows the server
+                # if it gets permanently slower.
+                self.baseline = latency if self.baseline is None else min(latency, self.baseline * 1.001)
+                # Ignore sub-10ms jitter, on a fast network the ratio alone is too noisy.
+                if latency > self.baseline * self.tolerance and latency - self.baseline > 0.01:
+                    self.counts["slow"] += 1
+                    self._decrease(started, now, self.slowdown)
+                else:
+                    self.counts["ok"] += 1
+                    # Only grow while the window is actually used, an idle window says nothing.
+                    if self.inflight + 1 >= int(self.limit) and self.limit < self.max_limit:
+                        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                        self.increases += 1
+            self.cond.notify_all()
+
+    def _decrease(self, started, now, factor):
+        # At most once per round trip: responses to requests sent before the last decrease
+        # reflect the old window.
+        if started < self.last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_decrease = now
+        self.decreases += 1
+
+    def percentile(self, p):
+        with self.cond:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def stats(self):
+        """Current window and latency percentiles (ms) of the last samples"""
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        p50, p90, p99 = (self.percentile(p) for p in (50, 90, 99))
+        with self.cond:
+            return {
+                "window": round(self.limit, 2),
+                "inflight": self.inflight,
+                "baseline_ms": ms(self.baseline),
+                "p50_ms": ms(p50),
+                "p90_ms": ms(p90),
+                "p99_ms": ms(p99),
+                "increases": self.increases,
+                "decreases": self.decreases,
+                **self.counts,
+            }
+
+
+current = None
+_original_send = None
+
+
+def _send(adapter, request, **kwargs):
+    limiter = current
+    if limiter is None:
+        return _original_send(adapter, request, **kwargs)
+    started = limiter.acquire()
+    status = None
+    try:
+        response = _original_send(adapter, request, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        limiter.release(started, status)
+
+
+def install(limiter=None):
+    """Route all requests through `limiter` (configured from the environment by default)"""
+    global current, _original_send
+    if limiter is None:
+        if os.environ.get("RUSTDESK_API_LIMITER") == "0":
+            return None
+        limiter = AdaptiveLimiter(max_limit=int(os.environ.get("RUSTDESK_API_MAX_INFLIGHT", 32)))
+        if os.environ.get("RUSTDESK_API_LIMITER_STATS") == "1":
+            atexit.register(lambda: print(json.dumps(limiter.stats()), file=sys.stderr))
+    # Hook the adapter rather than Session.send, redirects call Session.send recursively.
+    if _original_send is None:
+        _original_send = requests.adapters.HTTPAdapter.send
+        requests.adapters.HTTPAdapter.send = _send
+    current = limiter
+    return limiter
+
+
+def uninstall():
+    global current
+    current = None
@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 import sys
 import uuid
 import argparse
+import difflib
+import time
 import datetime
 import subprocess
 import re
@@ -16,6 +19,13 @@ import shutil
 g_indent_unit = "\t"
 g_version = ""
 g_build_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+# dist dir -> {"files": [(path, subdir)], "size": int, "dirs": {subdir: [names]}}
+g_dist_scans = {}
+# Persisted "<kind>:<key>" -> GUID table, so components keep their identity between builds.
+g_component_table_file = "Package/ComponentGuids.json"
+g_component_table = None
+# filename -> {"transforms": [func(lines)], "tags": [(tag_start, tag_end, func(lines, index_start))]}
+g_templates = {}
 
 # Replace the following links with your own in the custom arp properties.
 # https://learn.microsoft.com/en-us/windows/win32/msi/property-reference
@@ -88,54 +98,114 @@ def make_parser():
         default="PURSLANE",
         help="The app manufacturer.",
     )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the diff of the generated files instead of writing them.",
+        default=False,
+    )
     return parser
 
 
-def read_lines_and_start_index(file_path, tag_start, tag_end):
-    with open(file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    index_start = -1
-    index_end = -1
-    for i, line in enumerate(lines):
-        if tag_start in line:
-            index_start = i
-        if tag_end in line:
-            index_end = i
+def get_component_table(app_name):
+    global g_component_table
+    if g_component_table is None:
+        g_component_table = {"app": app_name, "loaded": {}, "others": {}, "used": {}}
+        table_file = Path(sys.argv[0]).parent.joinpath(g_component_table_file)
+        if table_file.exists():
+            try:
+                with open(table_file, "r", encoding="utf-8") as f:
+                    content = json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Warning: ignore invalid component table {table_file}: {e}")
+                content = {}
+            # The table is keyed by app name, every white-label product has its own GUIDs.
+            # Entries of the old flat format don't say which product they belong to, drop them.
+            tables = {k: v for k, v in content.items() if isinstance(v, dict)}
+            g_component_table["loaded"] = tables.pop(app_name, {})
+            g_component_table["others"] = tables
+    return g_component_table
+
+
+def get_component_guid(app_name, key):
+    # Reuse the GUID persisted for this app if any, otherwise derive it from the app name
+    # and the key, so the same file or component always gets the same GUID.
+    table = get_component_table(app_name)
+    guid = table["loaded"].get(key)
+    if guid is None:
+        namespace = uuid.uuid5(uuid.NAMESPACE_OID, app_name + ".exe")
+        guid = str(uuid.uuid5(namespace, key))
+    table["used"][key] = guid
+    return guid
+
+
+def save_component_table():
+    if g_component_table is None:
+        return
+    # Only the GUIDs used by this build are kept for its app, stale entries are dropped.
+    # The tables of the other apps are kept as they are.
+    tables = dict(g_component_table["others"], **{g_component_table["app"]: g_component_table["used"]})
+    content = json.dumps(tables, indent=2, sort_keys=True) + "\n"
+    table_file = Path(sys.argv[0]).parent.joinpath(g_component_table_file)
+    if table_file.exists():
+        with open(table_file, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                return
+    with open(table_file, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def scan_dist_dir(dist_dir):
+    # Walk the dist dir once and cache the result, the component list, the estimated
+    # size and the directory map are all derived from this single scan.
+    key = str(dist_dir)
+    if key in g_dist_scans:
+        return g_dist_scans[key]
+
+    files = []
+    dirs = {}
+    total_size = 0
+    for root, dir_names, file_names in os.walk(dist_dir):
+        dir_names.sort()
+        subdir = os.path.relpath(root, dist_dir)
+        dir_files = dirs.setdefault(subdir, [])
+        for name in sorted(file_names):
+            file_path = Path(root, name)
+            total_size += file_path.stat().st_size
+            files.append((file_path, subdir))
+            dir_files.append(name)
 
-    if index_start == -1:
-        print(f'Error: start tag "{tag_start}" not found')
-        return None, None
-    if index_end == -1:
-        print(f'Error: end tag "{tag_end}" not found')
-        return None, None
-    return lines, index_start
+    scan = {"files": files, "size": total_size, "dirs": dirs}
+    g_dist_scans[key] = scan
+    return scan
 
 
 def insert_components_between_tags(lines, index_start, app_name, dist_dir):
     indent = g_indent_unit * 3
-    path = Path(dist_dir)
-    idx = 1
-    for file_path in path.glob("**/*"):
-        if file_path.is_file():
-            if file_path.name.lower() == f"{app_name}.exe".lower():
-                continue
-
-            subdir = str(file_path.parent.relative_to(path))
-            dir_attr = ""
-            if subdir != ".":
-                dir_attr = f'Subdirectory="{subdir}"'
-
-            # Don't generate Component Id and File Id like 'Component_{idx}' and 'File_{idx}'
-            # because it will cause error
-            # "Error WIX0130	The primary key 'xxxx' is duplicated in table 'Directory'"
-            to_insert_lines = f"""
-{indent}<Component Guid="{uuid.uuid4()}" {dir_attr}>
+    scan = scan_dist_dir(dist_dir)
+    app_exe = f"{app_name}.exe".lower()
+    to_insert_lines = []
+    for file_path, subdir in scan["files"]:
+        if file_path.name.lower() == app_exe:
+            continue
+
+        dir_attr = ""
+        rel_path = file_path.name
+        if subdir != ".":
+            dir_attr = f'Subdirectory="{subdir}"'
+            rel_path = Path(subdir, file_path.name).as_posix()
+        guid = get_component_guid(app_name, f"file:{rel_path}")
+
+        # Don't generate Component Id and File Id like 'Component_{idx}' and 'File_{idx}'
+        # because it will cause error
+        # "Error WIX0130	The primary key 'xxxx' is duplicated in table 'Directory'"
+        to_insert_lines.append(
+            f"""{indent}<Component Guid="{guid}" {dir_attr}>
 {indent}{g_indent_unit}<File Source="{file_path.as_posix()}" KeyPath="yes" Checksum="yes" />
 {indent}</Component>
 """
-            lines.insert(index_start + 1, to_insert_lines[1:])
-            index_start += 1
-            idx += 1
+        )
+    lines[index_start + 1 : index_start + 1] = to_insert_lines
     return True
 
 
@@ -207,7 +277,7 @@ def gen_upgrade_info():
 
         vs = g_version.split(".")
         major = vs[0]
-        upgrade_id = uuid.uuid4()
+        upgrade_id = uuid.uuid5(uuid.NAMESPACE_OID, f"{app_name}.exe.upgrade.{major}")
         to_insert_lines = [
             f'{indent}<Upgrade Id="{upgrade_id}">\n',
             f'{indent}{g_indent_unit}<UpgradeVersion Property="OLD_VERSION_FOUND" Minimum="{major}.0.0" Maximum="{major}.99.99" IncludeMinimum="yes" IncludeMaximum="yes" OnlyDetect="no" IgnoreRemoveFailure="yes" MigrateFeatures="yes" />\n',
@@ -292,14 +362,7 @@ def gen_custom_ARPSYSTEMCOMPONENT_False(args):
 
 
 def get_folder_size(folder_path):
-    total_size = 0
-
-    folder = Path(folder_path)
-    for file in folder.glob("**/*"):
-        if file.is_file():
-            total_size += file.stat().st_size
-
-    return total_size
+    return scan_dist_dir(folder_path)["size"]
 
 
 def gen_custom_ARPSYSTEMCOMPONENT_True(args, dist_dir):
@@ -425,18 +488,92 @@ def gen_conn_type(args):
         func,
     )
 
+def get_template(filename):
+    return g_templates.setdefault(filename, {"transforms": [], "tags": []})
+
+
 def gen_content_between_tags(filename, tag_start, tag_end, func):
-    target_file = Path(sys.argv[0]).parent.joinpath(filename)
-    lines, index_start = read_lines_and_start_index(target_file, tag_start, tag_end)
-    if lines is None:
-        return False
+    # The content is generated later by render_templates(), which loads and writes each file once.
+    get_template(filename)["tags"].append((tag_start, tag_end, func))
+    return True
 
-    func(lines, index_start)
 
-    with open(target_file, "w", encoding="utf-8") as f:
-        f.writelines(lines)
+def render_template_lines(lines, template):
+    for transform in template["transforms"]:
+        lines = transform(lines)
 
-    return True
+    # Locate every registered tag in a single scan.
+    tags = template["tags"]
+    starts = {}
+    ends = {}
+    for i, line in enumerate(lines):
+        for tag_start, tag_end, _ in tags:
+            if tag_start in line:
+                starts[tag_start] = i
+            if tag_end in line:
+                ends.setdefault(tag_end, []).append(i)
+
+    regions = []
+    for tag_start, tag_end, func in tags:
+        if tag_start not in starts:
+            print(f'Error: start tag "{tag_start}" not found')
+            return None
+        index_start = starts[tag_start]
+        index_end = next((i for i in ends.get(tag_end, []) if i > index_start), -1)
+        if index_end == -1:
+            print(f'Error: end tag "{tag_end}" not found')
+            return None
+        regions.append((index_start, index_end, func))
+
+    # Replace from the bottom up, so the indexes of the remaining regions stay valid.
+    # The content generated by a previous run is dropped, so the output is the same on every run.
+    for index_start, index_end, func in sorted(regions, key=lambda r: r[0], reverse=True):
+        block = []
+        func(block, -1)
+        lines[index_start + 1 : index_end] = block
+    return lines
+
+
+def render_templates(dry_run=False):
+    ok = True
+    changed = 0
+    timings = []
+    t_total = time.perf_counter()
+    for filename, template in g_templates.items():
+        t_file = time.perf_counter()
+        target_file = Path(sys.argv[0]).parent.joinpath(filename)
+        with open(target_file, "r", encoding="utf-8") as f:
+            old_lines = f.readlines()
+        lines = render_template_lines(list(old_lines), template)
+        if lines is None:
+            print(f"Error: failed to render {target_file}")
+            ok = False
+            continue
+        # Generated entries may span several lines, so compare the joined content.
+        content = "".join(lines)
+        if content != "".join(old_lines):
+            changed += 1
+            if dry_run:
+                sys.stdout.writelines(
+                    difflib.unified_diff(
+                        old_lines,
+                        content.splitlines(keepends=True),
+                        str(target_file),
+                        str(target_file),
+                    )
+                )
+            else:
+                with open(target_file, "w", encoding="utf-8") as f:
+                    f.write(content)
+        timings.append((filename, time.perf_counter() - t_file))
+
+    for filename, t in timings:
+        print(f"  {filename}: {t * 1000:.1f} ms")
+    print(
+        f"Rendered {len(timings)} files ({changed} changed{', dry run' if dry_run else ''}) "
+        f"in {(time.perf_counter() - t_total) * 1000:.1f} ms"
+    )
+    return ok
 
 
 def prepare_resources():
@@ -502,20 +639,23 @@ def update_license_file(app_name):
         f.write(license_content)
 
 
-def replace_component_guids_in_wxs():
+def replace_component_guids_in_wxs(app_name):
     langs_dir = Path(sys.argv[0]).parent.joinpath("Package")
-    for file_path in langs_dir.glob("**/*.wxs"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        # <Component Id="Product.Registry.DefaultIcon" Guid="6DBF2690-0955-4C6A-940F-634DDA503F49">
-        for i, line in enumerate(lines):
-            match = re.search(r'Component.+Guid="([^"]+)"', line)
-            if match:
-                lines[i] = re.sub(r'Guid="[^"]+"', f'Guid="{uuid.uuid4()}"', line)
-
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.writelines(lines)
+    for file_path in sorted(langs_dir.glob("**/*.wxs")):
+
+        def transform(lines):
+            # <Component Id="Product.Registry.DefaultIcon" Guid="6DBF2690-0955-4C6A-940F-634DDA503F49">
+            # Components without Id are generated between tags and get their GUIDs there.
+            for i, line in enumerate(lines):
+                match = re.search(r'Component\s+Id="([^"]+)".*Guid="([^"]+)"', line)
+                if match:
+                    guid = get_component_guid(app_name, f"wxs:{match.group(1)}").upper()
+                    lines[i] = re.sub(r'Guid="[^"]+"', f'Guid="{guid}"', line)
+            return lines
+
+        get_template(file_path.relative_to(langs_dir.parent).as_posix())["transforms"].append(
+            transform
+        )
 
 
 if __name__ == "__main__":
@@ -531,13 +671,11 @@ if __name__ == "__main__":
     if not init_global_vars(dist_dir, app_name, args):
         sys.exit(-1)
 
-    update_license_file(app_name)
-
     if not gen_pre_vars(args, dist_dir):
         sys.exit(-1)
 
     if app_name != "RustDesk":
-        replace_component_guids_in_wxs()
+        replace_component_guids_in_wxs(app_name)
 
     if not gen_upgrade_info():
         sys.exit(-1)
@@ -554,5 +692,15 @@ if __name__ == "__main__":
     if not gen_custom_dialog_bitmaps():
         sys.exit(-1)
 
+    if not render_templates(args.dry_run):
+        sys.exit(-1)
+
+    if args.dry_run:
+        sys.exit(0)
+
+    update_license_file(app_name)
+
     replace_app_name_in_langs(args.app_name)
     replace_app_name_in_custom_actions(args.app_name)
+
+    save_component_table()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import json
+import sys
+import time
+
+import requests
+
+import instrument
+import limiter
+from snapshot import ApiError, Client, fetch_all
+
+# Bring user groups, device groups, strategies and address book rules to the state described
+# in a YAML (or JSON) file:
+#
+#   user_groups:
+#     - name: eng
+#       note: Engineering
+#       users: [alice, bob]                       # members, added if missing
+#       accessed_from: [{type: 0, name: ops}]     # same as user-groups.py --accessed-from
+#       access_to: [{type: 1, name: lab}]
+#   device_groups:
+#     - name: lab
+#       devices: ["123456789"]                    # device IDs
+#       accessed_from: [{type: 0, name: eng}]
+#   strategies:
+#     - name: default
+#       enabled: true
+#       users: [alice]
+#       devices: ["123456789"]
+#       device_groups: [lab]
+#   address_books:
+#     - name: Shared
+#       rules:
+#         - {user: alice, permission: rw}
+#         - {group: eng, permission: ro}
+#         - {everyone: true, permission: ro}
+#   prune: false                                  # delete groups missing from the file, only for the
+#                                                 # group kinds (user_groups/device_groups) the file lists
+#
+#   python3 res/reconcile.py plan --url http://console:21114 --token xxx state.yaml
+#   python3 res/reconcile.py apply --url http://console:21114 --token xxx state.yaml
+#
+# The current state is listed concurrently, once, and all names are resolved from it. Changes
+# run in two phases with bounded parallelism: groups first, then memberships, strategy
+# assignments, address book rules and group access rules naming the new groups.
+
+PERMISSIONS = {"ro": 1, "rw": 2, "full": 3}
+
+
+def load_state_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                print("Error: PyYAML is required for YAML files, run `pip3 install pyyaml`")
+                exit(1)
+            desired = yaml.safe_load(f) or {}
+        else:
+            desired = json.load(f)
+    for kind in ["user_groups", "device_groups", "strategies", "address_books"]:
+        names = [x.get("name") for x in desired.get(kind) or []]
+        if None in names or len(set(names)) != len(names):
+            print(f"Error: every entry of {kind} needs a unique name")
+            exit(1)
+    return desired
+
+
+def list_current(client, desired, jobs):
+    """List everything the desired state refers to, concurrently."""
+    lists = {
+        "user_groups": ("/api/user-groups", {}),
+        "device_groups": ("/api/device-groups", {}),
+        "users": ("/api/users", {}),
+        "devices": ("/api/devices", {}),
+        "address_books": ("/api/ab/shared/profiles", {}),
+    }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pages, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(lists) + 1) as executor:
+        futures = {
+            kind: executor.submit(fetch_all, client, pages, kind, path, params)
+            for kind, (path, params) in lists.items()
+        }
+        futures["strategies"] = executor.submit(client.get, "strategies", "/api/strategies")
+        current = {kind: future.result() or [] for kind, future in futures.items()}
+        if isinstance(current["strategies"], dict):
+            current["strategies"] = current["strategies"].get("data", [])
+
+        books = {ab["name"]: ab for ab in current["address_books"]}
+        rule_futures = {
+            ab["name"]: executor.submit(fetch_all, client, pages, "ab_rules", "/api/ab/rules", {"ab": books[ab["name"]]["guid"]})
+            for ab in desired.get("address_books") or []
+            if ab["name"] in books
+        }
+        current["ab_rules"] = {name: future.result() for name, future in rule_futures.items()}
+    return current
+
+
+def index(rows, key):
+    return {row.get(key): row for row in rows}
+
+
+def action(phase, desc, resource, method, path, payload=None, ref=None):
+    # `ref` is (kind, name) of a group created in phase 1, its guid replaces {guid} in `path`.
+    return {"phase": phase, "desc": desc, "resource": resource, "method": method, "path": path,
+            "payload": payload, "ref": ref}
+
+
+def rule_names(rules):
+    return {(r.get("type"), r.get("name")) for r in rules or []}
+
+
+def plan_groups(kind, path, desired, current, new_names, actions):
+    existing = index(current[kind], "name")
+    rule_keys = ["accessed_from", "access_to"] if kind == "user_groups" else ["accessed_from"]
+    api_keys = {"accessed_from": "allowed_incomings", "access_to": "allowed_outgoings"}
+    label = kind[:-1].replace("_", " ")
+    for group in desired.get(kind) or []:
+        name = group["name"]
+        payload = {}
+        if group.get("note") is not None:
+            payload["note"] = group["note"]
+        for key in rule_keys:
+            if group.get(key) is not None:
+                payload[api_keys[key]] = group[key]
+        if name not in existing:
+            create = dict(payload, name=name)
+            rules = {k: v for k, v in payload.items() if k.startswith("allowed_")}
+            # Rules naming groups created by this run are set once those exist.
+            if rules and any(r.get("name") in new_names for v in rules.values() for r in v):
+                create = {k: v for k, v in create.items() if k not in rules}
+                actions.append(action(2, f"~ {label} {name}: rules", kind, "PATCH", path + "/{guid}",
+                                      rules, ref=(kind, name)))
+            actions.append(action(1, f"+ {label} {name}", kind, "POST", path, create))
+            continue
+        g = existing[name]
+        changed = [
+            k for k, v in payload.items()
+            if (rule_names(g.get(k)) != rule_names(v) if k.startswith("allowed_") else g.get(k) != v)
+        ]
+        # Like for a new group, rules naming groups created by this run wait for phase 2.
+        late = [k for k in changed if k.startswith("allowed_") and any(r.get("name") in new_names for r in payload[k])]
+        for phase, keys in [(1, [k for k in changed if k not in late]), (2, late)]:
+            if keys:
+                actions.append(action(phase, f"~ {label} {name}: {', '.join(keys)}", kind, "PATCH",
+                                      f"{path}/{g['guid']}", {k: payload[k] for k in keys}))
+    # A kind missing from the file isn't managed by it, pruning it would delete every group.
+    if desired.get("prune") and desired.get(kind) is not None:
+        names = {g["name"] for g in desired[kind]}
+        for g in current[kind]:
+            if g.get("name") not in names:
+                actions.append(action(1, f"- {label} {g.get('name')}", kind, "DELETE", f"{path}/{g['guid']}"))
+
+
+def plan_memberships(desired, current, actions, errors):
+    users = index(current["users"], "name")
+    devices = index(current["devices"], "id")
+    groups = index(current["user_groups"], "name")
+    for group in desired.get("user_groups") or []:
+        missing = [u for u in group.get("users") or [] if u not in users]
+        errors.extend(f"user '{u}' not found (user group {group['name']})" for u in missing)
+        to_add = [u for u in group.get("users") or [] if u in users and users[u].get("group_name") != group["name"]]
+        if not to_add:
+            continue
+        guid = groups.get(group["name"], {}).get("guid")
+        actions.append(action(2, f"+ {len(to_add)} users -> user group {group['name']} ({', '.join(to_add)})",
+                              "user_groups", "POST", f"/api/user-groups/{guid or '{guid}'}",
+                              [users[u]["guid"] for u in to_add],
+                              ref=None if guid else ("user_groups", group["name"])))
+    groups = index(current["device_groups"], "name")
+    for group in desired.get("device_groups") or []:
+        missing = [d for d in group.get("devices") or [] if d not in devices]
+        errors.extend(f"device '{d}' not found (device group {group['name']})" for d in missing)
+        to_add = [d for d in group.get("devices") or []
+                  if d in devices and devices[d].get("device_group_name") != group["name"]]
+        if not to_add:
+            continue
+        guid = groups.get(group["name"], {}).get("guid")
+        actions.append(action(2, f"+ {len(to_add)} devices -> device group {group['name']} ({', '.join(to_add)})",
+                              "device_groups", "POST", f"/api/device-groups/{guid or '{guid}'}", to_add,
+                              ref=None if guid else ("device_groups", group["name"])))
+
+
+def plan_strategies(desired, current, actions, errors):
+    strategies = index(current["strategies"], "name")
+    users = index(current["users"], "name")
+    devices = index(current["devices"], "id")
+    groups = index(current["device_groups"], "name")
+    for strategy in desired.get("strategies") or []:
+        name = strategy["name"]
+        s = strategies.get(name)
+        if not s:
+            errors.append(f"strategy '{name}' not found, strategies are created in the web console")
+            continue
+        enabled = strategy.get("enabled")
+        current_enabled = s.get("enabled", s.get("status"))
+        if enabled is not None and bool(current_enabled) != bool(enabled):
+            actions.append(action(1, f"~ strategy {name}: {'enable' if enabled else 'disable'}", "strategies",
+                                  "PUT", f"/api/strategies/{s['guid']}/status", bool(enabled)))
+        # Targets whose rows tell their strategy are skipped if already assigned.
+        targets = {"peers": [], "users": [], "groups": []}
+        names = []
+        for key, rows, field, values in [
+            ("peers", devices, "id", strategy.get("devices")),
+            ("users", users, "name", strategy.get("users")),
+            ("groups", groups, "name", strategy.get("device_groups")),
+        ]:
+            for value in values or []:
+                row = rows.get(value)
+                if row is None and not (key == "groups" and value in {g["name"] for g in desired.get("device_groups") or []}):
+                    errors.append(f"{field} '{value}' not found (strategy {name})")
+                    continue
+                if row is not None and row.get("strategy_name") == name:
+                    continue
+                targets[key].append(row["guid"] if row else ("device_groups", value))
+                names.append(value)
+        if names:
+            actions.append(action(2, f"+ strategy {name} -> {', '.join(names)}", "strategies", "POST",
+                                  "/api/strategies/assign", dict(targets, strategy=s["guid"])))
+
+
+def plan_ab_rules(desired, current, actions, errors):
+    books = index(current["address_books"], "name")
+    for book in desired.get("address_books") or []:
+        ab = books.get(book["name"])
+        if not ab:
+            errors.append(f"address book '{book['name']}' not found")
+            continue
+        existing = {}
+        for r in current["ab_rules"].get(book["name"], []):
+            existing[(r.get("user") or None, r.get("group") or None)] = r
+        for rule in book.get("rules") or []:
+            permission = PERMISSIONS.get(str(rule.get("permission", "ro")).lower())
+            if permission is None:
+                errors.append(f"invalid permission {rule.get('permission')} (address book {book['name']})")
+                continue
+            key = (rule.get("user"), rule.get("group"))
+            target = rule.get("user") or rule.get("group") or "everyone"
+            r = existing.get(key)
+            if r is None:
+                payload = {"guid": ab["guid"], "rule": permission}
+                if rule.get("user"):
+                    payload["user"] = rule["user"]
+                elif rule.get("group"):
+                    payload["group"] = rule["group"]
+                actions.append(action(2, f"+ rule {target}={rule.get('permission', 'ro')} on address book {book['name']}",
+                                      "ab_rules", "POST", "/api/ab/rule", payload))
+            elif r.get("rule") != permission:
+                actions.append(action(2, f"~ rule {target}={rule.get('permission')} on address book {book['name']}",
+                                      "ab_rules", "PATCH", "/api/ab/rule", {"guid": r["guid"], "rule": permission}))
+
+
+def make_plan(desired, current):
+    actions = []
+    errors = []
+    new_names = (
+        {g["name"] for g in desired.get("user_groups") or []} - {g.get("name") for g in current["user_groups"]}
+    ) | (
+        {g["name"] for g in desired.get("device_groups") or []} - {g.get("name") for g in current["device_groups"]}
+    )
+    plan_groups("user_groups", "/api/user-groups", desired, current, new_names, actions)
+    plan_groups("device_groups", "/api/device-groups", desired, current, new_names, actions)
+    plan_memberships(desired, current, actions, errors)
+    plan_strategies(desired, current, actions, errors)
+    plan_ab_rules(desired, current, actions, errors)
+    return actions, errors
+
+
+def naive_calls(desired):
+    """Calls made by replaying every entry of the desired state with the single item scripts."""
+    calls = 0
+    for kind in ["user_groups", "device_groups"]:
+        for group in desired.get(kind) or []:
+            calls += 2  # update_group: lookup + PATCH (or create)
+            members = group.get("users") or []
+            if members:
+                calls += 2 + len(members)  # add_users: group lookup, a lookup per user, POST
+            if group.get("devices"):
+                calls += 2  # add_devices: group lookup + POST
+    for strategy in desired.get("strategies") or []:
+        if strategy.get("enabled") is not None:
+            calls += 2  # enable/disable: list + PUT
+        targets = sum(len(strategy.get(k) or []) for k in ["users", "devices", "device_groups"])
+        if targets:
+            calls += 2 + targets  # assign_strategy: list, a lookup per target, POST
+    for book in desired.get("address_books") or []:
+        calls += 2 * len(book.get("rules") or [])  # get_ab_by_name + add_ab_rule
+    return calls
+
+
+def resolve_refs(act, guids):
+    if act["ref"]:
+        act["path"] = act["path"].replace("{guid}", guids[act["ref"]])
+    payload = act["payload"]
+    if isinstance(payload, dict) and "groups" in payload:
+        payload["groups"] = [guids[g] if isinstance(g, tuple) else g for g in payload["groups"]]
+    return act
+
+
+def run_phase(client, actions, jobs):
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(client.send, a["resource"], a["method"], a["path"], a["payload"]): a for a in actions
+        }
+        for future in concurrent.futures.as_completed(futures):
+            a = futures[future]
+            ok, result = future.result()
+            print(f"{'ok' if ok else 'FAILED'}: {a['desc']}" + ("" if ok else f": {result}"))
+            if not ok:
+                failures.append((a, result))
+    return failures
+
+
+def apply_plan(client, actions, jobs):
+    phase1 = [a for a in actions if a["phase"] == 1]
+    phase2 = [a for a in actions if a["phase"] == 2]
+    failures = run_phase(client, phase1, jobs)
+    guids = {}
+    refs = {a["ref"] for a in phase2 if a["ref"]}
+    refs |= {g for a in phase2 if isinstance(a["payload"], dict) for g in a["payload"].get("groups", [])
+             if isinstance(g, tuple)}
+    for kind in sorted({kind for kind, _ in refs}):
+        path = "/api/user-groups" if kind == "user_groups" else "/api/device-groups"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pages:
+            for g in fetch_all(client, pages, kind, path):
+                guids[(kind, g.get("name"))] = g.get("guid")
+    runnable = []
+    for a in phase2:
+        needed = ({a["ref"]} if a["ref"] else set()) | {
+            g for g in (a["payload"].get("groups", []) if isinstance(a["payload"], dict) else []) if isinstance(g, tuple)
+        }
+        if needed - guids.keys():
+            failures.append((a, "group was not created"))
+            print(f"SKIPPED: {a['desc']}: group was not created")
+            continue
+        runnable.append(resolve_refs(a, guids))
+    failures += run_phase(client, runnable, jobs)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile groups, memberships, strategies and address book rules")
+    parser.add_argument("command", choices=["plan", "apply"], help="plan only prints the changes")
+    parser.add_argument("state", help="YAML or JSON file with the desired state")
+    parser.add_argument("--url", required=True, help="URL of the API")
+    parser.add_argument("--token", required=True, help="Bearer token for authentication")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="Concurrent requests (default: 8)")
+    args = parser.parse_args()
+    instrument.install()
+    limiter.install()
+    while args.url.endswith("/"): args.url = args.url[:-1]
+
+    desired = load_state_file(args.state)
+    client = Client(args.url, args.token)
+    start = time.time()
+    try:
+        current = list_current(client, desired, args.jobs)
+    except (ApiError, requests.RequestException) as e:
+        print(f"Error: listing the current state failed: {e}")
+        exit(1)
+    list_calls = sum(s["requests"] for s in client.stats.values())
+    actions, errors = make_plan(desired, current)
+    print(f"Listed current state with {list_calls} calls in {time.time() - start:.2f}s")
+
+    for a in sorted(actions, key=lambda a: a["phase"]):
+        print(f"[{a['phase']}] {a['desc']}")
+    for e in errors:
+        print(f"Warning: {e}")
+    naive = naive_calls(desired)
+    print(f"{len(actions)} changes, {list_calls + len(actions)} calls, naive replay: {naive} calls "
+          f"(saved {naive - list_calls - len(actions)})")
+    if not actions:
+        print("Nothing to do")
+        return
+    if args.command == "plan":
+        return
+
+    start = time.time()
+    try:
+        failures = apply_plan(client, actions, args.jobs)
+    except (ApiError, requests.RequestException) as e:
+        # A connection error, or the listing of the groups created in phase 1 failed
+        print(f"Error: applying the changes failed: {e}")
+        exit(1)
+    total_calls = sum(s["requests"] for s in client.stats.values())
+    print(f"Applied {len(actions) - len(failures)} of {len(actions)} changes with {total_calls} calls "
+          f"in {time.time() - start:.2f}s")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+
+import requests
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import instrument
+import limiter
+
+# Pull the whole tenant into a local SQLite file, then query it offline, e.g. the devices of
+# device group "group1" with strategy "s1" which haven't been online for 30 days:
+#
+#   python3 res/snapshot.py pull --url http://console:21114 --token xxx --db tenant.db
+#   python3 res/snapshot.py query --db tenant.db "select id, device_name, last_online from devices
+#       where device_group_name = 'group1' and strategy_name = 's1'
+#       and last_online < datetime('now', '-30 days')"
+#
+# `refresh` updates an existing snapshot in place. The list endpoints have no "changed since"
+# filter, so every page is requested again, but conditionally (If-None-Match/If-Modified-Since)
+# when the server sent validators last time, and pages hashing like last time are skipped
+# without touching the database. Only the rows of changed pages are diffed.
+
+PAGE_SIZE = 100
+
+SCHEMA = """
+create table devices (
+    guid text primary key, id text, device_name text, device_username text, os text,
+    user_name text, device_group_name text, strategy_name text, status integer,
+    last_online text, note text, raw text
+);
+create index devices_id on devices(id);
+create index devices_group on devices(device_group_name, last_online);
+create index devices_strategy on devices(strategy_name);
+create index devices_user on devices(user_name);
+create index devices_last_online on devices(last_online);
+
+create table users (
+    guid text primary key, name text, email text, group_name text, status integer,
+    is_admin integer, note text, raw text
+);
+create index users_name on users(name);
+create index users_group on users(group_name);
+
+create table user_groups (guid text primary key, name text, note text, raw text);
+create index user_groups_name on user_groups(name);
+
+create table device_groups (guid text primary key, name text, note text, raw text);
+create index device_groups_name on device_groups(name);
+
+create table strategies (guid text primary key, name text, enabled integer, raw text);
+create index strategies_name on strategies(name);
+
+create table address_books (guid text primary key, name text, owner text, note text, raw text);
+create index address_books_name on address_books(name);
+
+create table ab_peers (
+    ab_guid text, id text, alias text, tags text, note text, raw text,
+    primary key (ab_guid, id)
+);
+create index ab_peers_id on ab_peers(id);
+
+-- one row per resource of the last pull
+create table snapshot_stats (
+    resource text primary key, rows integer, requests integer, bytes integer, seconds real
+);
+create table snapshot_info (key text primary key, value text);
+"""
+
+# Created on the first refresh, snapshots of a pull don't have them yet.
+REFRESH_SCHEMA = """
+-- hash, validators and row keys of every page seen by the last refresh
+create table if not exists page_hashes (
+    resource text, current integer, hash text, etag text, last_modified text, total integer,
+    keys text, primary key (resource, current)
+);
+create table if not exists refresh_stats (
+    refreshed_at text, resource text, inserted integer, updated integer, deleted integer,
+    pages integer, unchanged_pages integer, requests integer, bytes integer, seconds real
+);
+"""
+
+
+def timestamp(value):
+    # "2025-01-01T10:00:00.123" -> "2025-01-01 10:00:00", comparable with sqlite's datetime()
+    if not value:
+        return None
+    return str(value).replace("T", " ").split(".")[0]
+
+
+def device_row(d):
+    info = d.get("info") or {}
+    return (
+        d.get("guid"), d.get("id"), d.get("device_name") or info.get("device_name"),
+        d.get("device_username") or info.get("username"), d.get("os") or info.get("os"),
+        d.get("user_name"), d.get("device_group_name"), d.get("strategy_name"), d.get("status"),
+        timestamp(d.get("last_online")), d.get("note"), json.dumps(d),
+    )
+
+
+def user_row(u):
+    return (
+        u.get("guid"), u.get("name"), u.get("email"), u.get("group_name"), u.get("status"),
+        u.get("is_admin"), u.get("note"), json.dumps(u),
+    )
+
+
+def group_row(g):
+    return (g.get("guid"), g.get("name"), g.get("note"), json.dumps(g))
+
+
+def strategy_row(s):
+    return (s.get("guid"), s.get("name"), s.get("enabled", s.get("status")), json.dumps(s))
+
+
+def ab_row(ab):
+    return (ab.get("guid"), ab.get("name"), ab.get("owner"), ab.get("note"), json.dumps(ab))
+
+
+def peer_row(ab_guid, p):
+    return (ab_guid, p.get("id"), p.get("alias"), json.dumps(p.get("tags") or []), p.get("note"), json.dumps(p))
+
+
+# table -> (insert columns count, row function)
+TABLES = {
+    "devices": (12, device_row),
+    "users": (8, user_row),
+    "user_groups": (4, group_row),
+    "device_groups": (4, group_row),
+    "strategies": (4, strategy_row),
+    "address_books": (5, ab_row),
+}
+
+# resource -> (endpoint, extra params), all paged with current/pageSize
+LISTS = {
+    "devices": ("/api/devices", {}),
+    "users": ("/api/users", {}),
+    "user_groups": ("/api/user-groups", {}),
+    "device_groups": ("/api/device-groups", {}),
+    "address_books": ("/api/ab/shared/profiles", {}),
+}
+
+
+class ApiError(Exception):
+    """An HTTP error status or an {"error": ...} response to a listing"""
+
+
+class Client:
+    """Thread safe API client, one requests session per thread, counting requests and bytes."""
+
+    def __init__(self, url, token):
+        self.url = url
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def request(self, resource, path, params=None, headers=None):
+        response = self.session().get(f"{self.url}{path}", params=params, headers=headers)
+        with self.lock:
+            stats = self.stats.setdefault(resource, {"requests": 0, "bytes": 0})
+            stats["requests"] += 1
+            stats["bytes"] += len(response.content)
+        if response.status_code == 304:
+            return response
+        # Raise rather than exit, this runs on worker threads where exit() only ends the worker.
+        if response.status_code != 200:
+            raise ApiError(f"HTTP {response.status_code} - {response.text}")
+        response_json = response.json()
+        if isinstance(response_json, dict) and "error" in response_json:
+            raise ApiError(response_json["error"])
+        return response
+
+    def get(self, resource, path, params=None):
+        return self.request(resource, path, params).json()
+
+    def send(self, resource, method, path, payload=None):
+        """Send a change, returns (ok, result or error message) instead of exiting on errors."""
+        response = self.session().request(method, f"{self.url}{path}", json=payload)
+        with self.lock:
+            stats = self.stats.setdefault(resource, {"requests": 0, "bytes": 0})
+            stats["requests"] += 1
+            stats["bytes"] += len(response.content)
+        if response.status_code != 200:
+            return False, f"HTTP {response.status_code} - {response.text}"
+        if not response.text.strip():
+            return True, None
+        try:
+            response_json = response.json()
+        except ValueError:
+            return True, response.text
+        if isinstance(response_json, dict) and "error" in response_json:
+            return False, response_json["error"]
+        return True, response_json
+
+    def get_page(self, resource, path, params, known):
+        """Conditional GET of a page, returns None if the server says it's not modified."""
+        headers = {}
+        if known and known["etag"]:
+            headers["If-None-Match"] = known["etag"]
+        if known and known["last_modified"]:
+            headers["If-Modified-Since"] = known["last_modified"]
+        response = self.request(resource, path, params, headers)
+        if response.status_code == 304:
+            return None
+        return response
+
+
+def fetch_all(client, executor, resource, path, params=None):
+    """Fetch the first page for the total, then all the other pages concurrently.
+
+    Raises ApiError (or a requests exception) if any page fails, never returns a partial list."""
+    params = dict(params or {}, pageSize=PAGE_SIZE)
+    first = client.get(resource, path, dict(params, current=1))
+    rows = list(first.get("data", []))
+    total = first.get("total", 0)
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    if len(rows) < PAGE_SIZE or pages <= 1:
+        return rows
+    futures = [
+        executor.submit(client.get, resource, path, dict(params, current=current))
+        for current in range(2, pages + 1)
+    ]
+    try:
+        for future in futures:
+            rows.extend(future.result().get("data", []))
+    except BaseException:
+        # The listing is lost anyway, don't send the pages not started yet.
+        for future in futures:
+            future.cancel()
+        raise
+    return rows
+
+
+def pull_resources(client, jobs):
+    """Pull every resource concurrently, returns ({resource: rows}, {ab_guid: peers}, {resource: seconds})."""
+    results = {}
+    seconds = {}
+    start = time.time()
+
+    def timed(resource, func, *args):
+        t = time.time()
+        res = func(*args)
+        seconds[resource] = time.time() - t
+        return res
+
+    # Page requests are submitted from the list tasks, keep them on their own pool so the
+    # list tasks can't starve them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pages, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(LISTS) + 1) as lists:
+        futures = {
+            resource: lists.submit(timed, resource, fetch_all, client, pages, resource, path, params)
+            for resource, (path, params) in LISTS.items()
+        }
+        futures["strategies"] = lists.submit(timed, "strategies", client.get, "strategies", "/api/strategies")
+        for resource, future in futures.items():
+            results[resource] = future.result() or []
+        if isinstance(results["strategies"], dict):
+            results["strategies"] = results["strategies"].get("data", [])
+
+        t = time.time()
+        peer_futures = {
+            ab["guid"]: lists.submit(fetch_all, client, pages, "ab_peers", "/api/ab/peers", {"ab": ab["guid"]})
+            for ab in results["address_books"]
+        }
+        peers = {guid: future.result() for guid, future in peer_futures.items()}
+        seconds["ab_peers"] = time.time() - t
+    seconds["total"] = time.time() - start
+    return results, peers, seconds
+
+
+def write_snapshot(db, url, results, peers, client, seconds):
+    # Build a new file and swap it in, readers never see a half written snapshot.
+    tmp = db + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    t = time.time()
+    conn = sqlite3.connect(tmp)
+    conn.executescript(SCHEMA)
+    counts = {}
+    with conn:
+        for table, (columns, row) in TABLES.items():
+            rows = [row(x) for x in results[table]]
+            conn.executemany(f"insert or replace into {table} values ({','.join('?' * columns)})", rows)
+            counts[table] = len(rows)
+        peer_rows = [peer_row(guid, p) for guid, ab_peers in peers.items() for p in ab_peers]
+        conn.executemany("insert or replace into ab_peers values (?,?,?,?,?,?)", peer_rows)
+        counts["ab_peers"] = len(peer_rows)
+        for resource, count in counts.items():
+            stats = client.stats.get(resource, {"requests": 0, "bytes": 0})
+            conn.execute(
+                "insert into snapshot_stats values (?,?,?,?,?)",
+                (resource, count, stats["requests"], stats["bytes"], round(seconds.get(resource, 0), 3)),
+            )
+        info = {
+            "url": url,
+            "pulled_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "pull_seconds": round(seconds["total"], 3),
+            "write_seconds": round(time.time() - t, 3),
+        }
+        conn.executemany("insert into snapshot_info values (?,?)", [(k, str(v)) for k, v in info.items()])
+    conn.close()
+    os.replace(tmp, db)
+    return counts, info
+
+
+def pull(url, token, db, jobs=8):
+    client = Client(url, token)
+    results, peers, seconds = pull_resources(client, jobs)
+    counts, info = write_snapshot(db, url, results, peers, client, seconds)
+    print_stats(db)
+    return counts
+
+
+# resource -> (table, endpoint, extra params, paged)
+REFRESH = {
+    "devices": ("devices", "/api/devices", {}, True),
+    "users": ("users", "/api/users", {}, True),
+    "user_groups": ("user_groups", "/api/user-groups", {}, True),
+    "device_groups": ("device_groups", "/api/device-groups", {}, True),
+    "strategies": ("strategies", "/api/strategies", {}, False),
+    "address_books": ("address_books", "/api/ab/shared/profiles", {}, True),
+}
+
+
+def page_rows(response_json):
+    if isinstance(response_json, dict):
+        return response_json.get("data", []), response_json.get("total", 0)
+    return response_json or [], len(response_json or [])
+
+
+def fetch_changed_pages(client, executor, resource, page_key, path, params, paged, known):
+    """Fetch the pages of a list, returns ([(current, rows or None if unchanged, page record)], seconds).
+
+    A page is unchanged if the server answers 304 to the stored validators, or if its
+    content hashes like last time."""
+
+    def fetch(current):
+        page_params = dict(params, pageSize=PAGE_SIZE, current=current) if paged else params
+        previous = known.get(current)
+        response = client.get_page(resource, path, page_params, previous)
+        if response is None:
+            return current, None, previous
+        digest = hashlib.sha256(response.content).hexdigest()
+        rows, total = page_rows(response.json())
+        record = {
+            "hash": digest,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "total": total,
+            "keys": None,
+        }
+        if previous and previous["hash"] == digest:
+            return current, None, dict(record, keys=previous["keys"])
+        return current, rows, record
+
+    start = time.time()
+    first = fetch(1)
+    pages = [first]
+    total = first[2]["total"]
+    if paged:
+        count = (total + PAGE_SIZE - 1) // PAGE_SIZE
+        pages.extend(executor.map(fetch, range(2, count + 1)))
+    return pages, time.time() - start
+
+
+def load_page_hashes(conn, page_key):
+    rows = conn.execute(
+        "select current, hash, etag, last_modified, total, keys from page_hashes where resource = ?", (page_key,)
+    ).fetchall()
+    return {
+        current: {"hash": h, "etag": etag, "last_modified": lm, "total": total, "keys": json.loads(keys)}
+        for current, h, etag, lm, total, keys in rows
+    }
+
+
+def apply_pages(conn, table, page_key, pages, key_of, row_of, scope=None):
+    """Diff the changed pages against the table, returns (inserted, updated, deleted)."""
+    key_columns = ["ab_guid", "id"] if table == "ab_peers" else ["guid"]
+    where = " and ".join(f"{c} = ?" for c in key_columns)
+    inserted = updated = 0
+    seen = set()
+    conn.execute("delete from page_hashes where resource = ?", (page_key,))
+    for current, rows, record in pages:
+        if rows is None:
+            keys = record["keys"]
+        else:
+            keys = []
+            for item in rows:
+                row = row_of(item)
+                key = key_of(item)
+                keys.append(key)
+                old = conn.execute(f"select raw from {table} where {where}", key).fetchone()
+                if old and old[0] == row[-1]:
+                    continue
+                conn.execute(f"insert or replace into {table} values ({','.join('?' * len(row))})", row)
+                if old:
+                    updated += 1
+                else:
+                    inserted += 1
+        seen.update(tuple(k) for k in keys)
+        conn.execute(
+            "insert into page_hashes values (?,?,?,?,?,?,?)",
+            (page_key, current, record["hash"], record["etag"], record["last_modified"], record["total"],
+             json.dumps(keys)),
+        )
+    # Whatever wasn't on any page is gone.
+    if scope:
+        existing = conn.execute(f"select {','.join(key_columns)} from {table} where ab_guid = ?", (scope,))
+    else:
+        existing = conn.execute(f"select {','.join(key_columns)} from {table}")
+    gone = [k for k in existing.fetchall() if tuple(k) not in seen]
+    conn.executemany(f"delete from {table} where {where}", gone)
+    return inserted, updated, len(gone)
+
+
+def refresh(url, token, db, jobs=8):
+    if not os.path.exists(db):
+        print(f"{db} not found, pulling the full snapshot")
+        return pull(url, token, db, jobs)
+    start = time.time()
+    client = Client(url, token)
+    conn = sqlite3.connect(db)
+    conn.executescript(REFRESH_SCHEMA)
+    refreshed_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    report = []
+
+    def record(resource, counts, pages, seconds):
+        stats = client.stats.get(resource, {"requests": 0, "bytes": 0})
+        unchanged = sum(1 for _, rows, _ in pages if rows is None)
+        row = (refreshed_at, resource, *counts, len(pages), unchanged, stats["requests"], stats["bytes"],
+               round(seconds, 3))
+        conn.execute("insert into refresh_stats values (?,?,?,?,?,?,?,?,?,?)", row)
+        report.append(row[1:])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pages_pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(REFRESH)) as lists:
+        futures = {}
+        for resource, (table, path, params, paged) in REFRESH.items():
+            known = load_page_hashes(conn, resource)
+            futures[resource] = lists.submit(
+                fetch_changed_pages, client, pages_pool, resource, resource, path, params, paged, known
+            )
+        # Fetch everything first, sqlite is written from this thread only. Everything is applied
+        # in one transaction, a failed request rolls the whole refresh back.
+        fetched = {resource: future.result() for resource, future in futures.items()}
+        with conn:
+            for resource, (pages, seconds) in fetched.items():
+                table = REFRESH[resource][0]
+                row_of = TABLES[table][1]
+                t = time.time()
+                counts = apply_pages(conn, table, resource, pages, lambda x: (x.get("guid"),), row_of)
+                record(resource, counts, pages, seconds + time.time() - t)
+
+            # Peers of every book, books removed since the last refresh lose their peers.
+            t = time.time()
+            books = [guid for (guid,) in conn.execute("select guid from address_books")]
+            peer_futures = {
+                guid: lists.submit(
+                    fetch_changed_pages, client, pages_pool, "ab_peers", f"ab_peers:{guid}", "/api/ab/peers",
+                    {"ab": guid}, True, load_page_hashes(conn, f"ab_peers:{guid}")
+                )
+                for guid in books
+            }
+            totals = [0, 0, 0]
+            all_pages = []
+            for guid, future in peer_futures.items():
+                pages, _ = future.result()
+                all_pages.extend(pages)
+                counts = apply_pages(
+                    conn, "ab_peers", f"ab_peers:{guid}", pages,
+                    lambda p, guid=guid: (guid, p.get("id")), lambda p, guid=guid: peer_row(guid, p), guid,
+                )
+                totals = [a + b for a, b in zip(totals, counts)]
+            placeholders = ",".join("?" * len(books))
+            gone = conn.execute(f"delete from ab_peers where ab_guid not in ({placeholders})", books).rowcount
+            conn.execute(
+                "delete from page_hashes where resource like 'ab_peers:%' and substr(resource, 10) not in "
+                f"({placeholders})", books
+            )
+            totals[2] += gone
+            record("ab_peers", totals, all_pages, time.time() - t)
+
+    with conn:
+        for table in list(TABLES) + ["ab_peers"]:
+            conn.execute("update snapshot_stats set rows = (select count(*) from %s) where resource = ?" % table,
+                         (table,))
+        conn.execute("insert or replace into snapshot_info values ('refreshed_at', ?)", (refreshed_at,))
+        conn.execute("insert or replace into snapshot_info values ('refresh_seconds', ?)",
+                     (str(round(time.time() - start, 3)),))
+    conn.close()
+
+    print(f"{'resource':<14} {'inserted':>8} {'updated':>8} {'deleted':>8} {'pages':>6} {'unchanged':>9} "
+          f"{'requests':>9} {'bytes':>10} {'seconds':>8}")
+    for resource, ins, upd, dele, pages, unchanged, reqs, size, secs in report:
+        print(f"{resource:<14} {ins:>8} {upd:>8} {dele:>8} {pages:>6} {unchanged:>9} {reqs:>9} {size:>10} "
+              f"{secs:>8.3f}")
+    print(f"Refreshed in {time.time() - start:.3f}s")
+    return report
+
+
+def print_stats(db):
+    conn = sqlite3.connect(db)
+    rows = conn.execute("select resource, rows, requests, bytes, seconds from snapshot_stats").fetchall()
+    info = dict(conn.execute("select key, value from snapshot_info").fetchall())
+    conn.close()
+    print(f"{'resource':<14} {'rows':>8} {'requests':>9} {'bytes':>12} {'seconds':>8}")
+    for resource, count, reqs, size, secs in rows:
+        print(f"{resource:<14} {count:>8} {reqs:>9} {size:>12} {secs:>8.3f}")
+    for key, value in info.items():
+        print(f"{key}: {value}")
+
+
+def query(db, sql, params=()):
+    conn = sqlite3.connect(db)
+    conn.row_factory = sqlite3.Row
+    start = time.time()
+    rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    conn.close()
+    return rows, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tenant snapshot in a local SQLite file")
+    parser.add_argument("command", choices=["pull", "refresh", "query", "stats"], help="Command to execute")
+    parser.add_argument("sql", nargs="?", help="SQL statement (for query)")
+    parser.add_argument("--url", help="URL of the API (for pull/refresh)")
+    parser.add_argument("--token", help="Bearer token for authentication (for pull/refresh)")
+    parser.add_argument("--db", default="snapshot.db", help="SQLite file (default: snapshot.db)")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="Concurrent page requests (default: 8)")
+
+    args = parser.parse_intermixed_args()
+    instrument.install()
+    limiter.install()
+
+    if args.command in ["pull", "refresh"]:
+        if not args.url or not args.token:
+            print(f"Error: --url and --token are required for {args.command}")
+            exit(1)
+        while args.url.endswith("/"): args.url = args.url[:-1]
+        try:
+            if args.command == "pull":
+                pull(args.url, args.token, args.db, args.jobs)
+            else:
+                refresh(args.url, args.token, args.db, args.jobs)
+        except (ApiError, requests.RequestException) as e:
+            print(f"Error: {e}")
+            print(f"Error: {args.command} failed, {args.db} was not changed")
+            exit(1)
+        return
+
+    if not os.path.exists(args.db):
+        print(f"Error: {args.db} not found, run pull first")
+        exit(1)
+
+    if args.command == "stats":
+        print_stats(args.db)
+    elif args.command == "query":
+        if not args.sql:
+            print("Error: SQL statement is required for query")
+            exit(1)
+        rows, seconds = query(args.db, args.sql)
+        for row in rows:
+            print(json.dumps(row))
+        print(f"{len(rows)} rows in {seconds * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
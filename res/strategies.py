@@ -4,6 +4,9 @@ import requests
 import argparse
 import json
 
+import instrument
+import limiter
+
 
 def check_response(response):
     """
@@ -232,6 +235,8 @@ def main():
     parser.add_argument("--device-groups", help="Comma separated device group names or GUIDs (requires Device Group Permission:r)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
     while args.url.endswith("/"): args.url = args.url[:-1]
 
     if args.command == "list":
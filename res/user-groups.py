@@ -4,6 +4,10 @@ import requests
 import argparse
 import json
 
+import instrument
+import limiter
+from bulk import check_result, chunks, get_groups_by_names, run_parallel
+
 
 def check_response(response):
     """
@@ -108,14 +112,17 @@ def delete_groups(url, token, names):
     headers = headers_with(token)
     if isinstance(names, str):
         names = [names]
-    for n in names:
-        g = get_group_by_name(url, token, n)
-        if not g:
-            print(f"Error: Group '{n}' not found")
-            exit(1)
-        guid = g.get("guid")
-        r = requests.delete(f"{url}/api/user-groups/{guid}", headers=headers)
-        check_response(r)
+    groups = get_groups_by_names(list_groups, url, token, names)
+    missing = [n for n in names if n not in groups]
+    if missing:
+        print("Error: " + "; ".join(f"Group '{n}' not found" for n in missing))
+        exit(1)
+
+    def delete(name):
+        r = requests.delete(f"{url}/api/user-groups/{groups[name].get('guid')}", headers=headers)
+        check_result(r)
+
+    run_parallel(delete, names)
     return "Success"
 
 
@@ -158,6 +165,29 @@ def view_users(url, token, group_name=None, name=None, page_size=50):
     return data
 
 
+def get_users_by_names(url, token, user_names, page_size=100):
+    """Resolve user names to users, returns {name: user} for the names found.
+
+    Lists all users when that takes fewer requests than looking the names up one
+    by one, otherwise looks the names up concurrently."""
+    headers = headers_with(token)
+    wanted = set(user_names)
+
+    def fetch(params):
+        return check_result(requests.get(f"{url}/api/users", headers=headers, params=params))
+
+    total = run_parallel(fetch, [{"pageSize": 1, "current": 1}])[0].get("total", 0)
+    pages = (total + page_size - 1) // page_size
+    if pages < len(wanted):
+        results = run_parallel(
+            lambda current: fetch({"pageSize": page_size, "current": current}),
+            list(range(1, pages + 1)),
+        )
+    else:
+        results = run_parallel(lambda name: fetch({"name": name, "pageSize": 50}), list(wanted))
+    return {u.get("name"): u for res in results for u in res.get("data", []) if u.get("name") in wanted}
+
+
 def add_users(url, token, group_name, user_names):
     """Add users to a user group"""
     headers = headers_with(token)
@@ -172,30 +202,9 @@ def add_users(url, token, group_name, user_names):
     guid = g.get("guid")
     
     # Get user GUIDs
-    user_guids = []
-    errors = []
-    
-    for user_name in user_names:
-        # Get user by exact name match
-        params = {"name": user_name, "pageSize": 50}
-        r = requests.get(f"{url}/api/users", headers=headers, params=params)
-        if r.status_code != 200:
-            errors.append(f"{user_name}: HTTP {r.status_code}")
-            continue
-        
-        users_data = r.json()
-        users_list = users_data.get("data", [])
-        user = None
-        for u in users_list:
-            if u.get("name") == user_name:
-                user = u
-                break
-        
-        if not user:
-            errors.append(f"{user_name}: User not found")
-            continue
-        
-        user_guids.append(user["guid"])
+    users = get_users_by_names(url, token, user_names)
+    user_guids = [users[n]["guid"] for n in user_names if n in users]
+    errors = [f"{n}: User not found" for n in user_names if n not in users]
     
     if not user_guids:
         msg = "Error: No valid users found"
@@ -204,9 +213,11 @@ def add_users(url, token, group_name, user_names):
         print(msg)
         exit(1)
     
-    # Add users to group using POST /api/user-groups/:guid
-    r = requests.post(f"{url}/api/user-groups/{guid}", headers=headers, json=user_guids)
-    check_response(r)
+    # Add users to group using POST /api/user-groups/:guid, in chunks
+    run_parallel(
+        lambda payload: check_result(requests.post(f"{url}/api/user-groups/{guid}", headers=headers, json=payload)),
+        chunks(user_guids),
+    )
     
     success_msg = f"Success: Added {len(user_guids)} user(s) to group '{group_name}'"
     if errors:
@@ -253,6 +264,8 @@ def main():
     parser.add_argument("--user-name", help="User name filter (for view-users, supports fuzzy search)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
     while args.url.endswith("/"): args.url = args.url[:-1]
 
     if args.command == "view":
@@ -2,8 +2,17 @@
 
 import requests
 import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 
+import instrument
+import limiter
+
 
 def check_response(response):
     """
@@ -127,67 +136,256 @@ def invite_user(url, token, email, name, group_name=None, note=None):
     check_response(response)
 
 
-def enable_2fa_enforce(url, token, user_guids, base_url):
-    """Enable 2FA enforcement for users"""
+def send_with_retries(session, method, full_url, payload, retries=3):
+    """Send a request, retrying 429, 5xx and connection errors with backoff. Returns (error or None, retries used)."""
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(min(2 ** (attempt - 1), 10))
+        try:
+            response = session.request(method, full_url, json=payload)
+        except requests.RequestException as e:
+            error = str(e)
+            continue
+        # Only rate limiting and server errors are worth retrying
+        if response.status_code == 429 or response.status_code >= 500:
+            error = f"HTTP {response.status_code}: {response.text}"
+            continue
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}: {response.text}", attempt
+        try:
+            response_json = response.json()
+            if isinstance(response_json, dict) and "error" in response_json:
+                return response_json["error"], attempt
+        except ValueError:
+            pass
+        return None, attempt
+    return error, retries
+
+
+def send_in_chunks(url, token, method, path, payload, user_guids, chunk_size=500, jobs=8, retries=3):
+    """Send `payload` with `user_guids` split into chunks, in parallel.
+
+    A failing chunk is retried on its own and doesn't fail the others. Returns
+    {"ok": guids done, "failed": guids failed, "requests": n, "retries": n, "errors": [...]}."""
+    user_guids = user_guids if isinstance(user_guids, list) else [user_guids]
+    chunks = [user_guids[i:i + chunk_size] for i in range(0, len(user_guids), chunk_size)]
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
-        "user_guids": user_guids if isinstance(user_guids, list) else [user_guids],
-        "enforce": True,
-        "url": base_url
-    }
-    response = requests.put(f"{url}/api/users/tfa/totp/enforce", headers=headers, json=payload)
-    check_response(response)
+    local = threading.local()
+
+    def send(chunk):
+        # One keep-alive session per worker thread
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers.update(headers)
+        return send_with_retries(local.session, method, f"{url}{path}", dict(payload, user_guids=chunk), retries)
+
+    result = {"ok": 0, "failed": 0, "requests": len(chunks), "retries": 0, "errors": []}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for chunk, (error, attempts) in zip(chunks, executor.map(send, chunks)):
+            result["retries"] += attempts
+            if error:
+                result["failed"] += len(chunk)
+                result["errors"].append(f"{len(chunk)} user(s) starting at {chunk[0]}: {error}")
+            else:
+                result["ok"] += len(chunk)
+    return result
+
+
+def read_user_rows(path):
+    """Yield (row number, row) from a CSV file with a header or an NDJSON file (.ndjson/.jsonl)"""
+    if path.endswith(".ndjson") or path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield i, json.loads(line)
+                    except ValueError as e:
+                        yield i, {"_error": f"invalid JSON: {e}"}
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            # Row 1 is the header
+            for i, row in enumerate(csv.DictReader(f), 2):
+                yield i, row
+
+
+def list_group_names(url, token):
+    """Names of all user groups"""
+    headers = {"Authorization": f"Bearer {token}"}
+    pageSize = 100
+    names = set()
+    current = 0
+    while True:
+        current += 1
+        response = requests.get(f"{url}/api/user-groups", headers=headers,
+                                params={"pageSize": pageSize, "current": current})
+        response_json = check_response(response)
+        data = response_json.get("data", [])
+        names.update(g["name"] for g in data)
+        if len(data) < pageSize or current * pageSize >= response_json.get("total", 0):
+            break
+    return names
+
+
+def validate_user_rows(rows, group_names):
+    """Returns (users, errors). A row with a password is created, a row with only an email is invited."""
+    users, errors, seen = [], [], set()
+    for i, row in rows:
+        if "_error" in row:
+            errors.append(f"row {i}: {row['_error']}")
+            continue
+        user = {k: str(v).strip() for k, v in row.items() if k in ["name", "password", "email", "group_name", "note"] and v not in (None, "")}
+        problems = []
+        if not user.get("name"):
+            problems.append("name is required")
+        elif user["name"] in seen:
+            problems.append(f"duplicate name '{user['name']}'")
+        if not user.get("password") and not user.get("email"):
+            problems.append("password (new) or email (invite) is required")
+        if user.get("email") and "@" not in user["email"]:
+            problems.append(f"invalid email '{user['email']}'")
+        if not user.get("group_name"):
+            problems.append("group_name is required")
+        elif user["group_name"] not in group_names:
+            problems.append(f"group '{user['group_name']}' not found")
+        if problems:
+            errors.append(f"row {i}: " + ", ".join(problems))
+            continue
+        seen.add(user["name"])
+        users.append((i, user))
+    return users, errors
+
+
+def load_outcome(path):
+    """Names already created or invited according to an earlier outcome file"""
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if row["status"] in ["created", "invited"]:
+                    done.add(row["name"])
+    return done
+
+
+def user_exists(session, url, name):
+    """Whether a user named exactly `name` exists, False if the lookup fails"""
+    try:
+        response = session.get(f"{url}/api/users", params={"name": name, "pageSize": 100, "current": 1})
+        response_json = response.json() if response.status_code == 200 else {}
+    except (requests.RequestException, ValueError):
+        return False
+    # The name filter is a LIKE match, compare exactly
+    return isinstance(response_json, dict) and any(u.get("name") == name for u in response_json.get("data", []))
+
+
+def bulk_create(url, token, path, outcome_path=None, jobs=8, retries=3):
+    """Create or invite the users of a CSV/NDJSON file concurrently.
+
+    Every row's result is appended to the outcome file, running again with the same
+    outcome file skips the users that already succeeded."""
+    start = time.time()
+    outcome_path = outcome_path or path + ".outcome.csv"
+    group_names = list_group_names(url, token)
+    users, errors = validate_user_rows(read_user_rows(path), group_names)
+    if errors:
+        for error in errors:
+            print(f"Error: {error}")
+        print(f"Error: {len(errors)} invalid row(s), nothing was created")
+        exit(1)
+    done = load_outcome(outcome_path)
+    pending = [(i, user) for i, user in users if user["name"] not in done]
+    print(f"{len(users)} users in {path}, {len(users) - len(pending)} already done, {len(pending)} to create")
+
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    local = threading.local()
+
+    def create(user):
+        # One keep-alive session per worker thread
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.headers.update(headers)
+        if user.get("password"):
+            endpoint, status = "/api/users", "created"
+        else:
+            endpoint, status = "/api/users/invite", "invited"
+        error, attempts = send_with_retries(local.session, "POST", f"{url}{endpoint}", user, retries)
+        # Creating isn't idempotent: a 5xx or a dropped connection can come after the server
+        # created the user, and the retry then fails with "already exists". If any attempt was
+        # retried, check whether the user is there before reporting a failure.
+        if error and attempts and user_exists(local.session, url, user["name"]):
+            error = None
+        return ("failed" if error else status), error or "", attempts
+
+    counts = {"created": 0, "invited": 0, "failed": 0}
+    retried = 0
+    new_file = not os.path.exists(outcome_path)
+    with open(outcome_path, "a", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["row", "name", "status", "error"])
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(create, user): (i, user) for i, user in pending}
+            for n, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                i, user = futures[future]
+                status, error, attempts = future.result()
+                counts[status] += 1
+                retried += attempts
+                writer.writerow([i, user["name"], status, error])
+                f.flush()
+                if error:
+                    print(f"Error: row {i} ({user['name']}): {error}")
+                if n % 100 == 0:
+                    print(f"Progress: {n}/{len(pending)}")
+
+    seconds = time.time() - start
+    print(f"Created {counts['created']}, invited {counts['invited']}, failed {counts['failed']}, "
+          f"{retried} retries in {seconds:.2f}s, {len(pending) / seconds if seconds else 0:.1f} users/s")
+    print(f"Outcome written to {outcome_path}")
+    if counts["failed"]:
+        print("Run the same command again to retry the failed rows")
+    return counts
+
+
+def enable_2fa_enforce(url, token, user_guids, base_url, **chunking):
+    """Enable 2FA enforcement for users"""
+    return send_in_chunks(url, token, "PUT", "/api/users/tfa/totp/enforce", {"enforce": True, "url": base_url}, user_guids, **chunking)
 
 
-def disable_2fa_enforce(url, token, user_guids, base_url=""):
+def disable_2fa_enforce(url, token, user_guids, base_url="", **chunking):
     """Disable 2FA enforcement for users"""
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
-        "user_guids": user_guids if isinstance(user_guids, list) else [user_guids],
-        "enforce": False,
-        "url": base_url
-    }
-    response = requests.put(f"{url}/api/users/tfa/totp/enforce", headers=headers, json=payload)
-    check_response(response)
+    return send_in_chunks(url, token, "PUT", "/api/users/tfa/totp/enforce", {"enforce": False, "url": base_url}, user_guids, **chunking)
 
 
-def disable_email_verification(url, token, user_guids):
+def disable_email_verification(url, token, user_guids, **chunking):
     """Disable email login verification for users"""
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
-        "user_guids": user_guids if isinstance(user_guids, list) else [user_guids],
-        "type": "email"
-    }
-    response = requests.put(f"{url}/api/users/disable_login_verification", headers=headers, json=payload)
-    check_response(response)
+    return send_in_chunks(url, token, "PUT", "/api/users/disable_login_verification", {"type": "email"}, user_guids, **chunking)
 
 
-def reset_2fa(url, token, user_guids):
+def reset_2fa(url, token, user_guids, **chunking):
     """Reset 2FA for users"""
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
-        "user_guids": user_guids if isinstance(user_guids, list) else [user_guids],
-        "type": "2fa"
-    }
-    response = requests.put(f"{url}/api/users/disable_login_verification", headers=headers, json=payload)
-    check_response(response)
+    return send_in_chunks(url, token, "PUT", "/api/users/disable_login_verification", {"type": "2fa"}, user_guids, **chunking)
 
 
-def force_logout(url, token, user_guids):
+def force_logout(url, token, user_guids, **chunking):
     """Force logout users"""
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    payload = {
-        "user_guids": user_guids if isinstance(user_guids, list) else [user_guids],
-    }
-    response = requests.post(f"{url}/api/users/force-logout", headers=headers, json=payload)
-    check_response(response)
+    return send_in_chunks(url, token, "POST", "/api/users/force-logout", {}, user_guids, **chunking)
 
 
 def main():
+    def positive_int(value):
+        """At least 1, for counts like --jobs and --chunk-size"""
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid number: {value}")
+        if number < 1:
+            raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+        return number
+
     parser = argparse.ArgumentParser(description="User manager")
     parser.add_argument(
         "command",
-        choices=["view", "disable", "enable", "delete", "new", "invite",
+        choices=["view", "disable", "enable", "delete", "new", "invite", "bulk-create",
                  "enable-2fa-enforce", "disable-2fa-enforce", 
                  "disable-email-verification", "reset-2fa", "force-logout"],
         help="Command to execute",
@@ -202,8 +400,15 @@ def main():
     parser.add_argument("--email", help="User email (for invite command)")
     parser.add_argument("--note", help="User note (for new/invite command)")
     parser.add_argument("--web-console-url", help="Web console URL (for 2FA enforce commands)")
+    parser.add_argument("--file", help="CSV or NDJSON file with name, password, email, group_name, note (for bulk-create)")
+    parser.add_argument("--outcome", help="Per-row outcome CSV, used to resume (for bulk-create, default: <file>.outcome.csv)")
+    parser.add_argument("--jobs", type=positive_int, default=8, help="Concurrent requests (for bulk-create and the 2FA/verification/logout commands, default: 8)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries on 429/5xx and connection errors (for bulk-create and the 2FA/verification/logout commands, default: 3)")
+    parser.add_argument("--chunk-size", type=positive_int, default=500, help="Users per request (for the 2FA/verification/logout commands, default: 500)")
 
     args = parser.parse_args()
+    instrument.install()
+    limiter.install()
 
     while args.url.endswith("/"): args.url = args.url[:-1]
 
@@ -223,6 +428,15 @@ def main():
         print("Success: Invitation sent")
         return
 
+    if args.command == "bulk-create":
+        if not args.file:
+            print("Error: --file is required for bulk-create command")
+            exit(1)
+        counts = bulk_create(args.url, args.token, args.file, args.outcome, args.jobs, args.retries)
+        if counts["failed"]:
+            exit(1)
+        return
+
     users = view(
         args.url,
         args.token,
@@ -262,30 +476,36 @@ def main():
             for user in users:
                 delete_user(args.url, args.token, user["guid"], user["name"])
                 print("Success")
-        elif args.command == "enable-2fa-enforce":
-            if not args.web_console_url:
+        elif args.command in ["enable-2fa-enforce", "disable-2fa-enforce", "disable-email-verification",
+                              "reset-2fa", "force-logout"]:
+            if args.command == "enable-2fa-enforce" and not args.web_console_url:
                 print("Error: --web-console-url is required for enable-2fa-enforce")
                 exit(1)
             user_guids = [user["guid"] for user in users]
-            enable_2fa_enforce(args.url, args.token, user_guids, args.web_console_url)
-            print(f"Success: Enabled 2FA enforcement for {len(users)} user(s)")
-        elif args.command == "disable-2fa-enforce":
-            user_guids = [user["guid"] for user in users]
-            web_url = args.web_console_url or ""
-            disable_2fa_enforce(args.url, args.token, user_guids, web_url)
-            print(f"Success: Disabled 2FA enforcement for {len(users)} user(s)")
-        elif args.command == "disable-email-verification":
-            user_guids = [user["guid"] for user in users]
-            disable_email_verification(args.url, args.token, user_guids)
-            print(f"Success: Disabled email verification for {len(users)} user(s)")
-        elif args.command == "reset-2fa":
-            user_guids = [user["guid"] for user in users]
-            reset_2fa(args.url, args.token, user_guids)
-            print(f"Success: Reset 2FA for {len(users)} user(s)")
-        elif args.command == "force-logout":
-            user_guids = [user["guid"] for user in users]
-            force_logout(args.url, args.token, user_guids)
-            print(f"Success: Force logout for {len(users)} user(s)")
+            chunking = {"chunk_size": args.chunk_size, "jobs": args.jobs, "retries": args.retries}
+            if args.command == "enable-2fa-enforce":
+                result = enable_2fa_enforce(args.url, args.token, user_guids, args.web_console_url, **chunking)
+                done = "Enabled 2FA enforcement"
+            elif args.command == "disable-2fa-enforce":
+                web_url = args.web_console_url or ""
+                result = disable_2fa_enforce(args.url, args.token, user_guids, web_url, **chunking)
+                done = "Disabled 2FA enforcement"
+            elif args.command == "disable-email-verification":
+                result = disable_email_verification(args.url, args.token, user_guids, **chunking)
+                done = "Disabled email verification"
+            elif args.command == "reset-2fa":
+                result = reset_2fa(args.url, args.token, user_guids, **chunking)
+                done = "Reset 2FA"
+            else:
+                result = force_logout(args.url, args.token, user_guids, **chunking)
+                done = "Force logout"
+            for error in result["errors"]:
+                print(f"Error: {error}")
+            if result["failed"]:
+                print(f"{done} for {result['ok']} user(s), failed for {result['failed']} user(s) "
+                      f"({result['requests']} requests, {result['retries']} retries)")
+                exit(1)
+            print(f"Success: {done} for {result['ok']} user(s)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,21 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts import their shared modules from res/, the stub console lives in benchmarks/.
+sys.path.insert(0, os.path.join(ROOT, "res"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, ROOT)
+
+
+def load_script(path):
+    # The tools are standalone scripts (some with dashes in their names), load them by path.
+    name = "script_" + os.path.splitext(path)[0].replace("/", "_").replace("-", "_")
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,53 @@
+from conftest import load_script
+
+ab = load_script("res/ab.py")
+
+
+def test_restore_sends_only_writable_peer_fields():
+    book = {
+        "peers": [{"id": "1", "guid": "g-old", "alias": "a", "tags": ["t"], "hash": "h", "same_server": True}],
+        "tags": [],
+        "rules": [],
+    }
+    tasks = ab.plan_book_restore("ab", book, {"peers": [], "tags": [], "rules": []})
+    assert [t[4] for t in tasks] == [{"id": "1", "alias": "a", "tags": ["t"], "hash": "h"}]
+
+
+def test_restore_onto_another_server_is_idempotent():
+    # Server-assigned fields differ between the archive and the target, nothing has changed.
+    book = {"peers": [{"id": "1", "guid": "g-old", "alias": "a", "tags": ["t"], "hash": "h"}], "tags": [], "rules": []}
+    current = {"peers": [{"id": "1", "guid": "g-new", "alias": "a", "tags": ["t"], "created_at": "x"}],
+               "tags": [], "rules": []}
+    assert ab.plan_book_restore("ab", book, current) == []
+
+
+def test_restore_updates_changed_fields_only():
+    book = {"peers": [{"id": "1", "guid": "g", "alias": "new", "tags": ["t"], "note": "n"}], "tags": [], "rules": []}
+    current = {"peers": [{"id": "1", "guid": "g2", "alias": "old", "tags": ["t"], "note": "n"}], "tags": [], "rules": []}
+    tasks = ab.plan_book_restore("ab", book, current)
+    assert [(t[2], t[4]) for t in tasks] == [("PUT", {"id": "1", "alias": "new"})]
+
+
+def test_restore_sends_books_then_tags_then_peers_and_rules(monkeypatch):
+    book = {
+        "profile": {"name": "new"},
+        "peers": [{"id": "1", "tags": ["t"]}],
+        "tags": [{"name": "t", "color": "0xFF00FF00"}],
+        "rules": [{"user": "u", "rule": 1}],
+    }
+    books = [{"name": "existing", "guid": "g-existing"}]
+    batches = []
+
+    def send_requests(url, token, tasks, jobs=8, progress=False):
+        batches.append(sorted(task[1].split()[0] for task in tasks))
+        for task in tasks:
+            if task[3] == "/api/ab/shared/add":
+                books.append({"name": task[4]["name"], "guid": "g-new"})
+            yield task, None
+
+    monkeypatch.setattr(ab, "load_backup", lambda path: ({"created": "now"}, [book]))
+    monkeypatch.setattr(ab, "view_shared_abs", lambda url, token: list(books))
+    monkeypatch.setattr(ab, "send_requests", send_requests)
+    result = ab.restore_abs("http://console", "token", "backup.zip")
+    assert batches == [["address"], ["tag"], ["peer", "rule"]]
+    assert result == {"added": 4, "updated": 0, "failed": 0}
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+import bulk
+from conftest import load_script
+from stub_server import StubConsole, make_groups
+
+device_groups = load_script("res/device-groups.py")
+
+
+def test_run_parallel_keeps_order():
+    assert bulk.run_parallel(lambda x: x * 2, list(range(10))) == list(range(0, 20, 2))
+
+
+def test_first_failure_stops_the_rest_and_exits_once(capsys):
+    started = []
+    lock = threading.Lock()
+
+    def fn(item):
+        with lock:
+            started.append(item)
+        if item == 0:
+            raise bulk.ApiError("chunk 0 rejected")
+        time.sleep(0.01)
+        return item
+
+    with pytest.raises(SystemExit) as e:
+        bulk.run_parallel(fn, list(range(100)), jobs=1)
+    assert e.value.code == 1
+    assert started[0] == 0 and len(started) < 10
+    out = capsys.readouterr().out
+    assert "Error: chunk 0 rejected" in out
+    assert "1 of 100 requests failed" in out
+
+
+class RejectingConsole(StubConsole):
+    # Rejects every device chunk added to a group
+    def change(self, method, path, body):
+        if method == "POST" and path.startswith("/api/device-groups/"):
+            return 200, {"error": "device not found"}
+        return super().change(method, path, body)
+
+
+def test_add_devices_exits_from_the_main_thread(capsys):
+    console = RejectingConsole({"/api/device-groups": make_groups(1)}).start()
+    try:
+        ids = [str(i) for i in range(bulk.CHUNK_SIZE * 20)]
+        with pytest.raises(SystemExit) as e:
+            device_groups.add_devices(console.url, "token", "group0", ids)
+    finally:
+        console.stop()
+    assert e.value.code == 1
+    posts = [r for r in console.requests if r[0] == "POST"]
+    # The chunks not started when the first one failed were never sent
+    assert len(posts) < 20
+    assert "device not found" in capsys.readouterr().out
@@ -0,0 +1,96 @@
+import http.server
+import json
+import os
+import stat
+import threading
+import urllib.error
+
+import pytest
+
+from conftest import load_script
+
+customize = load_script("customize.py")
+
+ICON = b"\x00\x00\x01\x00icon"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # Serves /icon.ico with a fixed ETag, everything else is a 404. Requests are recorded on the server.
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path != "/icon.ico":
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(ICON)))
+        self.end_headers()
+        self.wfile.write(ICON)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_writes_file_and_etag(server, tmp_path):
+    dest = tmp_path / "icon.ico"
+    status, entry = customize.download_resource(server.url + "/icon.ico", str(dest))
+    assert status == "downloaded"
+    assert dest.read_bytes() == ICON
+    assert entry["etag"] == '"v1"' and entry["size"] == len(ICON)
+    # The mode open() gives a new file under the current umask, not the 0600 of mkstemp
+    reference = tmp_path / "reference"
+    reference.write_bytes(b"")
+    assert stat.S_IMODE(os.stat(dest).st_mode) == stat.S_IMODE(os.stat(reference).st_mode)
+
+
+def test_revalidation_sends_etag_and_keeps_file(server, tmp_path):
+    dest = tmp_path / "icon.ico"
+    url = server.url + "/icon.ico"
+    _, entry = customize.download_resource(url, str(dest))
+    dest.write_bytes(b"local copy")
+
+    status, revalidated = customize.download_resource(url, str(dest), entry)
+    assert status == "not-modified"
+    assert server.requests[-1] == ("/icon.ico", '"v1"')
+    assert dest.read_bytes() == b"local copy"
+    assert revalidated["checked"] >= entry["checked"]
+
+    # A fresh cache entry doesn't touch the network at all
+    count = len(server.requests)
+    assert customize.download_resource(url, str(dest), revalidated, max_age=3600)[0] == "cached"
+    # Nor does any cached copy with -1, the command line default
+    assert customize.download_resource(url, str(dest), dict(revalidated, checked=0), max_age=-1)[0] == "cached"
+    assert len(server.requests) == count
+
+
+def test_failed_fetch_keeps_previous_resource(server, tmp_path):
+    dest = tmp_path / "logo.png"
+    dest.write_bytes(b"previous")
+    with pytest.raises(urllib.error.HTTPError):
+        customize.download_resource(server.url + "/missing.png", str(dest))
+    assert dest.read_bytes() == b"previous"
+    assert [p.name for p in tmp_path.iterdir()] == ["logo.png"]
+
+    ok = customize.download_resources({"icon.ico": server.url + "/icon.ico", "logo.png": server.url + "/missing.png"},
+                                      str(tmp_path))
+    assert not ok
+    cache = json.loads((tmp_path / customize.DOWNLOAD_CACHE_FILE).read_text())
+    assert list(cache) == ["icon.ico"]
+    with pytest.raises(SystemExit):
+        customize.download_resources({"logo.png": server.url + "/missing.png"}, str(tmp_path), strict=True)
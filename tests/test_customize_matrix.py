@@ -0,0 +1,74 @@
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, load_script
+
+matrix = load_script("customize_matrix.py")
+
+CONFIG_RS = """\
+lazy_static::lazy_static! {
+    pub static ref HARD_SETTINGS: RwLock<HashMap<String, String>> = Default::default();
+}
+"""
+
+
+def git(cwd, *args):
+    subprocess.check_call(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], cwd=cwd,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def worktree(tmp_path):
+    # A minimal checkout: config.rs and the tracked resource destinations of the real tree
+    path = tmp_path / "worktree"
+    config_rs = path / "libs" / "hbb_common" / "src" / "config.rs"
+    config_rs.parent.mkdir(parents=True)
+    config_rs.write_text(CONFIG_RS)
+    for dest in ["res/icon.ico", "res/logo.svg"]:
+        (path / dest).parent.mkdir(parents=True, exist_ok=True)
+        (path / dest).write_bytes(b"original " + dest.encode())
+    git(path, "init", "-q")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "base")
+    return path
+
+
+def test_password_stays_out_of_matrix_log(worktree, tmp_path):
+    variant = {"name": "acme", "app_name": "Acme", "server_url": "rs.example.com", "server_key": "key",
+               "permanent_password": "s3cr3t"}
+    report = matrix.build_variant(ROOT, str(tmp_path / "out"), str(worktree), variant, {"build_command": ""}, False)
+    assert report["status"] == "ok"
+    # The password did reach the source, but not the log
+    assert "s3cr3t" in (worktree / "libs" / "hbb_common" / "src" / "config.rs").read_text()
+    log = (tmp_path / "out" / "variants" / "acme" / "matrix.log").read_text()
+    assert "HARD_SETTINGS" in log
+    assert "s3cr3t" not in log
+
+
+def test_run_masks_secrets_in_output(tmp_path):
+    log_path = str(tmp_path / "matrix.log")
+    code = matrix.run([sys.executable, "-c", "print('password is s3cr3t'); exit(3)"], str(tmp_path), log_path,
+                      secrets=["s3cr3t"])
+    assert code == 3
+    with open(log_path, encoding="utf-8") as f:
+        assert f.read().splitlines()[-1] == "password is ***"
+
+
+def test_reset_restores_tracked_and_removes_untracked_resources(worktree, tmp_path):
+    (worktree / "res" / "icon.ico").write_bytes(b"previous variant")
+    logo_png = worktree / "flutter" / "assets" / "logo.png"
+    logo_png.parent.mkdir(parents=True)
+    logo_png.write_bytes(b"previous variant")
+    assert matrix.reset_resources(str(worktree), str(tmp_path / "matrix.log"))
+    assert (worktree / "res" / "icon.ico").read_bytes() == b"original res/icon.ico"
+    assert not logo_png.exists()
+
+
+def test_failed_reset_fails_the_variant(tmp_path):
+    not_a_repo = tmp_path / "worktree"
+    not_a_repo.mkdir()
+    variant = {"name": "acme", "app_name": "Acme", "server_url": "rs.example.com", "server_key": "key"}
+    report = matrix.build_variant(ROOT, str(tmp_path / "out"), str(not_a_repo), variant, {"build_command": ""}, False)
+    assert report["status"] == "reset failed"
@@ -0,0 +1,37 @@
+import io
+
+import pytest
+import requests
+
+import instrument
+from stub_server import StubConsole
+
+
+@pytest.fixture
+def console():
+    console = StubConsole({"/api/users": []}).start()
+    yield console
+    console.stop()
+
+
+@pytest.fixture
+def recorder():
+    recorder = instrument.install(instrument.Recorder())
+    yield recorder
+    instrument.uninstall()
+
+
+def test_streamed_body_is_recorded_without_size(console, recorder):
+    response = requests.post(f"{console.url}/api/users", data=io.BytesIO(b'{"name": "a"}'))
+    assert response.status_code == 200
+    endpoint = recorder.summary()["endpoints"]["POST /api/users"]
+    assert endpoint["count"] == 1 and endpoint["bytes_out"] == 0
+
+
+def test_recording_failure_does_not_break_the_request(console, recorder, monkeypatch, capsys):
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(recorder, "record", fail)
+    assert requests.get(f"{console.url}/api/users").status_code == 200
+    assert "boom" in capsys.readouterr().err
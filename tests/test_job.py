@@ -0,0 +1,42 @@
+import logging
+import sys
+
+import pytest
+
+from conftest import load_script
+
+job = load_script("res/job.py")
+
+
+@pytest.fixture
+def dist(tmp_path):
+    # Two identical dlls share one upload, the exe is signed on its own
+    for name, content in [("a.dll", b"dll"), ("b.dll", b"dll"), ("app.exe", b"exe"), ("readme.txt", b"txt")]:
+        (tmp_path / name).write_bytes(content)
+    return tmp_path
+
+
+def test_sign_files_signs_each_unique_file_once(dist, monkeypatch):
+    signed = []
+
+    def sign_one_file(file_path):
+        signed.append(file_path)
+        with open(file_path, "ab") as f:
+            f.write(b"+sig")
+        return True
+
+    monkeypatch.setattr(job, "sign_one_file", sign_one_file)
+    assert job.sign_files(str(dist))
+    assert len(signed) == 2
+    assert (dist / "a.dll").read_bytes() == (dist / "b.dll").read_bytes() == b"dll+sig"
+    assert (dist / "readme.txt").read_bytes() == b"txt"
+
+
+def test_sign_failure_exits_non_zero_without_summary(dist, monkeypatch, caplog):
+    monkeypatch.setattr(job, "sign_one_file", lambda file_path: False)
+    monkeypatch.setattr(sys, "argv", ["job.py", "sign_files", str(dist)])
+    with caplog.at_level(logging.INFO), pytest.raises(SystemExit) as e:
+        job.main()
+    assert e.value.code == 1
+    assert "Failed to sign" in caplog.text
+    assert "unique files" not in caplog.text
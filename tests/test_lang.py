@@ -0,0 +1,145 @@
+import glob
+import os
+import random
+import shutil
+
+import pytest
+
+from conftest import ROOT, load_script
+
+lang = load_script("res/lang.py")
+
+
+def test_parse_entries():
+    text = (
+        'lazy_static::lazy_static! {\n'
+        '    [\n'
+        '        ("Status", "Estado"),\n'
+        '        ("quote", "say \\"hi\\""),\n'
+        '\t("path", "C:\\\\dir\\n"),\n'
+        '        ("last", "no comma")\n'
+        '    ].iter().cloned().collect();\n'
+        '}\n'
+    )
+    entries = lang.parse_entries(text)
+    assert [(k, v) for k, v, _, _ in entries] == [
+        ("Status", "Estado"),
+        ("quote", 'say \\"hi\\"'),
+        ("path", "C:\\\\dir\\n"),
+        ("last", "no comma"),
+    ]
+    # The offsets point at the value as written in the source
+    for _, value, start, end in entries:
+        assert text[start:end] == value
+
+
+@pytest.mark.parametrize("line", [
+    '        ("key", "bare " quote"),',
+    '        ("key", "trailing backslash \\"),',
+    '        ("key" "missing comma"),',
+])
+def test_parse_entries_reports_invalid_lines(line):
+    text = '    [\n        ("ok", "fine"),\n%s\n    ]\n' % line
+    with pytest.raises(ValueError, match=r"test\.rs:3: invalid translation entry"):
+        lang.parse_entries(text, "test.rs")
+
+
+@pytest.mark.parametrize("value, escaped", [
+    ('say "hi"', 'say \\"hi\\"'),
+    ('C:\\dir', 'C:\\\\dir'),
+    ('two\nlines', 'two\\nlines'),
+    # Escape sequences already present are kept as they are
+    ('kept \\n \\" \\\\ \\u{20ac}', 'kept \\n \\" \\\\ \\u{20ac}'),
+    ('trailing \\', 'trailing \\\\'),
+])
+def test_escape_literal(value, escaped):
+    assert lang.escape_literal(value) == escaped
+
+
+def test_escape_round_trip_fuzz():
+    rng = random.Random(0)
+    alphabet = 'ab "\\\n\r\t\0{}u€ñ'
+    for _ in range(2000):
+        s = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        body = lang.rust_escape(s)
+        assert lang.unescape_literal(body) == s
+        # A valid literal body is left alone, and parses back as one entry
+        assert lang.escape_literal(body) == body
+        entries = lang.parse_entries('        ("k", "%s"),\n' % body)
+        assert [v for _, v, _, _ in entries] == [body]
+        # Any raw string escapes to a body which parses as one entry
+        raw = lang.escape_literal(s)
+        assert len(lang.parse_entries('        ("k", "%s"),\n' % raw)) == 1
+
+
+def test_csv_round_trip_reproduces_sources(tmp_path, monkeypatch):
+    sources = sorted(glob.glob(os.path.join(ROOT, "src", "lang", "*.rs")))
+    assert sources
+    shutil.copytree(os.path.join(ROOT, "src", "lang"), tmp_path / "src" / "lang")
+    monkeypatch.chdir(tmp_path)
+    lang.to_csv()
+    for fn in sources:
+        name = os.path.basename(fn)[:-3]
+        # to_rs reads <lang>.csv from the current directory
+        shutil.copy(tmp_path / "src" / "lang" / ("%s.csv" % name), tmp_path / ("%s.csv" % name))
+        lang.to_rs(name)
+        with open(fn, "rb") as original, open(tmp_path / "src" / "lang" / ("%s.rs" % name), "rb") as written:
+            assert written.read() == original.read(), name
+
+
+@pytest.fixture
+def lang_tree(tmp_path, monkeypatch):
+    # lang.py works on ./src/lang, expand a copy of the real files
+    shutil.copytree(os.path.join(ROOT, "src", "lang"), tmp_path / "src" / "lang")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "src" / "lang"
+
+
+def expand_one_by_one():
+    # What expand() did before the template was shared: parse template.rs for each language
+    out = {}
+    for name in lang.get_langs():
+        translations = lang.get_lang(name)
+        with open('./src/lang/template.rs', encoding='utf8') as f:
+            text = f.read()
+        pos = 0
+        chunks = []
+        for k, _, start, end in lang.parse_entries(text):
+            chunks.append(text[pos:start])
+            chunks.append(translations.get(k, ''))
+            pos = end
+        chunks.append(text[pos:])
+        out[name] = ''.join(chunks)
+    return out
+
+
+def test_template_is_parsed_once_and_reproduces_itself(lang_tree):
+    template = lang.parse_template()
+    translations = lang.get_lang("template")
+    text = ''.join(translations[c[0]] if isinstance(c, tuple) else c for c in template)
+    assert text == (lang_tree / "template.rs").read_text(encoding="utf8")
+
+
+@pytest.mark.parametrize("cpus", [1, 2], ids=["sequential", "process-pool"])
+def test_shared_template_matches_per_language_parse(cpus, lang_tree, monkeypatch, capsys):
+    for fn in lang_tree.glob("*.rs"):
+        if fn.stem not in ("en", "template"):
+            # Drop the last entry so every language needs rewriting
+            text = fn.read_text(encoding="utf8")
+            fn.write_text(text[:text.rindex("        (")] + text[text.rindex("\n    ]"):], encoding="utf8")
+    expected = expand_one_by_one()
+    monkeypatch.setattr(lang.os, "cpu_count", lambda: cpus)
+    lang.expand()
+    assert {name: (lang_tree / ("%s.rs" % name)).read_text(encoding="utf8") for name in expected} == expected
+    assert "%d changed" % len(expected) in capsys.readouterr().out
+
+
+def test_unchanged_languages_are_not_written(lang_tree, monkeypatch, capsys):
+    monkeypatch.setattr(lang.os, "cpu_count", lambda: 1)
+    lang.expand()
+    capsys.readouterr()
+    for fn in lang_tree.glob("*.rs"):
+        os.utime(fn, ns=(0, 0))
+    lang.expand()
+    assert all(fn.stat().st_mtime_ns == 0 for fn in lang_tree.glob("*.rs"))
+    assert " 0 changed" in capsys.readouterr().out
@@ -0,0 +1,49 @@
+from conftest import load_script
+
+reconcile = load_script("res/reconcile.py")
+
+
+def current_state():
+    return {
+        "user_groups": [{"guid": "ug1", "name": "eng"}, {"guid": "ug2", "name": "ops"}],
+        "device_groups": [{"guid": "dg1", "name": "lab"}, {"guid": "dg2", "name": "office"}],
+        "users": [],
+        "devices": [],
+        "strategies": [],
+        "address_books": [],
+        "ab_rules": {},
+    }
+
+
+def deletes(actions):
+    return sorted(a["path"] for a in actions if a["method"] == "DELETE")
+
+
+def test_prune_only_touches_kinds_in_the_file():
+    # The file manages user groups only, the device groups must survive the prune.
+    actions, errors = reconcile.make_plan({"user_groups": [{"name": "eng"}], "prune": True}, current_state())
+    assert errors == []
+    assert deletes(actions) == ["/api/user-groups/ug2"]
+
+
+def test_prune_with_an_explicit_empty_list_deletes_that_kind():
+    actions, _ = reconcile.make_plan({"device_groups": [], "prune": True}, current_state())
+    assert deletes(actions) == ["/api/device-groups/dg1", "/api/device-groups/dg2"]
+
+
+def test_no_prune_deletes_nothing():
+    actions, _ = reconcile.make_plan({"user_groups": [], "device_groups": []}, current_state())
+    assert deletes(actions) == []
+
+
+def test_rules_naming_a_new_group_wait_for_it():
+    desired = {"user_groups": [{"name": "eng", "note": "n", "access_to": [{"type": 0, "name": "newops"}]},
+                               {"name": "newops"}]}
+    actions, errors = reconcile.make_plan(desired, current_state())
+    assert errors == []
+    plan = sorted((a["phase"], a["method"], a["path"], sorted(a["payload"])) for a in actions)
+    assert plan == [
+        (1, "PATCH", "/api/user-groups/ug1", ["note"]),
+        (1, "POST", "/api/user-groups", ["name"]),
+        (2, "PATCH", "/api/user-groups/ug1", ["allowed_outgoings"]),
+    ]
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from conftest import load_script
+from stub_server import StubConsole, make_devices, make_groups, make_users
+
+snapshot = load_script("res/snapshot.py")
+
+
+class FailingConsole(StubConsole):
+    # Answers one page of /api/devices with a 500 while `failing` is set
+    failing = False
+
+    def respond(self, method, path, query, body):
+        if self.failing and path == "/api/devices" and query.get("current") == "3":
+            return 500, {"error": "internal error"}
+        return super().respond(method, path, query, body)
+
+
+@pytest.fixture
+def console():
+    console = FailingConsole({
+        "/api/devices": make_devices(350),
+        "/api/users": make_users(20),
+        "/api/user-groups": make_groups(3),
+        "/api/device-groups": make_groups(3),
+        "/api/ab/shared/profiles": [],
+        "/api/strategies": [],
+    }).start()
+    yield console
+    console.stop()
+
+
+def device_count(db):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute("select count(*) from devices").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_failed_page_aborts_the_pull(console, tmp_path):
+    console.failing = True
+    db = str(tmp_path / "tenant.db")
+    with pytest.raises(snapshot.ApiError):
+        snapshot.pull(console.url, "token", db, jobs=2)
+    assert not (tmp_path / "tenant.db").exists()
+    assert not (tmp_path / "tenant.db.tmp").exists()
+
+
+def test_failed_page_leaves_the_snapshot_unchanged_on_refresh(console, tmp_path):
+    db = str(tmp_path / "tenant.db")
+    snapshot.pull(console.url, "token", db, jobs=2)
+    assert device_count(db) == 350
+    del console.data["/api/devices"][:10]
+    console.failing = True
+    with pytest.raises(snapshot.ApiError):
+        snapshot.refresh(console.url, "token", db, jobs=2)
+    assert device_count(db) == 350
+
+
+def test_main_exits_once_on_failure(console, tmp_path, monkeypatch, capsys):
+    console.failing = True
+    db = str(tmp_path / "tenant.db")
+    monkeypatch.setattr("sys.argv", ["snapshot.py", "pull", "--url", console.url, "--token", "t", "--db", db])
+    with pytest.raises(SystemExit) as e:
+        snapshot.main()
+    assert e.value.code == 1
+    assert "was not changed" in capsys.readouterr().out
@@ -0,0 +1,72 @@
+import csv
+import json
+
+import pytest
+
+from conftest import load_script
+from stub_server import StubConsole, make_groups
+
+users = load_script("res/users.py")
+
+
+class FlakyConsole(StubConsole):
+    # Creates the user, then answers the first POST for each name in `flaky` with a 502 like a
+    # proxy timing out. Creating an existing name fails like the real console.
+    def __init__(self, data, flaky):
+        super().__init__(data)
+        self.flaky = set(flaky)
+
+    def change(self, method, path, body):
+        if method == "POST" and path == "/api/users":
+            user = json.loads(body)
+            with self.lock:
+                if any(u["name"] == user["name"] for u in self.data[path]):
+                    return 200, {"error": "user already exists"}
+                self.data[path].append(dict(user, guid="created-%d" % len(self.requests)))
+                if user["name"] in self.flaky:
+                    self.flaky.discard(user["name"])
+                    return 502, {"error": "bad gateway"}
+            return 200, {}
+        return super().change(method, path, body)
+
+
+@pytest.fixture
+def console(monkeypatch):
+    monkeypatch.setattr(users.time, "sleep", lambda seconds: None)
+    console = FlakyConsole({"/api/user-groups": make_groups(1), "/api/users": [{"name": "taken"}]}, ["flaky"]).start()
+    yield console
+    console.stop()
+
+
+def write_users(path, names):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "password", "group_name"])
+        writer.writerows([name, "secret", "group0"] for name in names)
+
+
+def test_retried_create_that_already_succeeded_is_created(console, tmp_path):
+    path = str(tmp_path / "users.csv")
+    write_users(path, ["flaky", "plain"])
+    counts = users.bulk_create(console.url, "token", path, jobs=1)
+    assert counts == {"created": 2, "invited": 0, "failed": 0}
+    with open(path + ".outcome.csv", encoding="utf-8") as f:
+        assert {row["name"]: row["status"] for row in csv.DictReader(f)} == {"flaky": "created", "plain": "created"}
+
+
+def test_existing_user_still_fails_without_retry(console, tmp_path):
+    path = str(tmp_path / "users.csv")
+    write_users(path, ["taken"])
+    counts = users.bulk_create(console.url, "token", path, jobs=1)
+    assert counts["failed"] == 1
+    # The first answer was final, no lookup was made
+    assert [r[:2] for r in console.requests if r[1] == "/api/users"] == [("POST", "/api/users")]
+
+
+@pytest.mark.parametrize("option", [["--chunk-size", "0"], ["--chunk-size", "-1"], ["--jobs", "0"]])
+def test_counts_below_one_are_rejected(option, monkeypatch, capsys):
+    monkeypatch.setattr("sys.argv", ["users.py", "force-logout", "--url", "http://console", "--token", "t", *option])
+    with pytest.raises(SystemExit) as e:
+        users.main()
+    assert e.value.code == 2
+    assert "must be at least 1" in capsys.readouterr().err